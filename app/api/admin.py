@@ -0,0 +1,117 @@
+"""Admin endpoints for the CroceRossa Qdrant Cloud API: query profiles and memory diagnostics.
+
+Every endpoint requires the ``X-Admin-Token`` header equal to ADMIN_TOKEN; with
+no ADMIN_TOKEN configured the endpoints do not exist (404). The same token
+authorizes the ``X-Profile`` header of ``POST /api/query``.
+"""
+
+import hmac
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.profiling import measure_memory, request_profiler, tracemalloc_session
+from app.rag.cache import all_caches
+
+logger = get_logger(__name__)
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """Return whether a token is the configured admin token."""
+    if not settings.ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode())
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Dependency rejecting the requests without the admin token."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token_valid(x_admin_token):
+        logger.warning("Rejected admin request with missing or invalid token")
+        raise HTTPException(status_code=403, detail="Token di amministrazione non valido")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+def _stores() -> Dict[str, Any]:
+    """Return the long-lived structures whose memory is reported: session store and caches."""
+    # Import differito: il router delle query importa questo modulo
+    from app.api.router import session_memories
+
+    stores: Dict[str, Any] = {"sessions": session_memories}
+    for cache in all_caches():
+        name = f"cache:{cache.name}"
+        stores[name if name not in stores else f"{name}:{id(cache)}"] = cache
+    return stores
+
+
+def _memory_report() -> Dict[str, Any]:
+    """Measure every store."""
+    return {name: measure_memory(store) for name, store in _stores().items()}
+
+
+@router.get("/memory")
+async def memory():
+    """Report the objects and bytes held by the session store and by each cache."""
+    return {"tracemalloc": tracemalloc_session.status(), "stores": await run_in_threadpool(_memory_report)}
+
+
+@router.get("/tracemalloc")
+async def tracemalloc_status():
+    """Return whether tracemalloc is tracing and the memory it traced."""
+    return tracemalloc_session.status()
+
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(frames: Optional[int] = None):
+    """Start tracing allocations; every allocation is slower until tracing stops."""
+    return tracemalloc_session.start(frames)
+
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop():
+    """Stop tracing allocations."""
+    return tracemalloc_session.stop()
+
+
+@router.post("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(top: Optional[int] = None):
+    """Dump a tracemalloc snapshot and report the top allocation sites, their growth and the stores."""
+    try:
+        return await run_in_threadpool(tracemalloc_session.snapshot, _stores(), top)
+    except RuntimeError:
+        raise HTTPException(status_code=409, detail="tracemalloc non è attivo: avvialo con /api/admin/tracemalloc/start")
+
+
+@router.get("/profiles")
+async def profiles():
+    """List the saved query profiles, newest first, with their stage timings."""
+    summaries: List[Dict[str, Any]] = []
+    for name in reversed(request_profiler.list_profiles()):
+        try:
+            with open(os.path.join(request_profiler.directory, name), "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            continue
+        metadata.pop("top_functions", None)
+        summaries.append(dict(metadata, file=name))
+    return {"profiles": summaries}
+
+
+@router.get("/profiles/{name}")
+async def profile_file(name: str):
+    """Download a saved profile, its metadata or a tracemalloc snapshot."""
+    path = os.path.join(request_profiler.directory, os.path.basename(name))
+    if os.path.basename(name) != name or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profilo non trovato")
+    return FileResponse(path, filename=name)
@@ -0,0 +1,169 @@
+"""Cached, precompressed frontend assets for the CroceRossa Qdrant Cloud application.
+
+``index.html`` and the files under ``static/`` are read once at startup and
+kept in memory together with their gzip and brotli variants, compressed at
+the highest level (``brotli`` is in requirements.txt; an install without it
+serves gzip only). Requests never
+touch the filesystem: the encoding is negotiated from ``Accept-Encoding``,
+every response carries ``ETag``, ``Cache-Control`` and ``Vary`` headers, and a
+matching ``If-None-Match`` is answered with an empty 304.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Dict, Optional, Set
+
+from fastapi import Request, Response
+
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+metrics.describe("cri_asset_responses_total", "counter", "Frontend asset responses, by status and content encoding")
+
+# Tipi già compressi (immagini, font woff) non guadagnano nulla da gzip/brotli
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+MIN_COMPRESS_SIZE = 256
+
+
+@dataclass
+class Asset:
+    """An in-memory file with its precompressed variants."""
+
+    media_type: str
+    body: bytes
+    etag: str
+    last_modified: str
+    cache_control: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Return the strong ETag of a representation (each encoding has its own)."""
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    """Return the content codings accepted by an ``Accept-Encoding`` header (q=0 excluded)."""
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(header: str, asset: Asset) -> bool:
+    """Return whether an ``If-None-Match`` header matches any representation of the asset."""
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return any(asset.etag_for(encoding) in tags for encoding in (None, *asset.encoded))
+
+
+class AssetStore:
+    """Frontend files loaded at startup and served from memory."""
+
+    def __init__(self):
+        """Initialize an empty store."""
+        self._assets: Dict[str, Asset] = {}
+
+    def __len__(self) -> int:
+        """Return the number of assets."""
+        return len(self._assets)
+
+    def load_file(self, url_path: str, file_path: str, cache_control: str) -> Optional[Asset]:
+        """Read a file and its precompressed variants into the store under ``url_path``.
+
+        Returns None (and logs) when the file cannot be read.
+        """
+        try:
+            with open(file_path, "rb") as f:
+                body = f.read()
+            mtime = os.path.getmtime(file_path)
+        except OSError as e:
+            logger.error(f"Could not load frontend asset {file_path}: {str(e)}")
+            return None
+
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        asset = Asset(
+            media_type=media_type,
+            body=body,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            last_modified=formatdate(mtime, usegmt=True),
+            cache_control=cache_control,
+        )
+        if len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE_TYPES):
+            # Compressione una tantum al massimo livello: il costo è all'avvio, non per richiesta
+            variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if BROTLI_AVAILABLE:
+                variants["br"] = brotli.compress(body, quality=11)
+            asset.encoded = {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+        self._assets[url_path] = asset
+        return asset
+
+    def load_directory(self, directory: str, prefix: str, cache_control: str) -> int:
+        """Load every file under a directory, served as ``prefix/<relative path>``; return the count."""
+        loaded = 0
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                relative = os.path.relpath(file_path, directory).replace(os.sep, "/")
+                if self.load_file(f"{prefix}/{relative}", file_path, cache_control) is not None:
+                    loaded += 1
+        logger.info(f"Loaded {loaded} static assets from '{directory}'")
+        return loaded
+
+    def get(self, url_path: str) -> Optional[Asset]:
+        """Return the asset served at a path, if any."""
+        return self._assets.get(url_path)
+
+    def respond(self, request: Request, asset: Asset) -> Response:
+        """Build the response for an asset: best accepted encoding, or 304 if the client copy is current."""
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in asset.encoded and e in accepted), None)
+        headers = {
+            "ETag": asset.etag_for(encoding),
+            "Cache-Control": asset.cache_control,
+            "Last-Modified": asset.last_modified,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, asset):
+            metrics.inc("cri_asset_responses_total", status="304", encoding=encoding or "identity")
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        body = asset.encoded[encoding] if encoding else asset.body
+        metrics.inc("cri_asset_responses_total", status="200", encoding=encoding or "identity")
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, headers=headers, media_type=asset.media_type)
+        return Response(content=body, headers=headers, media_type=asset.media_type)
+
+
+asset_store = AssetStore()
@@ -0,0 +1,110 @@
+"""Request coalescing and idempotent replays for the CroceRossa Qdrant Cloud API.
+
+Identical queries in flight at the same time share a single RAG pipeline
+execution (single-flight): the same question from the same session (double
+click, client retry after a timeout) or the same standalone question, without
+conversation history, from different sessions. Completed responses of requests
+carrying an ``idempotency_key`` are kept for IDEMPOTENCY_TTL seconds and
+replayed to retries.
+"""
+
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+from app.rag.cache import VersionedCache
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_coalesced_requests_total", "counter", "Queries served by joining an identical in-flight query, by key kind")
+metrics.describe("cri_idempotent_replays_total", "counter", "Queries answered from the idempotency replay cache")
+
+T = TypeVar("T")
+
+# Le risposte idempotenti non dipendono dalla versione della collection
+REPLAY_VERSION = "replay"
+
+
+class SingleFlight:
+    """Deduplicates concurrent executions of the same work on the event loop."""
+
+    def __init__(self):
+        """Initialize with no work in flight."""
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    def __len__(self) -> int:
+        """Return the number of executions in flight."""
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run ``fn`` unless an execution for ``key`` is already in flight, then share its result.
+
+        The execution runs in its own task, so a caller that disconnects does not
+        cancel it for the others.
+
+        Returns:
+            The result and True for the caller that started the execution
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.inc("cri_coalesced_requests_total", kind=key[0] if isinstance(key, tuple) else "other")
+            return await asyncio.shield(task), False
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task), True
+
+    def _done(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        """Forget a completed execution."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita il warning "exception was never retrieved" se tutti i chiamanti si sono disconnessi
+        if not task.cancelled():
+            task.exception()
+
+
+def normalize_question(question: str) -> str:
+    """Normalize whitespace and case so that trivially different questions coalesce."""
+    return " ".join(question.split()).casefold()
+
+
+def coalescing_key(question: str,
+                   session_id: Optional[str],
+                   has_history: bool,
+                   scope: Optional[Dict[str, Any]],
+                   include_prompt: bool) -> Tuple[str, ...]:
+    """Return the key identifying identical queries.
+
+    A question without conversation history does not depend on the session, so
+    it is shared across sessions; a follow-up is only shared within its session.
+    """
+    scope_key = json.dumps(scope or {}, sort_keys=True, default=str)
+    question_key = normalize_question(question)
+    if has_history and session_id:
+        return ("session", session_id, question_key, scope_key, str(include_prompt))
+    return ("standalone", question_key, scope_key, str(include_prompt))
+
+
+query_flight = SingleFlight()
+replay_cache = VersionedCache("idempotency", settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_TTL,
+                              invalidate_on_swap=False)
+
+
+def get_replay(session_id: Optional[str], idempotency_key: str) -> Optional[Dict[str, Any]]:
+    """Return the stored response of a completed idempotent request."""
+    result = replay_cache.get((session_id, idempotency_key), REPLAY_VERSION)
+    if result is not None:
+        metrics.inc("cri_idempotent_replays_total")
+        logger.info("Replaying idempotent response", idempotency_key=idempotency_key)
+    return result
+
+
+def store_replay(session_id: Optional[str], idempotency_key: str, result: Dict[str, Any]) -> None:
+    """Store the response of a completed idempotent request (errors are not stored)."""
+    if result.get("error"):
+        return
+    replay_cache.set((session_id, idempotency_key), result, REPLAY_VERSION)
@@ -0,0 +1,46 @@
+"""On-demand debug artifacts for the CroceRossa Qdrant Cloud API.
+
+Query responses carry only the answer and compact source references. The full
+RAG prompt and the full text of the chunks used for the answer are kept in a
+bounded in-memory store, keyed by the ``request_id`` returned with the answer,
+and fetched from ``GET /api/debug/{request_id}`` only when someone needs them.
+"""
+
+import uuid
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.rag.cache import VersionedCache
+
+logger = get_logger(__name__)
+
+# Gli artefatti descrivono una risposta già data: non dipendono dalla versione della collection
+DEBUG_VERSION = "debug"
+
+debug_store = VersionedCache("debug", settings.DEBUG_STORE_SIZE, settings.DEBUG_STORE_TTL, invalidate_on_swap=False)
+
+
+def new_request_id() -> str:
+    """Return a new, unguessable request identifier."""
+    return uuid.uuid4().hex
+
+
+def attach_request_id(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of an engine result with a request ID, storing its debug artifacts under that ID.
+
+    The engine result may be shared by coalesced requests: each of them gets its
+    own ID, pointing to the same artifacts.
+    """
+    response = dict(result)
+    artifacts = response.pop("debug", None)
+    response["request_id"] = new_request_id()
+    if artifacts is not None:
+        artifacts = dict(artifacts, condensed_question=response.get("condensed_question"))
+        debug_store.set(response["request_id"], artifacts, DEBUG_VERSION)
+    return response
+
+
+def get_debug(request_id: str) -> Optional[Dict[str, Any]]:
+    """Return the debug artifacts of a recent request, or None if unknown or expired."""
+    return debug_store.get(request_id, DEBUG_VERSION)
@@ -1,9 +1,31 @@
 """Pydantic models for the CroceRossa Qdrant Cloud API."""
 
+from datetime import date
 from typing import Dict, List, Optional, Any
 from pydantic import BaseModel, Field
 
 
+class QueryScope(BaseModel):
+    """Optional scope restricting a query to a slice of the document collection."""
+    
+    sources: Optional[List[str]] = Field(None, description="Document sources (file names) to search")
+    document_types: Optional[List[str]] = Field(None, description="Document types, e.g. regolamento, circolare")
+    committees: Optional[List[str]] = Field(None, description="Committees the documents belong to")
+    date_from: Optional[date] = Field(None, description="Only documents dated on or after this day")
+    date_to: Optional[date] = Field(None, description="Only documents dated on or before this day")
+    collections: Optional[List[str]] = Field(None, description="Collections to search, bypassing the collection router")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "document_types": ["regolamento"],
+                "committees": ["Comitato di Roma"],
+                "date_from": "2024-01-01",
+                "date_to": "2024-12-31"
+            }
+        }
+
+
 class QueryRequest(BaseModel):
     """Request model for the /query endpoint."""
     
@@ -17,12 +39,23 @@ class QueryRequest(BaseModel):
         False,
         description="Whether to include the full prompt in the response"
     )
+    scope: Optional[QueryScope] = Field(
+        None,
+        description="Optional scope (source, document type, committee, date range) for the search"
+    )
+    idempotency_key: Optional[str] = Field(
+        None,
+        max_length=128,
+        description="Optional client-generated key; retries with the same key replay the completed response"
+    )
     
     class Config:
         json_schema_extra = {
             "example": {
                 "query": "Come posso diventare volontario della Croce Rossa?",
-                "session_id": "user_123456"
+                "session_id": "user_123456",
+                "scope": {"document_types": ["regolamento"]},
+                "idempotency_key": "4f6c2a9e-8b1d-4c3e-9a57-1e2f3d4c5b6a"
             }
         }
 
@@ -31,9 +64,13 @@ class QueryResponse(BaseModel):
     """Response model for the /query endpoint."""
     
     answer: str = Field(..., description="The assistant's response")
+    request_id: Optional[str] = Field(
+        None,
+        description="Request identifier; full prompt and chunk texts are available at /api/debug/{request_id}"
+    )
     source_documents: List[Dict[str, Any]] = Field(
         default_factory=list, 
-        description="List of source documents used to generate the answer"
+        description="Compact references (id, score, preview, metadata) of the chunks used to generate the answer"
     )
     condensed_question: Optional[str] = Field(
         None, 
@@ -43,18 +80,59 @@ class QueryResponse(BaseModel):
         None,
         description="The full prompt used to generate the answer"
     )
+    metadata: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Processing metadata: latency budget, elapsed time, stages degraded to meet the budget and answering model"
+    )
     
     class Config:
         json_schema_extra = {
             "example": {
                 "answer": "Per diventare volontario della Croce Rossa Italiana devi...",
+                "request_id": "9b2f4c1e7a8d4e6f8c3b5a1d2e4f6a8b",
                 "source_documents": [
                     {
-                        "text": "Il percorso per diventare Volontario CRI prevede la frequenza...",
+                        "id": "1c9e6a52-3f0b-5d7e-9a41-8b2c7d6e5f40",
+                        "score": 0.8734,
+                        "preview": "Il percorso per diventare Volontario CRI prevede la frequenza...",
                         "metadata": {"source": "regolamento_volontari.pdf", "page": 12}
                     }
                 ],
-                "condensed_question": "Quali sono i requisiti e le procedure per diventare volontario della Croce Rossa Italiana?"
+                "condensed_question": "Quali sono i requisiti e le procedure per diventare volontario della Croce Rossa Italiana?",
+                "metadata": {"budget_ms": 12000, "elapsed_ms": 4210, "degradations": [], "model": "gpt-4.1-mini"}
+            }
+        }
+
+
+class DebugResponse(BaseModel):
+    """Response model for the /debug/{request_id} endpoint."""
+    
+    request_id: str = Field(..., description="Identifier returned with the query response")
+    condensed_question: Optional[str] = Field(None, description="The question used for retrieval")
+    full_prompt: Optional[str] = Field(None, description="The full prompt used to generate the answer")
+    source_documents: List[Dict[str, Any]] = Field(
+        default_factory=list,
+        description="Chunks used to generate the answer, with full text, score and metadata"
+    )
+    routing_cues: List[str] = Field(
+        default_factory=list,
+        description="Complexity cues that sent the answer to the large model"
+    )
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "request_id": "9b2f4c1e7a8d4e6f8c3b5a1d2e4f6a8b",
+                "condensed_question": "Come posso diventare volontario della Croce Rossa?",
+                "full_prompt": "Sei un assistente della Croce Rossa Italiana...",
+                "source_documents": [
+                    {
+                        "id": "1c9e6a52-3f0b-5d7e-9a41-8b2c7d6e5f40",
+                        "score": 0.8734,
+                        "text": "Il percorso per diventare Volontario CRI prevede la frequenza del corso base...",
+                        "metadata": {"source": "regolamento_volontari.pdf", "page": 12}
+                    }
+                ]
             }
         }
 
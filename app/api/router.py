@@ -1,18 +1,29 @@
 """API router for the CroceRossa Qdrant Cloud application."""
 
-from fastapi import APIRouter, Depends, HTTPException, Body
-from typing import Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from functools import partial
+from typing import Dict, Optional
 
+from app.api.admin import ADMIN_TOKEN_HEADER, admin_token_valid
+from app.api.coalescing import coalescing_key, get_replay, query_flight, store_replay
+from app.api.debug import attach_request_id, get_debug
+from app.core.admission import OverloadedError, admission_controller, client_key, rate_limiter
+from app.core.circuit import CircuitOpenError
 from app.api.models import (
     QueryRequest,
     QueryResponse,
+    DebugResponse,
     ResetRequest,
     ResetResponse,
     TranscriptResponse,
     ContactResponse,
 )
 from app.core.config import settings
+from app.core.deadline import Deadline
 from app.core.logging import get_logger
+from app.core.profiling import PROFILE_HEADER, request_profiler
+from app.rag.capture import capture_writer
 from app.rag.engine import RAGEngine
 from app.rag.memory import ConversationMemory
 
@@ -60,10 +71,45 @@ def get_rag_engine(session_memory: ConversationMemory = Depends(get_session_memo
         return engine
 
 
-@router.post("/query", response_model=QueryResponse)
-async def query(request: QueryRequest, rag_engine: RAGEngine = Depends(get_rag_engine)):
+def _service_unavailable(error: CircuitOpenError) -> HTTPException:
+    """Build the 503 response for a query that needs an upstream whose circuit is open."""
+    return HTTPException(
+        status_code=503,
+        detail="Il servizio è momentaneamente non disponibile. Riprova tra qualche secondo.",
+        headers={"Retry-After": error.retry_after_header},
+    )
+
+
+def _too_many_requests(error: OverloadedError) -> HTTPException:
+    """Build the 429 response for a request rejected by admission control."""
+    return HTTPException(
+        status_code=429,
+        detail="Il servizio è momentaneamente sovraccarico. Riprova tra qualche secondo.",
+        headers={"Retry-After": error.retry_after_header},
+    )
+
+
+@router.post("/query", response_model=QueryResponse, response_model_exclude_none=True)
+async def query(request: QueryRequest, http_request: Request, response: Response,
+                rag_engine: RAGEngine = Depends(get_rag_engine)):
     """Process a user query and return a response."""
     logger.info(f"Received query: '{request.query}', session_id: {request.session_id}")
+    # Il budget parte all'arrivo: anche l'attesa in coda consuma tempo
+    deadline = Deadline()
+    
+    # Un retry con la stessa idempotency key riceve la risposta già calcolata
+    if request.idempotency_key:
+        replayed = get_replay(request.session_id, request.idempotency_key)
+        if replayed is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return QueryResponse(**replayed)
+    
+    try:
+        if settings.RATE_LIMIT_ENABLED:
+            host = http_request.client.host if http_request.client else None
+            rate_limiter.check(client_key(request.session_id, host))
+    except OverloadedError as e:
+        raise _too_many_requests(e)
     
     # Get the memory specific to this session
     current_session_memory = get_session_memory(request.session_id)
@@ -80,16 +126,84 @@ async def query(request: QueryRequest, rag_engine: RAGEngine = Depends(get_rag_e
     # Make sure the RAG engine uses this memory
     rag_engine.memory = current_session_memory
     
+    scope = request.scope.model_dump(exclude_none=True) if request.scope else None
+    # Cattura del traffico per il replay: richiesta e storia effettivamente usata dalla pipeline
+    capture = capture_writer.start({
+        "query": request.query,
+        "session_id": request.session_id,
+        "scope": scope,
+        "include_prompt": request.include_prompt,
+        "history": [list(exchange) for exchange in current_session_memory.get_history()],
+    })
+    # Profilo della pipeline su richiesta di un admin (header X-Profile) o a campione
+    requested_profile = http_request.headers.get(PROFILE_HEADER)
+    if requested_profile and not admin_token_valid(http_request.headers.get(ADMIN_TOKEN_HEADER)):
+        logger.warning("Ignoring X-Profile header without a valid admin token")
+        requested_profile = None
+    profile = request_profiler.start(requested_profile)
+    status = 500
+    result = None
+    
     # Process the query
     try:
-        result = rag_engine.query(request.query, include_prompt=request.include_prompt)
+        async def run_query():
+            query_call = rag_engine.query if profile is None else partial(profile.run, rag_engine.query)
+            # Solo l'esecuzione effettiva occupa uno slot: le richieste accodate a un'altra non contano
+            async with admission_controller.admit():
+                # La pipeline è sincrona: gira in un thread per non bloccare l'event loop
+                result = await run_in_threadpool(
+                    query_call, request.query, include_prompt=request.include_prompt, scope=scope,
+                    deadline=deadline, capture=capture
+                )
+            return result, current_session_memory
+        
+        if settings.QUERY_COALESCING_ENABLED:
+            key = coalescing_key(request.query, request.session_id,
+                                 bool(current_session_memory.get_history()), scope, bool(request.include_prompt))
+            (result, owner_memory), leader = await query_flight.do(key, run_query)
+            # Una domanda condivisa tra sessioni va comunque registrata nella memoria di ciascuna
+            if not leader and owner_memory is not current_session_memory:
+                current_session_memory.add_exchange(request.query, result["answer"])
+            if not leader and capture is not None:
+                capture.set(coalesced=True)
+        else:
+            result, _ = await run_query()
+        
+        # Prompt e testi completi restano sul server, recuperabili con il request_id
+        result = attach_request_id(result)
+        
+        if request.idempotency_key:
+            store_replay(request.session_id, request.idempotency_key, result)
+        status = 200
         return QueryResponse(**result)
+    except CircuitOpenError as e:
+        status = 503
+        raise _service_unavailable(e)
+    except OverloadedError as e:
+        status = 429
+        raise _too_many_requests(e)
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"Si è verificato un errore durante l'elaborazione della richiesta: {str(e)}"
         )
+    finally:
+        if capture is not None:
+            capture_writer.submit(capture.finish(status, result))
+        if profile is not None:
+            request_id = result.get("request_id") if result else None
+            await run_in_threadpool(request_profiler.save, profile, request_id, status,
+                                    deadline.elapsed(), list(deadline.degradations))
+
+
+@router.get("/debug/{request_id}", response_model=DebugResponse)
+async def debug(request_id: str):
+    """Get the full prompt and chunk texts of a recent query."""
+    artifacts = get_debug(request_id)
+    if artifacts is None:
+        raise HTTPException(status_code=404, detail="Dati di debug non disponibili o scaduti per questa richiesta")
+    return DebugResponse(request_id=request_id, **artifacts)
 
 
 @router.post("/reset", response_model=ResetResponse)
@@ -0,0 +1,211 @@
+"""Admission control and upstream concurrency limits for the CroceRossa Qdrant Cloud application.
+
+Three layers protect the upstreams (and the other users) under overload:
+
+- a token bucket per client (session, or IP address without a session) stops a
+  single client from monopolizing capacity;
+- the admission controller bounds the RAG pipelines running at once and the
+  requests waiting for a slot; beyond the queue, or after the queue deadline,
+  a request is rejected immediately instead of slowing everyone down;
+- a semaphore per upstream (OpenAI chat, OpenAI embeddings, Cohere, Qdrant)
+  bounds the parallel calls that the running pipelines send to each service.
+
+Every rejection raises OverloadedError, turned into a 429 with Retry-After by the API.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_admission_rejections_total", "counter", "Requests rejected by admission control, by reason")
+metrics.describe("cri_admission_active", "gauge", "RAG pipelines currently running")
+metrics.describe("cri_admission_queued", "gauge", "Requests waiting for a pipeline slot")
+metrics.describe("cri_upstream_in_flight", "gauge", "Calls in flight to each upstream")
+metrics.describe("cri_upstream_max_concurrency", "gauge", "Configured concurrency limit of each upstream")
+
+
+class OverloadedError(Exception):
+    """Raised when a request is rejected because the service is saturated."""
+
+    def __init__(self, reason: str, retry_after: float):
+        """Create the error with the rejection reason and a suggested retry delay in seconds."""
+        super().__init__(f"Service overloaded ({reason}), retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        """Return the Retry-After header value (whole seconds, at least 1)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class UpstreamBusyError(OverloadedError):
+    """Raised when no slot for an upstream frees up within the acquire timeout."""
+
+
+def _reject(reason: str, retry_after: float, error_class: type = OverloadedError) -> OverloadedError:
+    """Count a rejection and build the error to raise."""
+    metrics.inc("cri_admission_rejections_total", reason=reason)
+    logger.warning(f"Request rejected: {reason}", retry_after=round(retry_after, 1))
+    return error_class(reason, retry_after)
+
+
+class ClientRateLimiter:
+    """Token bucket per client key, refilled at requests_per_minute up to burst tokens.
+
+    Only used from the event loop. The least recently seen clients are dropped
+    beyond ``max_clients`` buckets.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int, max_clients: int = 10000):
+        """Initialize an empty set of buckets."""
+        self.rate = requests_per_minute / 60.0
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def check(self, client_key: str) -> None:
+        """Spend one token for the client, or raise OverloadedError with the time to the next token."""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(client_key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        if tokens < 1.0:
+            self._buckets[client_key] = (tokens, now)
+            raise _reject("rate_limited", (1.0 - tokens) / self.rate if self.rate else 60.0)
+
+        self._buckets[client_key] = (tokens - 1.0, now)
+        self._buckets.move_to_end(client_key)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+
+
+class AdmissionController:
+    """Bounds the pipelines running at once, with a bounded wait queue and a wait deadline."""
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        """Initialize the controller."""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Hold a pipeline slot for the duration of the block.
+
+        Raises:
+            OverloadedError: The queue is full, or no slot freed up before the deadline
+        """
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            raise _reject("queue_full", settings.OVERLOAD_RETRY_AFTER)
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise _reject("queue_timeout", settings.OVERLOAD_RETRY_AFTER) from None
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+class UpstreamLimiter:
+    """Thread-safe concurrency limits on the calls sent to each upstream."""
+
+    def __init__(self, limits: Dict[str, int], acquire_timeout: float):
+        """Create one semaphore per upstream."""
+        self.limits = dict(limits)
+        self.acquire_timeout = acquire_timeout
+        self._semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items()}
+        self._in_flight = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, upstream: str) -> Iterator[None]:
+        """Hold a call slot for ``upstream`` for the duration of the block.
+
+        Raises:
+            UpstreamBusyError: No slot freed up within the acquire timeout
+        """
+        if not self._acquire(upstream, self.acquire_timeout):
+            raise _reject(f"upstream_busy_{upstream}", settings.OVERLOAD_RETRY_AFTER, UpstreamBusyError)
+        try:
+            yield
+        finally:
+            self.release(upstream)
+
+    def try_acquire(self, upstream: str) -> bool:
+        """Take a call slot for ``upstream`` only if one is free right now; release it with release()."""
+        return self._acquire(upstream, None)
+
+    def release(self, upstream: str) -> None:
+        """Give back a slot taken with try_acquire()."""
+        with self._lock:
+            self._in_flight[upstream] -= 1
+        self._semaphores[upstream].release()
+
+    def _acquire(self, upstream: str, timeout: Optional[float]) -> bool:
+        """Take a slot, waiting at most ``timeout`` seconds (None: do not wait)."""
+        semaphore = self._semaphores[upstream]
+        if not (semaphore.acquire(blocking=False) if timeout is None else semaphore.acquire(timeout=timeout)):
+            return False
+        with self._lock:
+            self._in_flight[upstream] += 1
+        return True
+
+    def in_flight(self) -> Dict[str, int]:
+        """Return the calls currently in flight per upstream."""
+        with self._lock:
+            return dict(self._in_flight)
+
+
+def client_key(session_id: Optional[str], client_host: Optional[str]) -> str:
+    """Return the rate-limiting key of a request: its session, or its IP address."""
+    if session_id:
+        return f"session:{session_id}"
+    return f"ip:{client_host or 'unknown'}"
+
+
+rate_limiter = ClientRateLimiter(settings.RATE_LIMIT_REQUESTS_PER_MINUTE, settings.RATE_LIMIT_BURST)
+admission_controller = AdmissionController(settings.QUERY_MAX_CONCURRENCY, settings.QUERY_MAX_QUEUE,
+                                           settings.QUERY_QUEUE_TIMEOUT)
+upstream_limiter = UpstreamLimiter(
+    {
+        "openai_chat": settings.UPSTREAM_CONCURRENCY_OPENAI_CHAT,
+        "openai_embeddings": settings.UPSTREAM_CONCURRENCY_OPENAI_EMBEDDINGS,
+        "cohere": settings.UPSTREAM_CONCURRENCY_COHERE,
+        "qdrant": settings.UPSTREAM_CONCURRENCY_QDRANT,
+    },
+    settings.UPSTREAM_ACQUIRE_TIMEOUT,
+)
+
+
+def _collect_admission_metrics() -> Iterable[Tuple[str, Dict[str, object], float]]:
+    """Expose queue and upstream utilization as gauges at scrape time."""
+    yield "cri_admission_active", {}, admission_controller.active
+    yield "cri_admission_queued", {}, admission_controller.queued
+    for upstream, count in upstream_limiter.in_flight().items():
+        yield "cri_upstream_in_flight", {"upstream": upstream}, count
+        yield "cri_upstream_max_concurrency", {"upstream": upstream}, upstream_limiter.limits[upstream]
+
+
+metrics.register_collector(_collect_admission_metrics)
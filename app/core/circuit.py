@@ -0,0 +1,216 @@
+"""Circuit breakers on the upstreams of the CroceRossa Qdrant Cloud application.
+
+A breaker per upstream (OpenAI chat, OpenAI embeddings, Cohere, Qdrant) opens
+after CIRCUIT_FAILURE_THRESHOLD consecutive failed or slow calls. While it is
+open, calls fail immediately with CircuitOpenError, so the pipeline takes its
+fallback (stale cached results, no rerank, no condensation) instead of waiting
+for the full timeout of an upstream in trouble. After CIRCUIT_RESET_TIMEOUT a
+single probe call is let through: its success closes the breaker again.
+
+Only errors of the upstream itself count as failures: transport errors,
+timeouts and 5xx/408/429 responses. Local errors raised inside the guarded block
+(parsing, validation, programming errors) propagate without touching the breaker.
+"""
+
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterable, Iterator, Optional, Tuple
+
+from app.core.admission import OverloadedError
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_circuit_state", "gauge", "Circuit breaker state of each upstream (0 closed, 1 half-open, 2 open)")
+metrics.describe("cri_circuit_transitions_total", "counter", "Circuit breaker state changes, by upstream and new state")
+metrics.describe("cri_circuit_rejections_total", "counter", "Calls failed fast by an open circuit breaker")
+metrics.describe("cri_circuit_slow_calls_total", "counter", "Upstream calls slower than the breaker latency threshold")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Errori di rete, timeout e risposte HTTP degli SDK, confrontati per nome per non importare gli SDK
+UPSTREAM_ERROR_TYPES = frozenset({
+    "builtins.TimeoutError",
+    "builtins.ConnectionError",
+    "httpx.TransportError",
+    "httpx.HTTPStatusError",
+    "openai.APIConnectionError",
+    "openai.APIStatusError",
+    "cohere.core.api_error.ApiError",
+    "qdrant_client.http.exceptions.UnexpectedResponse",
+    "qdrant_client.http.exceptions.ResponseHandlingException",
+    "grpc.RpcError",
+})
+
+# Risposte di errore che indicano un upstream in difficoltà (le altre 4xx dipendono dalla richiesta)
+_UPSTREAM_CLIENT_STATUSES = (408, 429)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """Return the HTTP status of an SDK error, if it carries one."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        try:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        except Exception:
+            status = None
+    return status if isinstance(status, int) else None
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Return whether an error means the upstream failed, rather than the code calling it."""
+    names = {f"{cls.__module__}.{cls.__qualname__}" for cls in type(error).__mro__}
+    if names.isdisjoint(UPSTREAM_ERROR_TYPES):
+        return False
+    status = _status_code(error)
+    return status is None or status >= 500 or status in _UPSTREAM_CLIENT_STATUSES
+
+
+class CircuitOpenError(OverloadedError):
+    """Raised when a call is refused because the breaker of its upstream is open."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        """Create the error with the upstream and the time until the next probe."""
+        super().__init__(f"circuit_open_{upstream}", retry_after)
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure circuit breaker for one upstream."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, slow_call_seconds: float = 0.0):
+        """Initialize a closed breaker.
+
+        Args:
+            name: Upstream name, used in errors, logs and metrics
+            failure_threshold: Consecutive failed or slow calls that open the breaker
+            reset_timeout: Seconds the breaker stays open before a probe call
+            slow_call_seconds: Calls slower than this count as failures (0 disables the check)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        """Change state (lock held)."""
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker '{self.name}': {self.state} -> {state}", failures=self.failures)
+        self.state = state
+        metrics.inc("cri_circuit_transitions_total", upstream=self.name, state=state)
+
+    def _before_call(self) -> None:
+        """Let the call through, or raise CircuitOpenError."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            waited = time.monotonic() - self.opened_at
+            if self.state == OPEN and waited >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+            # Da semiaperto passa una sola chiamata di prova alla volta
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            retry_after = max(0.0, self.reset_timeout - waited)
+        metrics.inc("cri_circuit_rejections_total", upstream=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _release_probe(self) -> None:
+        """Let another probe through after a call that said nothing about the upstream."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _after_call(self, succeeded: bool) -> None:
+        """Record the outcome of a call that was let through."""
+        with self._lock:
+            self._probe_in_flight = False
+            if succeeded:
+                self.failures = 0
+                self._transition(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Run the block as a call to the upstream, recording failures and slow calls.
+
+        Only upstream errors (see ``is_upstream_failure``) count as failures.
+
+        Raises:
+            CircuitOpenError: The breaker is open
+        """
+        self._before_call()
+        started_at = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e):
+                self._after_call(False)
+            else:
+                self._release_probe()
+            raise
+        elapsed = time.monotonic() - started_at
+        slow = self.slow_call_seconds > 0 and elapsed > self.slow_call_seconds
+        if slow:
+            metrics.inc("cri_circuit_slow_calls_total", upstream=self.name)
+            logger.warning(f"Slow call to '{self.name}'", elapsed=round(elapsed, 2))
+        self._after_call(not slow)
+
+
+class CircuitBreakers:
+    """The circuit breakers of all upstreams."""
+
+    def __init__(self, breakers: Dict[str, CircuitBreaker], enabled: bool = True):
+        """Register the breakers."""
+        self.breakers = dict(breakers)
+        self.enabled = enabled
+
+    def guard(self, upstream: str) -> ContextManager[None]:
+        """Return the guard of an upstream's breaker (a no-op when breakers are disabled)."""
+        if not self.enabled:
+            return nullcontext()
+        return self.breakers[upstream].guard()
+
+    def states(self) -> Dict[str, str]:
+        """Return the state of every breaker."""
+        return {name: breaker.state for name, breaker in self.breakers.items()}
+
+
+circuit_breakers = CircuitBreakers(
+    {
+        "openai_chat": CircuitBreaker("openai_chat", settings.CIRCUIT_FAILURE_THRESHOLD,
+                                      settings.CIRCUIT_RESET_TIMEOUT, settings.CIRCUIT_SLOW_CALL_OPENAI_CHAT),
+        "openai_embeddings": CircuitBreaker("openai_embeddings", settings.CIRCUIT_FAILURE_THRESHOLD,
+                                            settings.CIRCUIT_RESET_TIMEOUT, settings.CIRCUIT_SLOW_CALL_OPENAI_EMBEDDINGS),
+        "cohere": CircuitBreaker("cohere", settings.CIRCUIT_FAILURE_THRESHOLD,
+                                 settings.CIRCUIT_RESET_TIMEOUT, settings.CIRCUIT_SLOW_CALL_COHERE),
+        "qdrant": CircuitBreaker("qdrant", settings.CIRCUIT_FAILURE_THRESHOLD,
+                                 settings.CIRCUIT_RESET_TIMEOUT, settings.CIRCUIT_SLOW_CALL_QDRANT),
+    },
+    enabled=settings.CIRCUIT_BREAKER_ENABLED,
+)
+
+
+def _collect_circuit_metrics() -> Iterable[Tuple[str, Dict[str, object], float]]:
+    """Expose the breaker states as gauges at scrape time."""
+    for upstream, state in circuit_breakers.states().items():
+        yield "cri_circuit_state", {"upstream": upstream}, _STATE_VALUES[state]
+
+
+metrics.register_collector(_collect_circuit_metrics)
@@ -1,7 +1,7 @@
 """Configuration management for the CroceRossa Qdrant Cloud application."""
 
 import os
-from typing import Optional
+from typing import List, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,7 +13,7 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = Field(..., description="OpenAI API key")
     QDRANT_URL: str = Field(..., description="Qdrant Cloud URL")
     QDRANT_API_KEY: str = Field(..., description="Qdrant Cloud API key")
-    QDRANT_COLLECTION: str = Field(..., description="Qdrant Collection name")
+    QDRANT_COLLECTION: str = Field(..., description="Qdrant collection name or alias of the current collection version")
     COHERE_API_KEY: str = Field(..., description="Cohere API key for reranking")
     
     # RAG Configuration
@@ -21,9 +21,186 @@ class Settings(BaseSettings):
     RERANK_TOP_K: int = Field(10, description="Number of documents to keep after reranking")
     MEMORY_WINDOW_SIZE: int = Field(4, description="Number of conversation exchanges to keep in memory")
     
+    # Multi-collection routing
+    COLLECTIONS_CONFIG_PATH: str = Field("", description="JSON file of the searchable collections (empty = QDRANT_COLLECTION only)")
+    COLLECTION_ROUTER_MAX: int = Field(2, description="Maximum collections searched by a query routed on keywords")
+    COLLECTION_SEARCH_CONCURRENCY: int = Field(16, description="Threads running the per-collection searches of the queries")
+    
+    # Qdrant transport and search parameters
+    QDRANT_PREFER_GRPC: bool = Field(False, description="Use the gRPC transport for Qdrant data operations")
+    QDRANT_GRPC_PORT: int = Field(6334, description="Qdrant gRPC port")
+    QDRANT_HNSW_EF: Optional[int] = Field(None, description="HNSW ef used at search time (None = server default)")
+    QDRANT_EXACT_SEARCH: bool = Field(False, description="Bypass the HNSW index and run an exact search")
+    QDRANT_SCORE_THRESHOLD: Optional[float] = Field(None, description="Minimum similarity score for retrieved points")
+    QDRANT_PAYLOAD_FIELDS: List[str] = Field(
+        ["page_content", "metadata"],
+        description="Payload fields returned by direct and two-stage searches (empty = whole payload); "
+                    "the LlamaIndex retriever always reads the whole payload"
+    )
+    
+    # Matryoshka two-stage search
+    QDRANT_VECTOR_MODE: str = Field("single", description="Vector layout: single (one vector) or matryoshka (short + full named vectors)")
+    MATRYOSHKA_DIMENSIONS: int = Field(256, description="Dimensions of the truncated first-stage vector")
+    MATRYOSHKA_PREFETCH_MULTIPLIER: float = Field(4.0, description="First-stage shortlist size as a multiple of the result limit")
+    
+    # Qdrant quantization
+    QDRANT_QUANTIZATION: str = Field("none", description="Collection quantization: none, scalar or binary")
+    QDRANT_QUANTIZATION_ALWAYS_RAM: bool = Field(True, description="Keep quantized vectors in RAM")
+    QDRANT_QUANTIZATION_OVERSAMPLING: float = Field(2.0, description="Oversampling factor for quantized search")
+    QDRANT_QUANTIZATION_RESCORE: bool = Field(True, description="Rescore quantized candidates with the original vectors")
+    
+    # Collection versions and caches
+    COLLECTION_VERSION_CHECK_INTERVAL: float = Field(30.0, description="Seconds between checks of the collection alias")
+    COLLECTION_VERSIONS_TO_KEEP: int = Field(2, description="Collection versions kept by prune")
+    EMBEDDING_CACHE_SIZE: int = Field(2048, description="Query embeddings kept in cache (0 = disabled)")
+    EMBEDDING_CACHE_TTL: float = Field(86400.0, description="Lifetime of a cached query embedding, in seconds")
+    RETRIEVAL_CACHE_SIZE: int = Field(512, description="Retrieval results kept in cache (0 = disabled)")
+    RETRIEVAL_CACHE_TTL: float = Field(900.0, description="Lifetime of a cached retrieval result, in seconds")
+    
+    # Follow-up detection (condensation only for questions that depend on the conversation)
+    FOLLOW_UP_DETECTION_ENABLED: bool = Field(True, description="Condense only questions the local detector marks as follow-ups")
+    FOLLOW_UP_THRESHOLD: float = Field(2.0, description="Cue score from which a question is a follow-up")
+    
+    # Query-complexity model routing
+    MODEL_ROUTING_ENABLED: bool = Field(True, description="Answer simple questions with LLM_SMALL_MODEL instead of LLM_MODEL")
+    ROUTING_COMPLEX_THRESHOLD: float = Field(2.0, description="Complexity score from which a question goes to LLM_MODEL")
+    ROUTING_LONG_QUESTION_WORDS: int = Field(25, description="Words from which a question counts as long")
+    ROUTING_MIN_CONFIDENCE: float = Field(0.5, description="Best rerank score below which retrieval counts as low confidence")
+    ROUTING_RELEVANT_SCORE: float = Field(0.3, description="Rerank score from which a chunk counts as needed for the answer")
+    ROUTING_MULTI_DOCUMENT_SOURCES: int = Field(3, description="Distinct sources among the relevant chunks of a multi-document question")
+    ROUTING_DEEP_FOLLOW_UP: int = Field(3, description="Conversation exchanges from which a condensed question counts as a deep follow-up")
+    
+    # Precomputed answers to frequent standalone questions
+    PRECOMPUTED_ENABLED: bool = Field(True, description="Serve precomputed answers to frequent standalone questions")
+    PRECOMPUTED_STORE_PATH: str = Field("data/precomputed_answers.npz", description="File of the precomputed answer store")
+    PRECOMPUTED_MIN_SIMILARITY: float = Field(0.95, description="Cosine similarity from which a question matches a precomputed one")
+    PRECOMPUTED_REFRESH_ON_INGEST: bool = Field(True, description="Regenerate the precomputed answers after each ingestion run")
+    
+    # Spelling index built from the collection vocabulary
+    SPELLING_ENABLED: bool = Field(True, description="Correct typos in user questions with the corpus vocabulary")
+    SPELLING_VOCABULARY_PATH: str = Field("data/spelling_vocabulary.json", description="Vocabulary file of the spelling index")
+    SPELLING_MAX_EDIT_DISTANCE: int = Field(2, description="Maximum edit distance of a spelling correction")
+    SPELLING_MIN_FREQUENCY: int = Field(2, description="Occurrences required for a corpus word to enter the vocabulary")
+    
+    # Request coalescing and idempotency
+    QUERY_COALESCING_ENABLED: bool = Field(True, description="Share one pipeline execution among identical in-flight queries")
+    IDEMPOTENCY_TTL: float = Field(300.0, description="Seconds a response is replayed for its idempotency key")
+    IDEMPOTENCY_CACHE_SIZE: int = Field(10000, description="Idempotent responses kept for replay")
+    
+    # Response size and debug artifacts
+    GZIP_MINIMUM_SIZE: int = Field(1000, description="Responses smaller than this many bytes are not compressed")
+    GZIP_COMPRESS_LEVEL: int = Field(6, description="Gzip compression level of the responses (1-9)")
+    SOURCE_PREVIEW_CHARS: int = Field(200, description="Characters of chunk text returned as source preview")
+    DEBUG_STORE_SIZE: int = Field(256, description="Requests whose full prompt and chunk texts are kept for /api/debug (0 = disabled)")
+    DEBUG_STORE_TTL: float = Field(900.0, description="Seconds the debug artifacts of a request are kept")
+
+    # Traffic capture for replay
+    CAPTURE_ENABLED: bool = Field(False, description="Record each /api/query with its upstream responses for replay")
+    CAPTURE_DIR: str = Field("data/capture", description="Directory of the compressed NDJSON capture files")
+    CAPTURE_MAX_BYTES: int = Field(50_000_000, description="Uncompressed bytes after which a capture file is rotated")
+    CAPTURE_MAX_FILES: int = Field(20, description="Capture files kept (the oldest are deleted)")
+    CAPTURE_SAMPLE_RATE: float = Field(1.0, description="Fraction of the queries recorded")
+    CAPTURE_QUEUE_SIZE: int = Field(1000, description="Records waiting to be written before new ones are dropped")
+
+    # Frontend assets (loaded and precompressed at startup)
+    FRONTEND_INDEX_PATH: str = Field("index.html", description="HTML file served at /")
+    FRONTEND_STATIC_DIR: str = Field("static", description="Directory served under /static")
+    FRONTEND_CACHE_CONTROL: str = Field("no-cache", description="Cache-Control of index.html (revalidated with its ETag)")
+    STATIC_CACHE_CONTROL: str = Field("public, max-age=86400", description="Cache-Control of the files under /static")
+    
+    # Admission control and upstream concurrency limits
+    QUERY_MAX_CONCURRENCY: int = Field(16, description="RAG pipelines running at once")
+    QUERY_MAX_QUEUE: int = Field(64, description="Requests waiting for a pipeline slot before rejecting with 429")
+    QUERY_QUEUE_TIMEOUT: float = Field(10.0, description="Maximum wait for a pipeline slot, in seconds")
+    UPSTREAM_CONCURRENCY_OPENAI_CHAT: int = Field(8, description="Parallel OpenAI chat/completion calls")
+    UPSTREAM_CONCURRENCY_OPENAI_EMBEDDINGS: int = Field(16, description="Parallel OpenAI embedding calls")
+    UPSTREAM_CONCURRENCY_COHERE: int = Field(8, description="Parallel Cohere rerank calls")
+    UPSTREAM_CONCURRENCY_QDRANT: int = Field(16, description="Parallel Qdrant searches")
+    UPSTREAM_ACQUIRE_TIMEOUT: float = Field(5.0, description="Maximum wait for an upstream call slot, in seconds")
+    RATE_LIMIT_ENABLED: bool = Field(True, description="Apply a token bucket per session (or IP) to /api/query")
+    RATE_LIMIT_REQUESTS_PER_MINUTE: float = Field(20.0, description="Sustained queries per minute per client")
+    RATE_LIMIT_BURST: int = Field(5, description="Queries a client can send in a burst")
+    OVERLOAD_RETRY_AFTER: float = Field(5.0, description="Retry-After suggested when the service is saturated, in seconds")
+    
+    # Circuit breakers on the upstreams
+    CIRCUIT_BREAKER_ENABLED: bool = Field(True, description="Fail fast to fallbacks while an upstream keeps failing")
+    CIRCUIT_FAILURE_THRESHOLD: int = Field(5, description="Consecutive failed or slow calls that open a breaker")
+    CIRCUIT_RESET_TIMEOUT: float = Field(30.0, description="Seconds a breaker stays open before a probe call")
+    CIRCUIT_SLOW_CALL_OPENAI_CHAT: float = Field(30.0, description="OpenAI chat calls slower than this count as failures (0 = off)")
+    CIRCUIT_SLOW_CALL_OPENAI_EMBEDDINGS: float = Field(3.0, description="OpenAI embedding calls slower than this count as failures (0 = off)")
+    CIRCUIT_SLOW_CALL_COHERE: float = Field(3.0, description="Cohere calls slower than this count as failures (0 = off)")
+    CIRCUIT_SLOW_CALL_QDRANT: float = Field(3.0, description="Qdrant searches slower than this count as failures (0 = off)")
+    STALE_ANSWER_CACHE_SIZE: int = Field(1024, description="Answers to standalone questions kept as fallback while OpenAI is down (0 = disabled)")
+    
+    # Latency budget of /api/query
+    QUERY_DEADLINE: float = Field(12.0, description="End-to-end latency budget of a query, in seconds (0 = disabled)")
+    DEADLINE_CONDENSE_MIN_REMAINING: float = Field(8.0, description="Seconds left required to condense a follow-up question")
+    DEADLINE_FULL_RETRIEVAL_MIN_REMAINING: float = Field(7.0, description="Seconds left required to retrieve RETRIEVAL_TOP_K documents")
+    DEADLINE_REDUCED_RETRIEVAL_TOP_K: int = Field(20, description="Documents retrieved when the budget is short")
+    DEADLINE_RERANK_MIN_REMAINING: float = Field(5.0, description="Seconds left required to rerank with Cohere")
+    DEADLINE_FULL_ANSWER_MIN_REMAINING: float = Field(4.0, description="Seconds left required to generate an answer without a length cap")
+    DEADLINE_REDUCED_MAX_TOKENS: int = Field(350, description="Answer max_tokens when the budget is short")
+    
     # LLM Configuration
     LLM_MODEL: str = Field("gpt-4.1", description="LLM model to use")
+    LLM_SMALL_MODEL: str = Field("gpt-4.1-mini", description="Faster model for simple questions, condensation and no-context answers")
     EMBEDDING_MODEL: str = Field("text-embedding-3-large", description="Embedding model to use")
+    EMBEDDING_DIMENSIONS: int = Field(3072, description="Dimensions of the stored embedding vectors")
+    
+    # Upstream HTTP connection pools
+    HTTP_POOL_MAX_CONNECTIONS: int = Field(20, description="Maximum connections per upstream pool")
+    HTTP_POOL_MAX_KEEPALIVE: int = Field(10, description="Maximum idle keep-alive connections per upstream pool")
+    HTTP_KEEPALIVE_EXPIRY: float = Field(120.0, description="Seconds an idle pooled connection is kept open")
+    HTTP_CONNECT_TIMEOUT: float = Field(5.0, description="Connect timeout for upstream requests, in seconds")
+    HTTP_CONNECT_RETRIES: int = Field(2, description="Transport-level retries on connection errors")
+    HTTP2_ENABLED: bool = Field(True, description="Use HTTP/2 for upstream pools when the h2 package is installed")
+    OPENAI_TIMEOUT: float = Field(60.0, description="Read timeout for OpenAI requests, in seconds")
+    OPENAI_MAX_RETRIES: int = Field(3, description="SDK retries for OpenAI requests")
+    COHERE_TIMEOUT: float = Field(10.0, description="Read timeout for Cohere requests, in seconds")
+    COHERE_MAX_RETRIES: int = Field(3, description="SDK retries for Cohere requests")
+    QDRANT_TIMEOUT: float = Field(10.0, description="Read timeout for Qdrant requests, in seconds")
+    
+    # Hedged Qdrant searches
+    QDRANT_HEDGE_ENABLED: bool = Field(True, description="Send a duplicate of slow vector searches and use the first answer")
+    QDRANT_HEDGE_PERCENTILE: float = Field(95.0, description="Recent-latency percentile after which a search is hedged")
+    QDRANT_HEDGE_MIN_DELAY: float = Field(0.05, description="Minimum delay before hedging a search, in seconds")
+    QDRANT_HEDGE_WINDOW: int = Field(500, description="Recent search latencies used to compute the percentile")
+    QDRANT_HEDGE_MIN_SAMPLES: int = Field(50, description="Searches observed before hedging starts")
+    
+    # Ingestion pipeline
+    INGEST_CHUNK_SIZE: int = Field(1024, description="Chunk size in tokens")
+    INGEST_CHUNK_OVERLAP: int = Field(128, description="Overlap between consecutive chunks, in tokens")
+    INGEST_EMBED_BATCH_SIZE: int = Field(256, description="Maximum texts per embedding request")
+    INGEST_EMBED_MAX_TOKENS_PER_BATCH: int = Field(100000, description="Maximum tokens per embedding request")
+    INGEST_EMBED_CONCURRENCY: int = Field(4, description="Parallel embedding requests")
+    INGEST_EMBED_TOKENS_PER_MINUTE: int = Field(1000000, description="Embedding token budget per minute")
+    INGEST_UPSERT_BATCH_SIZE: int = Field(128, description="Points per Qdrant upsert request")
+    INGEST_UPSERT_CONCURRENCY: int = Field(4, description="Parallel Qdrant upsert requests")
+    INGEST_MANIFEST_PATH: str = Field("data/ingest_manifest.json", description="Manifest of the indexed points per file")
+    INGEST_DEDUP_ENABLED: bool = Field(True, description="Group near-duplicate chunks with MinHash/LSH at ingestion")
+    INGEST_DEDUP_MODE: str = Field("tag", description="Near-duplicates: tag (index all, collapse at retrieval) or drop (index canonical chunks only, losing the scope metadata of the copies)")
+    INGEST_DEDUP_THRESHOLD: float = Field(0.85, description="Estimated Jaccard similarity of word shingles from which two chunks are duplicates")
+    INGEST_DEDUP_NUM_PERM: int = Field(128, description="MinHash signature length")
+    INGEST_DEDUP_SHINGLE_SIZE: int = Field(5, description="Words per shingle")
+    INGEST_DEDUP_INDEX_PATH: str = Field("data/dedup_index.npz", description="Saved MinHash/LSH index of the indexed chunks")
+    
+    # Profiling on demand (endpoint admin e header X-Profile)
+    ADMIN_TOKEN: str = Field("", description="Token of the admin endpoints and of the X-Profile header (empty = disabled)")
+    PROFILE_DIR: str = Field("data/profiles", description="Directory of the query profiles and tracemalloc snapshots")
+    PROFILE_SAMPLE_RATE: float = Field(0.0, description="Fraction of queries profiled without the header")
+    PROFILE_SAMPLE_MODE: str = Field("sample", description="Profiler of the sampled queries: sample (stack sampling) or cprofile")
+    PROFILE_SAMPLING_INTERVAL: float = Field(0.005, description="Seconds between two stack samples of the sampling profiler")
+    PROFILE_MAX_FILES: int = Field(200, description="Query profiles kept in PROFILE_DIR (oldest deleted)")
+    PROFILE_TOP_FUNCTIONS: int = Field(30, description="Functions and allocation sites listed in the profile summaries")
+    PROFILE_MEMORY_MAX_OBJECTS: int = Field(2000000, description="Objects visited at most when measuring a structure")
+    TRACEMALLOC_FRAMES: int = Field(10, description="Frames stored per allocation when tracemalloc is started")
+    
+    # Startup warm-up
+    WARMUP_ENABLED: bool = Field(True, description="Warm up upstream connections and caches at startup")
+    WARMUP_QUERY: str = Field("Croce Rossa Italiana", description="Dummy query used by the startup warm-up")
+    WARMUP_INCLUDE_RERANK: bool = Field(True, description="Include a one-document Cohere rerank in the warm-up")
+    WARMUP_RETRY_BACKOFF: float = Field(2.0, description="Seconds before retrying a failed warm-up, doubled after every failure")
+    WARMUP_RETRY_MAX_BACKOFF: float = Field(60.0, description="Maximum seconds between two warm-up retries")
     
     # Miscellaneous
     LOG_LEVEL: str = Field("INFO", description="Logging level")
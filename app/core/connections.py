@@ -0,0 +1,143 @@
+"""Shared HTTP connection pools for the upstream services of the CroceRossa application.
+
+Every upstream (OpenAI, Cohere, Qdrant) gets one long-lived httpx client with a
+keep-alive pool, HTTP/2 where the ``h2`` package is available, and the timeouts
+and connect retries configured in Settings. All SDK clients are built on top of
+these pools, so TLS handshakes are paid once per connection instead of per query.
+"""
+
+import threading
+from typing import Any, Dict, Iterable, Tuple
+
+import httpx
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+try:
+    import h2  # noqa: F401 - richiesto da httpx per HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+metrics.describe("cri_http_pool_connections", "gauge", "Open connections in the upstream HTTP pool")
+metrics.describe("cri_http_pool_idle_connections", "gauge", "Idle keep-alive connections in the upstream HTTP pool")
+metrics.describe("cri_http_pool_active_connections", "gauge", "Connections currently serving a request")
+metrics.describe("cri_http_pool_waiting_requests", "gauge", "Requests queued waiting for a pooled connection")
+metrics.describe("cri_http_pool_max_connections", "gauge", "Configured maximum size of the upstream HTTP pool")
+metrics.describe("cri_upstream_requests_total", "counter", "HTTP requests sent to each upstream, by status code")
+
+
+class ConnectionManager:
+    """Builds and owns one pooled httpx client per upstream."""
+
+    def __init__(self):
+        """Initialize the manager; pools are created lazily on first use."""
+        self._lock = threading.Lock()
+        self._transports: Dict[str, httpx.HTTPTransport] = {}
+        self._clients: Dict[str, httpx.Client] = {}
+
+    def _read_timeout(self, upstream: str) -> float:
+        """Return the configured read timeout for an upstream."""
+        return {
+            "openai": settings.OPENAI_TIMEOUT,
+            "cohere": settings.COHERE_TIMEOUT,
+            "qdrant": settings.QDRANT_TIMEOUT,
+        }.get(upstream, settings.OPENAI_TIMEOUT)
+
+    def _build_transport(self) -> httpx.HTTPTransport:
+        """Create a pooled transport with the configured limits."""
+        http2 = settings.HTTP2_ENABLED and HTTP2_AVAILABLE
+        return httpx.HTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            retries=settings.HTTP_CONNECT_RETRIES,
+        )
+
+    def timeout(self, upstream: str) -> httpx.Timeout:
+        """Return the httpx timeout for an upstream."""
+        return httpx.Timeout(self._read_timeout(upstream), connect=settings.HTTP_CONNECT_TIMEOUT)
+
+    def transport(self, upstream: str) -> httpx.HTTPTransport:
+        """Return the shared transport (connection pool) for an upstream."""
+        with self._lock:
+            if upstream not in self._transports:
+                self._transports[upstream] = self._build_transport()
+                logger.info(
+                    f"Created HTTP pool for {upstream}",
+                    max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                    http2=settings.HTTP2_ENABLED and HTTP2_AVAILABLE,
+                )
+            return self._transports[upstream]
+
+    def http_client(self, upstream: str) -> httpx.Client:
+        """Return the shared httpx client for an upstream."""
+        transport = self.transport(upstream)
+        with self._lock:
+            if upstream not in self._clients:
+                def _count_response(response: httpx.Response) -> None:
+                    metrics.inc("cri_upstream_requests_total", upstream=upstream,
+                                status=response.status_code)
+
+                self._clients[upstream] = httpx.Client(
+                    transport=transport,
+                    timeout=self.timeout(upstream),
+                    event_hooks={"response": [_count_response]},
+                )
+            return self._clients[upstream]
+
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Return utilization figures for every pool created so far."""
+        stats = {}
+        with self._lock:
+            transports = dict(self._transports)
+        for upstream, transport in transports.items():
+            try:
+                pool: Any = transport._pool
+                connections = list(pool.connections)
+                idle = sum(1 for conn in connections if conn.is_idle())
+                waiting = sum(1 for request in list(pool._requests) if request.is_queued())
+                stats[upstream] = {
+                    "connections": len(connections),
+                    "idle": idle,
+                    "active": len(connections) - idle,
+                    "waiting": waiting,
+                    "max_connections": settings.HTTP_POOL_MAX_CONNECTIONS,
+                }
+            except Exception as e:
+                logger.debug(f"Unable to read pool stats for {upstream}: {str(e)}")
+        return stats
+
+    def close(self) -> None:
+        """Close every pooled client and transport."""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            for transport in self._transports.values():
+                transport.close()
+            self._clients = {}
+            self._transports = {}
+
+
+# Global connection manager shared by the whole process
+connection_manager = ConnectionManager()
+
+
+def _collect_pool_metrics() -> Iterable[Tuple[str, Dict[str, object], float]]:
+    """Expose pool utilization as gauges at scrape time."""
+    for upstream, pool in connection_manager.pool_stats().items():
+        yield "cri_http_pool_connections", {"upstream": upstream}, pool["connections"]
+        yield "cri_http_pool_idle_connections", {"upstream": upstream}, pool["idle"]
+        yield "cri_http_pool_active_connections", {"upstream": upstream}, pool["active"]
+        yield "cri_http_pool_waiting_requests", {"upstream": upstream}, pool["waiting"]
+        yield "cri_http_pool_max_connections", {"upstream": upstream}, pool["max_connections"]
+
+
+metrics.register_collector(_collect_pool_metrics)
@@ -0,0 +1,80 @@
+"""Per-request latency budgets for the CroceRossa Qdrant Cloud application.
+
+Every /api/query gets an end-to-end budget starting when the request arrives, so
+time spent waiting for a pipeline slot counts too. Before each optional or
+expensive stage the RAG engine asks the deadline whether enough time is left;
+when it is not, the stage is degraded (skipped, shallower or shorter) and the
+degradation is recorded in the response metadata and in the metrics.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_query_degradations_total", "counter", "Pipeline stages degraded, by stage and reason (latency_budget, circuit_open)")
+metrics.describe("cri_query_budget_remaining_seconds", "histogram", "Latency budget left when a query completes",
+                 buckets=(0.0, 0.5, 1.0, 2.0, 4.0, 6.0, 8.0, 12.0, 20.0))
+
+
+class Deadline:
+    """Latency budget of one request, shared by the stages of its pipeline."""
+
+    def __init__(self, budget_seconds: Optional[float] = None, started_at: Optional[float] = None):
+        """Start the budget.
+
+        Args:
+            budget_seconds: Total budget in seconds; defaults to QUERY_DEADLINE (0 disables degradations)
+            started_at: time.monotonic() of the request arrival, defaults to now
+        """
+        self.budget = settings.QUERY_DEADLINE if budget_seconds is None else budget_seconds
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.degradations: List[str] = []
+
+    @property
+    def enabled(self) -> bool:
+        """Return whether the budget is enforced."""
+        return self.budget > 0
+
+    def elapsed(self) -> float:
+        """Return the seconds spent since the request arrived."""
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        """Return the seconds left in the budget (infinite when disabled, never negative)."""
+        if not self.enabled:
+            return float("inf")
+        return max(0.0, self.budget - self.elapsed())
+
+    def allows(self, stage: str, min_remaining: float) -> bool:
+        """Return whether at least ``min_remaining`` seconds are left for ``stage``.
+
+        A negative answer records the degradation of the stage.
+        """
+        remaining = self.remaining()
+        if remaining >= min_remaining:
+            return True
+        self.degrade(stage, remaining)
+        return False
+
+    def degrade(self, stage: str, remaining: Optional[float] = None, reason: str = "latency_budget") -> None:
+        """Record that ``stage`` was degraded, to stay within the budget or because its upstream is down."""
+        remaining = self.remaining() if remaining is None else remaining
+        self.degradations.append(stage)
+        metrics.inc("cri_query_degradations_total", stage=stage, reason=reason)
+        logger.warning(f"Degrading stage '{stage}' ({reason})",
+                       remaining_ms=round(remaining * 1000) if self.enabled else None)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the budget, the time spent and the degradations taken, for the response metadata."""
+        if self.enabled:
+            metrics.observe("cri_query_budget_remaining_seconds", self.remaining())
+        return {
+            "budget_ms": round(self.budget * 1000) if self.enabled else None,
+            "elapsed_ms": round(self.elapsed() * 1000),
+            "degradations": list(self.degradations),
+        }
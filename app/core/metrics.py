@@ -0,0 +1,132 @@
+"""In-process metrics registry for the CroceRossa Qdrant Cloud application.
+
+Counters, gauges and histograms are kept in memory and rendered in the
+Prometheus text exposition format by the /metrics endpoint.
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Bucket di default per le latenze, in secondi
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    """Build a hashable, sorted key from a label dictionary."""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Dict[str, str]] = None) -> str:
+    """Format labels in Prometheus syntax."""
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ""
+    escaped = [
+        f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for k, v in items
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, gauges and histograms."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, List[float]]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, object], float]]]] = []
+
+    def describe(self, name: str, metric_type: str, help_text: str,
+                 buckets: Optional[Tuple[float, ...]] = None) -> None:
+        """Register the type and help text of a metric."""
+        with self._lock:
+            self._descriptions[name] = (metric_type, help_text)
+            if metric_type == "histogram":
+                self._buckets[name] = tuple(buckets or DEFAULT_BUCKETS)
+
+    def inc(self, name: str, value: float = 1.0, **labels: object) -> None:
+        """Increment a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: object) -> None:
+        """Set the current value of a gauge."""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        """Record an observation in a histogram."""
+        key = _label_key(labels)
+        with self._lock:
+            buckets = self._buckets.setdefault(name, DEFAULT_BUCKETS)
+            series = self._histograms.setdefault(name, {})
+            # Layout: [count per bucket..., +Inf count, sum]
+            values = series.setdefault(key, [0.0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[len(buckets)] += 1
+            values[len(buckets) + 1] += value
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, object], float]]]) -> None:
+        """Register a callback returning (gauge name, labels, value) triples at scrape time."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect(self) -> None:
+        """Refresh gauges from the registered collectors."""
+        for collector in list(self._collectors):
+            try:
+                for name, labels, value in collector():
+                    self.set_gauge(name, value, **labels)
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+
+    def get_counter(self, name: str, **labels: object) -> float:
+        """Return the current value of a counter (0 if never incremented)."""
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0.0)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        self._collect()
+        lines: List[str] = []
+        with self._lock:
+            names = sorted(set(self._counters) | set(self._gauges) | set(self._histograms))
+            for name in names:
+                metric_type, help_text = self._descriptions.get(name, ("untyped", ""))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+                for key, value in sorted(self._counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+                for key, value in sorted(self._gauges.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+                buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+                for key, values in sorted(self._histograms.get(name, {}).items()):
+                    for i, bound in enumerate(buckets):
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': str(bound)})} {values[i]}")
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {values[len(buckets)]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {values[len(buckets)]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {values[len(buckets) + 1]}")
+        return "\n".join(lines) + "\n"
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
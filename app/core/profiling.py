@@ -0,0 +1,395 @@
+"""On-demand profiling for the CroceRossa Qdrant Cloud application.
+
+A query is profiled when an admin sends the ``X-Profile`` header (``cprofile`` or
+``sample``) with a valid ``X-Admin-Token``, or when it is drawn by
+PROFILE_SAMPLE_RATE. Two profilers are available:
+
+- ``cprofile``: deterministic cProfile of ``RAGEngine.query``, saved as a pstats
+  file (``python -m pstats``, snakeviz). Precise, but slows the profiled query;
+- ``sample``: a thread samples the stack of the pipeline thread every
+  PROFILE_SAMPLING_INTERVAL seconds and saves the collapsed stacks
+  (flamegraph.pl, speedscope). Negligible overhead, suitable for sampling.
+
+Only the thread running the pipeline is profiled: searches run by the hedging
+and collection executors show up as waits. At most one query is profiled at a
+time; other triggers are skipped. Every profile has a JSON sidecar with the
+request ID, the status, the stage timings derived from the engine methods and the
+functions taking the most time.
+
+The module also reports the memory held by the session store and the caches,
+and drives tracemalloc for the admin endpoints.
+"""
+
+import cProfile
+import gc
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_profiles_total", "counter", "Profiled queries, by mode (cprofile, sample) and trigger (header, sample)")
+metrics.describe("cri_profiles_skipped_total", "counter", "Profile triggers skipped because another profile was running")
+
+PROFILE_HEADER = "X-Profile"
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+MODES = (CPROFILE, SAMPLE)
+
+# Metodi del motore (e chiamata al modello) da cui si ricavano i tempi delle fasi
+STAGE_FUNCTIONS: Dict[str, str] = {
+    "_condense_question": "condensation",
+    "_precomputed_answer": "precomputed",
+    "_embed_query": "embedding",
+    "_retrieve": "retrieval",
+    "_apply_reranking": "rerank",
+    "_build_answer_prompt": "prompt",
+    "complete": "answer",
+}
+
+# Oggetti condivisi con il resto del processo: non contano nella memoria di una struttura
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, types.CodeType, types.FrameType)
+
+
+def _frame_label(filename: str, function: str) -> str:
+    """Return the short label of a stack frame: file name and function."""
+    return f"{os.path.basename(filename)}:{function}"
+
+
+class _StackSampler(threading.Thread):
+    """Thread sampling the stack of another thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        """Prepare the sampler of a thread (started with ``start()``)."""
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: "Counter[Tuple[Tuple[str, str], ...]]" = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        """Record the stack of the target thread until stopped."""
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the sampler to exit."""
+        self._stop_event.set()
+        self.join()
+
+
+class QueryProfile:
+    """Profile of one query, filled by ``run`` in the thread executing the pipeline."""
+
+    def __init__(self, mode: str, trigger: str):
+        """Create an empty profile.
+
+        Args:
+            mode: Profiler, cprofile or sample
+            trigger: What requested the profile, header or sample
+        """
+        self.mode = mode
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.duration: Optional[float] = None
+        self.profiler: Optional[cProfile.Profile] = None
+        self.samples: "Counter[Tuple[Tuple[str, str], ...]]" = Counter()
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call fn under the profiler and return its result."""
+        started = time.perf_counter()
+        try:
+            if self.mode == CPROFILE:
+                self.profiler = cProfile.Profile()
+                return self.profiler.runcall(fn, *args, **kwargs)
+            sampler = _StackSampler(threading.get_ident(), settings.PROFILE_SAMPLING_INTERVAL)
+            sampler.start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                sampler.stop()
+                self.samples = sampler.samples
+        finally:
+            self.duration = time.perf_counter() - started
+
+    def _function_times(self) -> List[Dict[str, Any]]:
+        """Return the time spent in each function, with its calls (cprofile) or samples (sample)."""
+        functions = []
+        if self.profiler is not None:
+            for (filename, lineno, function), (_, calls, total, cumulative, _) in pstats.Stats(self.profiler).stats.items():
+                functions.append({
+                    "function": f"{_frame_label(filename, function)}:{lineno}",
+                    "name": function,
+                    "calls": calls,
+                    "self_ms": round(total * 1000, 2),
+                    "cumulative_ms": round(cumulative * 1000, 2),
+                })
+            return functions
+
+        interval_ms = settings.PROFILE_SAMPLING_INTERVAL * 1000
+        inclusive: "Counter[Tuple[str, str]]" = Counter()
+        own: "Counter[Tuple[str, str]]" = Counter()
+        for stack, count in self.samples.items():
+            for frame in set(stack):
+                inclusive[frame] += count
+            own[stack[-1]] += count
+        for frame, count in inclusive.items():
+            functions.append({
+                "function": _frame_label(*frame),
+                "name": frame[1],
+                "samples": count,
+                "self_ms": round(own[frame] * interval_ms, 2),
+                "cumulative_ms": round(count * interval_ms, 2),
+            })
+        return functions
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the stage timings and the slowest functions of the profile."""
+        functions = self._function_times()
+        stages: Dict[str, float] = {}
+        for entry in functions:
+            stage = STAGE_FUNCTIONS.get(entry["name"])
+            # Wrapper annidati con lo stesso nome (complete): conta il più esterno
+            if stage is not None:
+                stages[stage] = max(stages.get(stage, 0.0), entry["cumulative_ms"])
+        top = sorted(functions, key=lambda entry: entry["cumulative_ms"], reverse=True)
+        return {"stages_ms": stages, "top_functions": top[:settings.PROFILE_TOP_FUNCTIONS]}
+
+    def folded_stacks(self) -> str:
+        """Return the sampled stacks in the collapsed format of flamegraph.pl and speedscope."""
+        return "".join(
+            ";".join(_frame_label(*frame) for frame in stack) + f" {count}\n"
+            for stack, count in self.samples.most_common()
+        )
+
+
+class RequestProfiler:
+    """Decides which queries are profiled and writes their profiles to PROFILE_DIR."""
+
+    def __init__(self, directory: Optional[str] = None, sample_rate: Optional[float] = None,
+                 sample_mode: Optional[str] = None, max_files: Optional[int] = None):
+        """Configure the profiler (defaults from settings)."""
+        self.directory = directory or settings.PROFILE_DIR
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.sample_mode = sample_mode or settings.PROFILE_SAMPLE_MODE
+        self.max_files = settings.PROFILE_MAX_FILES if max_files is None else max_files
+        # Un profilo alla volta: il costo resta limitato e cProfile non si sovrappone
+        self._busy = threading.Lock()
+
+    def start(self, requested_mode: Optional[str] = None) -> Optional[QueryProfile]:
+        """Return a profile for a query, or None if the query is not profiled.
+
+        Args:
+            requested_mode: Mode asked for by an authenticated admin header, if any
+        """
+        if requested_mode:
+            mode, trigger = requested_mode.strip().lower(), "header"
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            mode, trigger = self.sample_mode, "sample"
+        else:
+            return None
+        if mode not in MODES:
+            logger.warning(f"Unknown profile mode '{mode}', expected one of {MODES}")
+            return None
+
+        if not self._busy.acquire(blocking=False):
+            metrics.inc("cri_profiles_skipped_total")
+            return None
+        metrics.inc("cri_profiles_total", mode=mode, trigger=trigger)
+        return QueryProfile(mode, trigger)
+
+    def save(self, profile: QueryProfile, request_id: Optional[str], status: int,
+             elapsed: float, degradations: List[str]) -> Optional[Dict[str, Any]]:
+        """Write a finished profile and its metadata, and let the next query be profiled.
+
+        A profile whose pipeline did not run (e.g. a coalesced request) is discarded.
+        """
+        try:
+            if profile.duration is None:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(profile.started_at))
+            base = os.path.join(self.directory, f"profile-{stamp}-{request_id or f'{status}-{os.getpid()}'}")
+
+            if profile.profiler is not None:
+                data_path = base + ".prof"
+                profile.profiler.dump_stats(data_path)
+            else:
+                data_path = base + ".folded"
+                with open(data_path, "w", encoding="utf-8") as f:
+                    f.write(profile.folded_stacks())
+
+            metadata = {
+                "request_id": request_id,
+                "status": status,
+                "mode": profile.mode,
+                "trigger": profile.trigger,
+                "started_at": profile.started_at,
+                "elapsed_ms": round(elapsed * 1000),
+                "pipeline_ms": round(profile.duration * 1000),
+                "degradations": degradations,
+                "data_file": os.path.basename(data_path),
+                **profile.summary(),
+            }
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=1)
+            self._prune()
+            logger.info(f"Saved {profile.mode} profile of request {request_id}", path=data_path,
+                        stages_ms=metadata["stages_ms"])
+            return metadata
+        except OSError as e:
+            logger.error(f"Failed to save profile: {str(e)}")
+            return None
+        finally:
+            self._busy.release()
+
+    def list_profiles(self) -> List[str]:
+        """Return the metadata files of the saved profiles, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith("profile-") and name.endswith(".json"))
+
+    def _prune(self) -> None:
+        """Delete the oldest profiles beyond max_files."""
+        names = self.list_profiles()
+        for name in names[:max(0, len(names) - self.max_files)]:
+            base = os.path.join(self.directory, name[:-len(".json")])
+            for suffix in (".json", ".prof", ".folded"):
+                if os.path.exists(base + suffix):
+                    os.remove(base + suffix)
+
+
+def measure_memory(root: Any, max_objects: Optional[int] = None) -> Dict[str, Any]:
+    """Return the objects and bytes reachable from root, and their allocation sites if tracemalloc traces.
+
+    Types, modules and functions are shared with the rest of the process and are
+    not followed. Objects reachable from several structures count in each.
+    """
+    max_objects = max_objects or settings.PROFILE_MEMORY_MAX_OBJECTS
+    tracing = tracemalloc.is_tracing()
+    seen = set()
+    stack = [root]
+    size = 0
+    sites: "Counter[str]" = Counter()
+    while stack and len(seen) < max_objects:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        obj_size = sys.getsizeof(obj, 0)
+        size += obj_size
+        if tracing:
+            traceback = tracemalloc.get_object_traceback(obj)
+            if traceback is not None:
+                sites[f"{traceback[-1].filename}:{traceback[-1].lineno}"] += obj_size
+        stack.extend(gc.get_referents(obj))
+
+    report: Dict[str, Any] = {"objects": len(seen), "bytes": size, "truncated": bool(stack)}
+    if hasattr(root, "__len__"):
+        report["entries"] = len(root)
+    if tracing:
+        report["allocation_sites"] = [{"site": site, "bytes": site_bytes}
+                                      for site, site_bytes in sites.most_common(settings.PROFILE_TOP_FUNCTIONS)]
+    return report
+
+
+class TracemallocSession:
+    """tracemalloc driven by the admin endpoints: start, snapshots diffed against the previous one, stop."""
+
+    def __init__(self, directory: Optional[str] = None):
+        """Prepare the session; tracing starts with ``start()`` (or PYTHONTRACEMALLOC)."""
+        self.directory = directory or settings.PROFILE_DIR
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def start(self, frames: Optional[int] = None) -> Dict[str, Any]:
+        """Start tracing allocations (restarting with a new depth if already tracing)."""
+        frames = frames or settings.TRACEMALLOC_FRAMES
+        with self._lock:
+            if tracemalloc.is_tracing() and tracemalloc.get_traceback_limit() != frames:
+                tracemalloc.stop()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._previous = None
+                logger.warning(f"tracemalloc started with {frames} frames")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop tracing and free the traces."""
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+        logger.info("tracemalloc stopped")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        """Return whether tracemalloc traces and the memory it traced."""
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {"tracing": tracing, "frames": tracemalloc.get_traceback_limit() if tracing else 0,
+                "traced_bytes": current, "traced_peak_bytes": peak}
+
+    def snapshot(self, stores: Dict[str, Any], top: Optional[int] = None) -> Dict[str, Any]:
+        """Dump a snapshot to PROFILE_DIR and report the top allocation sites and the memory of the stores.
+
+        Args:
+            stores: Structures to measure, by name (session store, caches...)
+            top: Allocation sites returned (default PROFILE_TOP_FUNCTIONS)
+
+        Raises:
+            RuntimeError: If tracemalloc is not tracing
+        """
+        top = top or settings.PROFILE_TOP_FUNCTIONS
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("tracemalloc is not tracing")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            previous, self._previous = self._previous, snapshot
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"tracemalloc-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+                                                f"-{int(time.time() * 1000) % 1000:03d}.snap")
+            snapshot.dump(path)
+
+            report = self.status()
+            report["snapshot_file"] = os.path.basename(path)
+            report["top_allocations"] = [
+                {"site": str(stat.traceback[-1]), "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics("lineno")[:top]
+            ]
+            if previous is not None:
+                report["growth_since_previous"] = [
+                    {"site": str(stat.traceback[-1]), "bytes_diff": stat.size_diff, "blocks_diff": stat.count_diff}
+                    for stat in snapshot.compare_to(previous, "lineno")[:top]
+                ]
+            report["stores"] = {name: measure_memory(store) for name, store in stores.items()}
+        logger.info(f"Saved tracemalloc snapshot {path}", traced_bytes=report["traced_bytes"])
+        return report
+
+
+request_profiler = RequestProfiler()
+tracemalloc_session = TracemallocSession()
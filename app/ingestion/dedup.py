@@ -0,0 +1,294 @@
+"""Near-duplicate chunk detection for the CroceRossa ingestion pipeline.
+
+Regulations, circulars and their updated versions repeat whole sections, so
+many chunks are copies (or near copies) of chunks of other documents. Each
+chunk gets a MinHash signature of its word shingles; an LSH index (signatures
+split in bands, one bucket table per band) finds the chunks already indexed
+that probably share most of their shingles, and the estimated Jaccard
+similarity of the signatures confirms them against INGEST_DEDUP_THRESHOLD.
+
+The first chunk of a group is canonical and names the group (the first 16 hex
+digits of its content hash); every chunk records its group in
+``metadata.duplicate_group``, so retrieval can collapse the chunks of a group.
+Every chunk is indexed by default (INGEST_DEDUP_MODE ``tag``), so scoped
+queries still find a section under each document that contains it. With
+``drop`` the other chunks of a group are neither embedded nor upserted, and
+their source, committee and date are not searchable.
+
+The index is saved with the ingestion manifest, so incremental runs see the
+chunks of unchanged files. A re-read file gets back the canonical chunks it
+still contains; when a canonical chunk is gone for good (its file changed or
+was removed) the other members of its group are forgotten and their files are
+re-read, so that one of them becomes canonical.
+"""
+
+import json
+import os
+import re
+import tempfile
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.ingestion.loader import Chunk
+from app.rag.filters import DUPLICATE_GROUP_KEY
+
+logger = get_logger(__name__)
+
+DROP = "drop"
+TAG = "tag"
+
+# Parole e numeri: articoli e commi con numeri diversi non sono duplicati
+SHINGLE_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Primo di Mersenne 2^61 - 1: (a * h + b) con a, h < 2^32 non supera 2^64
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(text: str, size: Optional[int] = None) -> np.ndarray:
+    """Return the 32-bit hashes of the word shingles of a text (the whole text if shorter)."""
+    size = size or settings.INGEST_DEDUP_SHINGLE_SIZE
+    words = SHINGLE_TOKEN_PATTERN.findall(text.lower())
+    shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                       count=len(shingles))
+
+
+def lsh_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Return the (bands, rows) split of a signature whose LSH threshold is closest below threshold.
+
+    Two chunks with Jaccard similarity s share a bucket with probability
+    1 - (1 - s^rows)^bands, which rises steeply around (1 / bands)^(1 / rows).
+    Staying below the target catches more candidates, confirmed afterwards on
+    the whole signature.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """MinHash signatures from universal hash permutations of the shingle hashes."""
+
+    def __init__(self, num_perm: Optional[int] = None, seed: int = 1):
+        """Draw the permutations (the same seed always gives comparable signatures)."""
+        self.num_perm = num_perm or settings.INGEST_DEDUP_NUM_PERM
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=self.num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """Return the MinHash signature of a text."""
+        hashes = shingle_hashes(text)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """LSH index of the chunk signatures of a collection, with their duplicate groups."""
+
+    def __init__(self, collection_name: str, threshold: Optional[float] = None, num_perm: Optional[int] = None):
+        """Create an empty index.
+
+        Args:
+            collection_name: Collection the chunks are indexed in
+            threshold: Estimated Jaccard similarity from which two chunks are duplicates
+            num_perm: Signature length
+        """
+        self.collection_name = collection_name
+        self.threshold = settings.INGEST_DEDUP_THRESHOLD if threshold is None else threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands, self.rows = lsh_bands(self.hasher.num_perm, self.threshold)
+        # entry ID -> (file_key, content_hash, group, canonical); firme nella stessa posizione
+        self.entries: Dict[int, Tuple[str, str, str, bool]] = {}
+        self.signatures: Dict[int, np.ndarray] = {}
+        self._by_file: Dict[str, List[int]] = {}
+        self._by_group: Dict[str, Set[int]] = {}
+        self._buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(self.bands)]
+        # Gruppi il cui chunk canonico è stato rimosso, in attesa che ricompaia
+        self._headless: Set[str] = set()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        """Return the number of indexed chunks."""
+        return len(self.entries)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        """Return the bucket key of each band of a signature."""
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _add(self, file_key: str, content_hash: str, group: str, canonical: bool, signature: np.ndarray) -> None:
+        """Index a chunk."""
+        entry_id = self._next_id
+        self._next_id += 1
+        self.entries[entry_id] = (file_key, content_hash, group, canonical)
+        self.signatures[entry_id] = signature
+        self._by_file.setdefault(file_key, []).append(entry_id)
+        self._by_group.setdefault(group, set()).add(entry_id)
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(key, set()).add(entry_id)
+
+    def _discard(self, entry_id: int) -> None:
+        """Remove a chunk from the index."""
+        file_key, _, group, _ = self.entries.pop(entry_id)
+        signature = self.signatures.pop(entry_id)
+        self._by_group[group].discard(entry_id)
+        if not self._by_group[group]:
+            del self._by_group[group]
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            bucket = band.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del band[key]
+        ids = self._by_file.get(file_key)
+        if ids is not None:
+            ids.remove(entry_id)
+            if not ids:
+                del self._by_file[file_key]
+
+    def _match(self, signature: np.ndarray) -> Optional[str]:
+        """Return the group of the most similar indexed chunk, if similar enough."""
+        candidates: Set[int] = set()
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            candidates |= band.get(key, set())
+        best_group, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            similarity = float(np.mean(self.signatures[entry_id] == signature))
+            if similarity >= best_similarity:
+                best_group, best_similarity = self.entries[entry_id][2], similarity
+        return best_group
+
+    def remove_file(self, file_key: str) -> None:
+        """Forget the chunks of a file (before re-reading it, or when it was deleted)."""
+        for entry_id in list(self._by_file.get(file_key, [])):
+            _, _, group, canonical = self.entries[entry_id]
+            self._discard(entry_id)
+            if canonical and group in self._by_group:
+                self._headless.add(group)
+
+    def assign(self, file_key: str, chunks: List[Chunk]) -> Tuple[List[Chunk], int]:
+        """Assign each chunk of a file to a duplicate group.
+
+        The file's previous chunks must have been removed with remove_file().
+        Each chunk gets ``metadata.duplicate_group``.
+
+        Returns:
+            The chunks to index (only the canonical ones in ``drop`` mode) and
+            the number of duplicates found
+        """
+        kept: List[Chunk] = []
+        duplicates = 0
+        for chunk in chunks:
+            signature = self.hasher.signature(chunk.text)
+            own_group = chunk.content_hash[:16]
+            if own_group in self._headless:
+                # Chunk canonico invariato di un file riletto: il gruppo ritrova il suo canonico
+                self._headless.discard(own_group)
+                group = own_group
+            else:
+                group = self._match(signature)
+            canonical = group is None or group == own_group and not self._has_canonical(group)
+            group = group or own_group
+            chunk.metadata[DUPLICATE_GROUP_KEY] = group
+            self._add(file_key, chunk.content_hash, group, canonical, signature)
+            if not canonical:
+                duplicates += 1
+            if canonical or settings.INGEST_DEDUP_MODE != DROP:
+                kept.append(chunk)
+        return kept, duplicates
+
+    def _has_canonical(self, group: str) -> bool:
+        """Return True if a group has a canonical chunk."""
+        return any(self.entries[entry_id][3] for entry_id in self._by_group.get(group, ()))
+
+    def orphaned_files(self) -> Set[str]:
+        """Forget the members of the groups whose canonical chunk is gone and return their files.
+
+        The files must be re-read: their chunks are assigned again, and one of
+        them becomes the canonical chunk of each group.
+        """
+        files: Set[str] = set()
+        for group in self._headless:
+            for member_id in list(self._by_group.get(group, ())):
+                files.add(self.entries[member_id][0])
+                self._discard(member_id)
+        self._headless.clear()
+        return files
+
+    def rebuild_from_collection(self, client: Any, batch_size: int = 256) -> None:
+        """Rebuild the index from the chunk texts and groups stored in the collection."""
+        offset = None
+        while True:
+            records, offset = client.scroll(collection_name=self.collection_name, limit=batch_size, offset=offset,
+                                            with_payload=["page_content", "file_key", "content_hash", "metadata"],
+                                            with_vectors=False)
+            for record in records:
+                payload = record.payload or {}
+                text, file_key = payload.get("page_content"), payload.get("file_key")
+                if not text or not file_key:
+                    continue
+                chunk_hash = payload.get("content_hash") or ""
+                group = (payload.get("metadata") or {}).get(DUPLICATE_GROUP_KEY) or chunk_hash[:16]
+                self._add(file_key, chunk_hash, group, group == chunk_hash[:16], self.hasher.signature(text))
+            if offset is None:
+                break
+        logger.info(f"Rebuilt duplicate index from {len(self)} chunks of '{self.collection_name}'")
+
+    def save(self, path: str) -> None:
+        """Write the index atomically (entries as JSON, signatures as a uint32 matrix)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        ids = sorted(self.entries)
+        header = {
+            "collection": self.collection_name,
+            "threshold": self.threshold,
+            "entries": [list(self.entries[entry_id]) for entry_id in ids],
+        }
+        matrix = np.array([self.signatures[entry_id] for entry_id in ids], dtype=np.uint32)
+        # Firme casuali, incomprimibili: salvataggio non compresso, ripetuto a ogni finestra
+        with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".npz", delete=False) as f:
+            np.savez(f, signatures=matrix.reshape(len(ids), self.hasher.num_perm),
+                                header=np.array(json.dumps(header, ensure_ascii=False)))
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str, collection_name: str) -> Optional["DuplicateIndex"]:
+        """Read an index written by save(), or return None if it belongs to another collection or setup."""
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            signatures = data["signatures"]
+        index = cls(collection_name)
+        if header.get("collection") != collection_name or header.get("threshold") != index.threshold \
+                or signatures.shape[1:] != (index.hasher.num_perm,):
+            return None
+        for entry, signature in zip(header["entries"], signatures):
+            index._add(entry[0], entry[1], entry[2], bool(entry[3]), signature)
+        return index
+
+
+def load_duplicate_index(client: Any, collection_name: str, rebuild: bool = True,
+                         path: Optional[str] = None) -> DuplicateIndex:
+    """Return the duplicate index of a collection, rebuilt from its points if missing or stale."""
+    path = path or settings.INGEST_DEDUP_INDEX_PATH
+    if os.path.exists(path):
+        try:
+            index = DuplicateIndex.load(path, collection_name)
+            if index is not None:
+                logger.info(f"Loaded duplicate index of {len(index)} chunks", path=path)
+                return index
+            logger.warning("Duplicate index belongs to another collection or setup, rebuilding it", path=path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Unreadable duplicate index {path}, rebuilding it: {str(e)}")
+    index = DuplicateIndex(collection_name)
+    if rebuild and client.count(collection_name, exact=False).count:
+        index.rebuild_from_collection(client)
+    return index
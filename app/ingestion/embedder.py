@@ -0,0 +1,129 @@
+"""Rate-limited, batched embedding for the CroceRossa ingestion pipeline.
+
+Chunks are grouped into requests bounded both by number of inputs and by
+tokens, and sent with bounded concurrency. A tokens-per-minute budget keeps the
+pipeline under the OpenAI rate limit instead of bouncing off 429 retries.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenRateLimiter:
+    """Thread-safe token bucket refilled continuously at tokens_per_minute."""
+
+    def __init__(self, tokens_per_minute: int):
+        """Initialize a full bucket."""
+        self.capacity = float(tokens_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        """Block until ``tokens`` can be spent."""
+        # Una richiesta più grande del bucket aspetterebbe per sempre
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BatchEmbedder:
+    """Embeds texts in token-bounded batches with bounded concurrency."""
+
+    def __init__(self,
+                 embed_batch: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                 batch_size: Optional[int] = None,
+                 max_tokens_per_batch: Optional[int] = None,
+                 concurrency: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None):
+        """Initialize the embedder.
+
+        Args:
+            embed_batch: Function embedding a list of texts; defaults to the OpenAI embedding model
+            batch_size: Maximum inputs per request (INGEST_EMBED_BATCH_SIZE)
+            max_tokens_per_batch: Maximum tokens per request (INGEST_EMBED_MAX_TOKENS_PER_BATCH)
+            concurrency: Parallel embedding requests (INGEST_EMBED_CONCURRENCY)
+            tokens_per_minute: Token budget (INGEST_EMBED_TOKENS_PER_MINUTE)
+        """
+        from llama_index.core.utils import get_tokenizer
+
+        if embed_batch is None:
+            from app.rag.components import create_embed_model
+
+            batch_size = batch_size or settings.INGEST_EMBED_BATCH_SIZE
+            embed_model = create_embed_model(embed_batch_size=batch_size)
+            embed_batch = embed_model.get_text_embedding_batch
+
+        self.embed_batch = embed_batch
+        self.batch_size = batch_size or settings.INGEST_EMBED_BATCH_SIZE
+        self.max_tokens_per_batch = max_tokens_per_batch or settings.INGEST_EMBED_MAX_TOKENS_PER_BATCH
+        self.concurrency = concurrency or settings.INGEST_EMBED_CONCURRENCY
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute or settings.INGEST_EMBED_TOKENS_PER_MINUTE)
+        # Tokenizer cl100k_base, lo stesso dei modelli text-embedding-3
+        self.tokenizer = get_tokenizer()
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed")
+
+    def count_tokens(self, text: str) -> int:
+        """Return the number of tokens of a text for the embedding model."""
+        return len(self.tokenizer(text))
+
+    def plan_batches(self, token_counts: List[int]) -> List[List[int]]:
+        """Group text indices into batches bounded by inputs and tokens."""
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, tokens in enumerate(token_counts):
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.max_tokens_per_batch):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_one_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        """Wait for the token budget, then embed one batch."""
+        self.rate_limiter.acquire(tokens)
+        return self.embed_batch(texts)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, preserving their order."""
+        if not texts:
+            return []
+
+        token_counts = [self.count_tokens(text) for text in texts]
+        batches = self.plan_batches(token_counts)
+        futures = []
+        for batch in batches:
+            batch_texts = [texts[i] for i in batch]
+            tokens = sum(token_counts[i] for i in batch)
+            futures.append(self.executor.submit(self._embed_one_batch, batch_texts, tokens))
+
+        vectors: List[Any] = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+
+        logger.debug(f"Embedded {len(texts)} texts in {len(batches)} requests")
+        return vectors
+
+    def close(self) -> None:
+        """Shut down the worker threads."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,133 @@
+"""Document loading and chunking for the CroceRossa ingestion pipeline.
+
+Documents are streamed one file at a time from a directory tree. Each chunk is
+turned into the payload schema read by the RAG engine:
+``{"page_content": <text>, "metadata": {...}}``, plus the ``file_key``,
+``content_hash`` and ``embedding_model`` keys used by incremental re-indexing.
+
+Metadata comes from the file itself (``source``, ``document_type`` taken from the
+first-level sub-directory) and can be completed with a sidecar JSON file named
+``<file>.meta.json`` (e.g. ``{"committee": "Comitato di Roma", "date": "2024-05-10"}``).
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md", ".docx", ".html")
+SIDECAR_SUFFIX = ".meta.json"
+
+
+class Chunk:
+    """A chunk of a source document, ready to be embedded and upserted."""
+
+    __slots__ = ("file_key", "index", "text", "metadata", "content_hash")
+
+    def __init__(self, file_key: str, index: int, text: str, metadata: Dict[str, Any]):
+        """Create a chunk.
+
+        Args:
+            file_key: Path of the source file relative to the ingestion root
+            index: Position of the chunk inside the file
+            text: The chunk text
+            metadata: Metadata stored in the payload
+        """
+        self.file_key = file_key
+        self.index = index
+        self.text = text
+        self.metadata = metadata
+        self.content_hash = content_hash(text)
+
+    def metadata_hash(self) -> str:
+        """Return a fingerprint of the chunk metadata."""
+        return metadata_hash(self.metadata)
+
+    def payload(self, embedding_model: str) -> Dict[str, Any]:
+        """Return the Qdrant payload for this chunk, tagged with the model that embedded it."""
+        return {
+            "page_content": self.text,
+            "metadata": self.metadata,
+            "file_key": self.file_key,
+            "content_hash": self.content_hash,
+            "embedding_model": embedding_model,
+        }
+
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of a chunk text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def metadata_hash(metadata: Dict[str, Any]) -> str:
+    """Return a short, order-independent fingerprint of chunk metadata."""
+    encoded = json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def iter_document_files(root: str) -> Iterator[Path]:
+    """Yield supported document files under root, in a stable order."""
+    root_path = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root_path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            if filename.startswith(".") or filename.endswith(SIDECAR_SUFFIX):
+                continue
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield Path(dirpath) / filename
+
+
+def file_metadata(path: Path, root: str) -> Dict[str, Any]:
+    """Build the chunk metadata for a file, merged with its optional sidecar JSON."""
+    relative = path.relative_to(root)
+    metadata: Dict[str, Any] = {"source": path.name}
+    if len(relative.parts) > 1:
+        metadata["document_type"] = relative.parts[0]
+
+    sidecar = path.with_name(path.name + SIDECAR_SUFFIX)
+    if sidecar.exists():
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                metadata.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Invalid metadata sidecar {sidecar}: {str(e)}")
+    return metadata
+
+
+class DocumentChunker:
+    """Reads single files and splits them into sentence-aware chunks."""
+
+    def __init__(self, chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None):
+        """Initialize the splitter with the configured chunk size and overlap."""
+        from llama_index.core.node_parser import SentenceSplitter
+
+        self.splitter = SentenceSplitter(
+            chunk_size=chunk_size or settings.INGEST_CHUNK_SIZE,
+            chunk_overlap=chunk_overlap if chunk_overlap is not None else settings.INGEST_CHUNK_OVERLAP,
+        )
+
+    def chunk_file(self, path: Path, root: str) -> List[Chunk]:
+        """Load a file and return its chunks (empty if the file has no text)."""
+        from llama_index.core import SimpleDirectoryReader
+
+        file_key = str(path.relative_to(root))
+        metadata = file_metadata(path, root)
+
+        # I PDF vengono letti pagina per pagina: il numero di pagina finisce nei metadata
+        documents = SimpleDirectoryReader(input_files=[str(path)], raise_on_error=True).load_data()
+        chunks: List[Chunk] = []
+        for document in documents:
+            if not document.text or not document.text.strip():
+                continue
+            page_metadata = dict(metadata)
+            if document.metadata.get("page_label"):
+                page_metadata["page"] = document.metadata["page_label"]
+            for text in self.splitter.split_text(document.text):
+                chunks.append(Chunk(file_key=file_key, index=len(chunks), text=text, metadata=dict(page_metadata)))
+        return chunks
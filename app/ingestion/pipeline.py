@@ -0,0 +1,606 @@
+"""Streaming, parallel ingestion of a document directory into the Qdrant collection.
+
+Usage:
+    python -m app.ingestion.pipeline /path/to/documenti [--collection NAME] [--reset] [--keep-missing]
+    python -m app.ingestion.pipeline /path/to/documenti --new-version [--no-swap]
+
+Files are read and chunked one at a time, embedded in rate-limited batches with
+bounded concurrency and upserted to Qdrant in parallel batches. The upserts of a
+window of files overlap with the embedding of the next one.
+
+Indexing is incremental: every point carries the hash of its chunk text and the
+embedding model tag, and a local manifest records the points of each file. Only
+new or changed chunks are embedded, chunks that disappeared are deleted, and the
+manifest (saved after each window) lets a crashed run resume where it stopped.
+
+With ``--new-version`` the run builds a new versioned collection behind the
+``QDRANT_COLLECTION`` alias and swaps the alias atomically once it is complete.
+The manifest records the version being built: a run interrupted before the swap
+is resumed in the same collection by the next ``--new-version`` run.
+
+Near-duplicate chunks (sections repeated across documents) are grouped with
+MinHash/LSH before planning; see ``app.ingestion.dedup``.
+"""
+
+import argparse
+import json
+import os
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.logging import configure_logging, get_logger
+from app.ingestion.dedup import DuplicateIndex, load_duplicate_index
+from app.ingestion.embedder import BatchEmbedder
+from app.ingestion.loader import Chunk, DocumentChunker, iter_document_files, metadata_hash
+from app.rag.qdrant_search import create_qdrant_client, point_vectors
+from app.rag.spelling import build_spelling_index
+from app.rag.versioning import VERSION_SEPARATOR, resolve_alias, swap_alias, versioned_name
+
+logger = get_logger(__name__)
+
+
+def embedding_model_tag() -> str:
+    """Return the tag identifying the embedding model and dimensions of the vectors."""
+    return f"{settings.EMBEDDING_MODEL}/{settings.EMBEDDING_DIMENSIONS}"
+
+
+def point_id(file_key: str, chunk_hash: str, occurrence: int = 0) -> str:
+    """Return a deterministic point ID derived from the chunk content.
+
+    An unchanged chunk keeps its ID even if earlier chunks of the file change;
+    ``occurrence`` disambiguates identical chunks in the same file.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_key}#{chunk_hash}#{occurrence}"))
+
+
+def file_signature(path: Path) -> Dict[str, float]:
+    """Return size and modification time of a file, used to detect changes."""
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class IngestManifest:
+    """Local record of the points indexed for every file of a collection.
+
+    For each file it stores the size/modification time seen at indexing and the
+    ID of each of its points with a fingerprint of the point metadata. A point
+    whose fingerprint is None must be re-embedded (e.g. after a model change).
+    The manifest is saved after every window, so it is also the resume checkpoint.
+
+    While a new collection version is built, ``building`` holds the version it
+    is copied from and the files already written to the new one.
+    """
+
+    def __init__(self, path: str, collection_name: str, embedding_model: str):
+        """Load the manifest, discarding it if it belongs to another collection."""
+        self.path = path
+        self.collection_name = collection_name
+        self.embedding_model = embedding_model
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.building: Optional[Dict[str, Any]] = None
+        self.built_files: Set[str] = set()
+        self.loaded = False
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("collection") == collection_name:
+                    self.files = data.get("files", {})
+                    if data.get("building") is not None:
+                        self.building = {"source": data["building"].get("source")}
+                        self.built_files = set(data["building"].get("files", []))
+                    self.loaded = True
+                    logger.info(f"Loaded manifest with {len(self.files)} indexed files", path=path)
+                    if data.get("embedding_model") != embedding_model:
+                        logger.warning("Embedding model changed, every chunk will be re-embedded",
+                                       previous=data.get("embedding_model"), current=embedding_model)
+                        self.invalidate()
+                else:
+                    logger.warning("Manifest belongs to another collection, starting from scratch",
+                                   manifest_collection=data.get("collection"))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable manifest {path}, starting from scratch: {str(e)}")
+
+    @staticmethod
+    def pending_build(path: str) -> Optional[Dict[str, Any]]:
+        """Return the collection version left unfinished in a manifest and its source, if any."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not data.get("building") or not data.get("collection"):
+            return None
+        return {"collection": data["collection"], "source": data["building"].get("source")}
+
+    def start_build(self, source: Optional[str], restart: bool = False) -> None:
+        """Record that a new version copied from ``source`` is being built (resumed unless ``restart``)."""
+        if self.building is None or restart:
+            self.building = {"source": source}
+            self.built_files = set()
+
+    def finish_build(self) -> None:
+        """Forget the build record once the new version is live."""
+        self.building = None
+        self.built_files = set()
+
+    def is_built(self, file_key: str) -> bool:
+        """Return True if the file was already written to the version being built."""
+        return self.building is not None and file_key in self.built_files
+
+    def rebuild_from_collection(self, client: Any) -> None:
+        """Rebuild the manifest from the ``file_key``/``content_hash`` tags stored in the payloads."""
+        offset = None
+        points_count = 0
+        while True:
+            records, offset = client.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=["file_key", "embedding_model", "metadata"],
+                with_vectors=False,
+            )
+            for record in records:
+                payload = record.payload or {}
+                file_key = payload.get("file_key")
+                if not file_key:
+                    continue
+                entry = self.files.setdefault(file_key, {"size": None, "mtime": None, "points": {}})
+                fingerprint = None
+                if payload.get("embedding_model") == self.embedding_model:
+                    fingerprint = metadata_hash(payload.get("metadata") or {})
+                entry["points"][str(record.id)] = fingerprint
+                points_count += 1
+            if offset is None:
+                break
+        logger.info(f"Rebuilt manifest from {points_count} points of {len(self.files)} files")
+
+    def invalidate(self) -> None:
+        """Force every file to be re-read and every chunk to be re-embedded."""
+        for entry in self.files.values():
+            entry["size"] = entry["mtime"] = None
+            entry["points"] = {pid: None for pid in entry["points"]}
+
+    def is_unchanged(self, file_key: str, signature: Dict[str, float]) -> bool:
+        """Return True if the file was fully indexed and has not changed since."""
+        entry = self.files.get(file_key)
+        return bool(entry) and entry["size"] == signature["size"] and entry["mtime"] == signature["mtime"]
+
+    def points(self, file_key: str) -> Dict[str, Optional[str]]:
+        """Return the indexed point IDs of a file with their metadata fingerprint."""
+        entry = self.files.get(file_key)
+        return dict(entry["points"]) if entry else {}
+
+    def update(self, file_key: str, signature: Dict[str, float], points: Dict[str, str]) -> None:
+        """Record the points of a fully indexed file."""
+        self.files[file_key] = {**signature, "points": points}
+        if self.building is not None:
+            self.built_files.add(file_key)
+
+    def remove(self, file_key: str) -> None:
+        """Forget a file whose points were deleted."""
+        self.files.pop(file_key, None)
+        self.built_files.discard(file_key)
+
+    def save(self) -> None:
+        """Write the manifest atomically."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        data: Dict[str, Any] = {
+            "collection": self.collection_name,
+            "embedding_model": self.embedding_model,
+            "files": self.files,
+        }
+        if self.building is not None:
+            data["building"] = {**self.building, "files": sorted(self.built_files)}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class FilePlan:
+    """The work needed to bring the points of one file up to date."""
+
+    __slots__ = ("file_key", "signature", "points", "to_embed", "to_refresh", "to_delete", "reused")
+
+    def __init__(self, file_key: str, signature: Dict[str, float]):
+        """Create an empty plan."""
+        self.file_key = file_key
+        self.signature = signature
+        # point ID -> fingerprint dei metadata, come verrà salvato nel manifest
+        self.points: Dict[str, str] = {}
+        self.to_embed: List[Tuple[str, Chunk]] = []
+        self.to_refresh: List[Tuple[str, Chunk]] = []
+        self.to_delete: List[str] = []
+        self.reused = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of points to upsert."""
+        return len(self.to_embed) + len(self.to_refresh)
+
+
+def plan_file(file_key: str, signature: Dict[str, float], chunks: List[Chunk],
+              indexed: Dict[str, Optional[str]], copy: bool = False) -> FilePlan:
+    """Diff the new chunks of a file against its indexed points.
+
+    New chunks are embedded; unchanged chunks whose metadata changed keep their
+    stored vector and only get a new payload; points no longer produced are deleted.
+    With ``copy`` (building a new collection version) every unchanged chunk is
+    copied with its stored vector.
+    """
+    plan = FilePlan(file_key, signature)
+    occurrences: Dict[str, int] = {}
+    for chunk in chunks:
+        occurrence = occurrences.get(chunk.content_hash, 0)
+        occurrences[chunk.content_hash] = occurrence + 1
+        pid = point_id(file_key, chunk.content_hash, occurrence)
+        fingerprint = chunk.metadata_hash()
+        plan.points[pid] = fingerprint
+
+        previous = indexed.get(pid)
+        if previous is None:
+            plan.to_embed.append((pid, chunk))
+        elif copy or previous != fingerprint:
+            plan.to_refresh.append((pid, chunk))
+        else:
+            plan.reused += 1
+
+    if not copy:
+        plan.to_delete = [pid for pid in indexed if pid not in plan.points]
+    return plan
+
+
+class IngestionPipeline:
+    """Reads, chunks, embeds and upserts a directory of documents.
+
+    By default the collection (or the collection behind the alias) is updated in
+    place. With ``new_version`` a new ``<alias>_v<timestamp>`` collection is built,
+    copying unchanged chunks from the current version, and the alias is swapped
+    to it only once it is complete. A version left unfinished by an interrupted
+    run is resumed instead, skipping the files it already holds.
+    """
+
+    def __init__(self,
+                 root: str,
+                 collection_name: Optional[str] = None,
+                 manifest_path: Optional[str] = None,
+                 client: Any = None,
+                 embedder: Optional[BatchEmbedder] = None,
+                 chunker: Optional[DocumentChunker] = None,
+                 new_version: bool = False):
+        """Initialize the pipeline; clients are created from Settings unless provided."""
+        self.root = root
+        self.client = client or create_qdrant_client()
+        self.alias = collection_name or settings.QDRANT_COLLECTION
+        current = resolve_alias(self.client, self.alias)
+        self.manifest_path = manifest_path or settings.INGEST_MANIFEST_PATH
+        self.new_version = new_version
+        self.source_collection: Optional[str] = None
+        self.resuming = False
+        if new_version:
+            if current is None and self.client.collection_exists(self.alias):
+                raise ValueError(f"'{self.alias}' is a collection, not an alias: "
+                                 "set QDRANT_COLLECTION to a new alias name to use versioned collections")
+            self.source_collection = current
+            self.collection_name = self._unfinished_version(current) or versioned_name(self.alias)
+        else:
+            self.collection_name = current or self.alias
+        self.embedding_model = embedding_model_tag()
+        self.embedder = embedder or BatchEmbedder()
+        self.chunker = chunker or DocumentChunker()
+        self.upsert_executor = ThreadPoolExecutor(max_workers=settings.INGEST_UPSERT_CONCURRENCY,
+                                                  thread_name_prefix="upsert")
+        # Numero di chunk accumulati prima di embedding e upsert
+        self.window_size = settings.INGEST_EMBED_BATCH_SIZE * settings.INGEST_EMBED_CONCURRENCY * 2
+        self.stats = {
+            "files_indexed": 0, "files_unchanged": 0, "files_removed": 0, "files_failed": 0,
+            "chunks_embedded": 0, "chunks_refreshed": 0, "chunks_reused": 0, "chunks_deleted": 0,
+            "chunks_duplicate": 0,
+        }
+        self.dedup: Optional[DuplicateIndex] = None
+
+    def _unfinished_version(self, current: Optional[str]) -> Optional[str]:
+        """Return the version an interrupted run was building from the current one, if it can be resumed."""
+        build = IngestManifest.pending_build(self.manifest_path)
+        if build is None or not build["collection"].startswith(self.alias + VERSION_SEPARATOR):
+            return None
+        # Se nel frattempo l'alias è stato spostato la versione incompleta parte da dati superati
+        if build["collection"] == current or build["source"] != current:
+            return None
+        if not self.client.collection_exists(build["collection"]):
+            return None
+        logger.info(f"Resuming unfinished version '{build['collection']}'", source=current)
+        self.resuming = True
+        return build["collection"]
+
+    def ensure_collection(self) -> None:
+        """Create the collection and its payload indexes if they do not exist yet."""
+        from app.rag.collection import create_collection, create_payload_indexes
+
+        if not self.client.collection_exists(self.collection_name):
+            create_collection(self.client, self.collection_name)
+        create_payload_indexes(self.client, self.collection_name)
+
+    @property
+    def copying(self) -> bool:
+        """True when building a new version on top of an existing one."""
+        return self.source_collection is not None
+
+    def _stored_vectors(self, ids: List[str]) -> Dict[str, Any]:
+        """Fetch the stored vectors of existing points (from the previous version when copying)."""
+        batch_size = settings.INGEST_UPSERT_BATCH_SIZE
+        vectors: Dict[str, Any] = {}
+        for i in range(0, len(ids), batch_size):
+            records = self.client.retrieve(
+                collection_name=self.source_collection or self.collection_name,
+                ids=ids[i:i + batch_size],
+                with_payload=False,
+                with_vectors=True,
+            )
+            vectors.update({str(record.id): record.vector for record in records})
+        return vectors
+
+    def _submit_window(self, window: List[FilePlan]) -> List[Future]:
+        """Embed a window of chunks and submit its upserts and deletions in parallel batches."""
+        from qdrant_client.http import models as rest
+
+        to_embed = [item for plan in window for item in plan.to_embed]
+        to_refresh = [item for plan in window for item in plan.to_refresh]
+
+        # I chunk con soli metadata cambiati (o copiati dalla versione precedente) riusano il vettore salvato
+        stored = self._stored_vectors([pid for pid, _ in to_refresh]) if to_refresh else {}
+        points = [
+            rest.PointStruct(id=pid, vector=point_vectors(stored[pid]), payload=chunk.payload(self.embedding_model))
+            for pid, chunk in to_refresh if pid in stored
+        ]
+        to_embed.extend(item for item in to_refresh if item[0] not in stored)
+        self.stats["chunks_refreshed"] += len(points)
+
+        vectors = self.embedder.embed([chunk.text for _, chunk in to_embed])
+        points.extend(
+            rest.PointStruct(id=pid, vector=point_vectors(vector), payload=chunk.payload(self.embedding_model))
+            for (pid, chunk), vector in zip(to_embed, vectors)
+        )
+        self.stats["chunks_embedded"] += len(to_embed)
+
+        batch_size = settings.INGEST_UPSERT_BATCH_SIZE
+        futures = [
+            self.upsert_executor.submit(
+                self.client.upsert,
+                collection_name=self.collection_name,
+                points=points[i:i + batch_size],
+                wait=True,
+            )
+            for i in range(0, len(points), batch_size)
+        ]
+
+        to_delete = [pid for plan in window for pid in plan.to_delete]
+        if to_delete:
+            futures.append(self.upsert_executor.submit(
+                self.client.delete,
+                collection_name=self.collection_name,
+                points_selector=rest.PointIdsList(points=to_delete),
+                wait=True,
+            ))
+            self.stats["chunks_deleted"] += len(to_delete)
+        return futures
+
+    def _complete(self, window: List[FilePlan], futures: List[Future], manifest: IngestManifest) -> None:
+        """Wait for a window's upserts and deletions, then record its files in the manifest."""
+        for future in futures:
+            future.result()
+        for plan in window:
+            manifest.update(plan.file_key, plan.signature, plan.points)
+            self.stats["files_indexed"] += 1
+            self.stats["chunks_reused"] += plan.reused
+        manifest.save()
+        # L'indice dei duplicati segue il manifest: una ripresa dopo un crash li trova allineati
+        if self.dedup is not None:
+            self.dedup.save(settings.INGEST_DEDUP_INDEX_PATH)
+        logger.info("Indexed window", files=len(window), **self.stats)
+
+    def _remove_missing(self, seen: Set[str], manifest: IngestManifest) -> None:
+        """Delete the points of files that are no longer in the root directory."""
+        from qdrant_client.http import models as rest
+
+        for file_key in [key for key in manifest.files if key not in seen]:
+            ids = list(manifest.points(file_key))
+            # Una nuova versione contiene i punti dei file rimossi solo se li ha già scritti una run interrotta
+            if ids and (not self.copying or manifest.is_built(file_key)):
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=rest.PointIdsList(points=ids),
+                    wait=True,
+                )
+            manifest.remove(file_key)
+            self.stats["files_removed"] += 1
+            self.stats["chunks_deleted"] += len(ids)
+            logger.info(f"Removed {len(ids)} points of deleted file {file_key}")
+        manifest.save()
+
+    def run(self, reset: bool = False, keep_missing: bool = False, swap: bool = True) -> Dict[str, Any]:
+        """Bring the collection up to date with the root directory.
+
+        Only new or changed chunks are embedded; chunks that disappeared are deleted.
+
+        Args:
+            reset: Re-embed every chunk, ignoring the manifest
+            keep_missing: Keep the points of files no longer present under root
+            swap: Point the alias to the new version once built (with ``new_version``)
+
+        Returns:
+            Indexing statistics
+        """
+        start = time.perf_counter()
+        self.ensure_collection()
+
+        # Costruendo una nuova versione si parte dal manifest della versione corrente (o di quella da riprendere)
+        indexed_collection = self.collection_name if self.resuming else (self.source_collection or self.collection_name)
+        manifest = IngestManifest(self.manifest_path, indexed_collection, self.embedding_model)
+        if not manifest.loaded and self.client.count(indexed_collection, exact=False).count:
+            manifest.rebuild_from_collection(self.client)
+        manifest.collection_name = self.collection_name
+        if self.new_version:
+            manifest.start_build(self.source_collection, restart=reset)
+            manifest.save()
+        if reset:
+            manifest.invalidate()
+        if settings.INGEST_DEDUP_ENABLED:
+            # Con --reset i gruppi si ricostruiscono da zero, nell'ordine dei file
+            self.dedup = (DuplicateIndex(indexed_collection) if reset
+                          else load_duplicate_index(self.client, indexed_collection))
+            self.dedup.collection_name = self.collection_name
+
+        window: List[FilePlan] = []
+        window_chunks = 0
+        pending: Optional[Tuple[List[FilePlan], List[Future]]] = None
+        seen: Set[str] = set()
+
+        def flush() -> None:
+            nonlocal window, window_chunks, pending
+            if not window:
+                return
+            futures = self._submit_window(window)
+            # L'upsert della finestra precedente procede mentre si calcolano gli embedding di questa
+            if pending is not None:
+                self._complete(*pending, manifest)
+            pending = (window, futures)
+            window, window_chunks = [], 0
+
+        def drain() -> None:
+            nonlocal pending
+            flush()
+            if pending is not None:
+                self._complete(*pending, manifest)
+                pending = None
+
+        def index_file(path: Path, file_key: str, force: bool = False) -> None:
+            nonlocal window_chunks
+            signature = file_signature(path)
+            if not force and (not self.copying or manifest.is_built(file_key)) \
+                    and manifest.is_unchanged(file_key, signature):
+                self.stats["files_unchanged"] += 1
+                return
+
+            try:
+                chunks = self.chunker.chunk_file(path, self.root)
+            except Exception as e:
+                logger.error(f"Failed to read {file_key}: {str(e)}")
+                self.stats["files_failed"] += 1
+                return
+
+            if self.dedup is not None:
+                self.dedup.remove_file(file_key)
+                chunks, duplicates = self.dedup.assign(file_key, chunks)
+                self.stats["chunks_duplicate"] += duplicates
+
+            plan = plan_file(file_key, signature, chunks, manifest.points(file_key), copy=self.copying)
+            window.append(plan)
+            window_chunks += plan.pending
+            if window_chunks >= self.window_size:
+                flush()
+
+        try:
+            for path in iter_document_files(self.root):
+                file_key = str(path.relative_to(self.root))
+                seen.add(file_key)
+                index_file(path, file_key)
+
+            if self.dedup is not None:
+                if not keep_missing:
+                    for file_key in [key for key in manifest.files if key not in seen]:
+                        self.dedup.remove_file(file_key)
+                # Gruppi rimasti senza chunk canonico: si rileggono i file dei membri, uno diventa canonico
+                orphaned = self.dedup.orphaned_files()
+                while orphaned:
+                    # I piani dei file riletti partono dal manifest aggiornato
+                    drain()
+                    logger.info(f"Re-reading {len(orphaned)} files whose duplicate groups lost their canonical chunk")
+                    for file_key in sorted(orphaned):
+                        path = Path(self.root) / file_key
+                        if path.exists():
+                            index_file(path, file_key, force=True)
+                    orphaned = self.dedup.orphaned_files()
+
+            drain()
+            if not keep_missing:
+                self._remove_missing(seen, manifest)
+        finally:
+            self.upsert_executor.shutdown(wait=True)
+            self.embedder.close()
+
+        self.stats["elapsed_s"] = round(time.perf_counter() - start, 1)
+        logger.info("Indexing completed", collection=self.collection_name, **self.stats)
+
+        if self.new_version:
+            self.stats["collection"] = self.collection_name
+            if not swap:
+                logger.info(f"New version '{self.collection_name}' built, alias '{self.alias}' not swapped")
+            elif self.stats["files_failed"]:
+                logger.error(f"Not swapping alias '{self.alias}': {self.stats['files_failed']} files failed, "
+                             f"new version '{self.collection_name}' left for inspection")
+            else:
+                self.stats["previous_collection"] = swap_alias(self.client, self.alias, self.collection_name)
+                manifest.finish_build()
+                manifest.save()
+                self._refresh_spelling()
+                self._refresh_precomputed()
+        elif self.stats["chunks_embedded"] or self.stats["chunks_deleted"]:
+            self._refresh_spelling()
+            self._refresh_precomputed()
+        return self.stats
+
+    def _refresh_spelling(self) -> None:
+        """Rebuild the vocabulary file of the spelling index from the indexed collection."""
+        if not settings.SPELLING_ENABLED:
+            return
+        try:
+            build_spelling_index(self.client, self.collection_name).save(settings.SPELLING_VOCABULARY_PATH)
+        except Exception as e:
+            logger.error(f"Could not rebuild the spelling vocabulary: {str(e)}")
+
+    def _refresh_precomputed(self) -> None:
+        """Regenerate the precomputed answers against the re-indexed collection."""
+        if not settings.PRECOMPUTED_ENABLED or not settings.PRECOMPUTED_REFRESH_ON_INGEST:
+            return
+        if not os.path.exists(settings.PRECOMPUTED_STORE_PATH):
+            return
+        try:
+            from app.rag.precomputed import refresh_store
+
+            refresh_store()
+        except Exception as e:
+            logger.error(f"Could not refresh the precomputed answers: {str(e)}")
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Indicizza una cartella di documenti nella collection Qdrant")
+    parser.add_argument("root", help="Cartella dei documenti (PDF, TXT, MD, DOCX, HTML)")
+    parser.add_argument("--collection", default=None, help="Collection di destinazione (default: QDRANT_COLLECTION)")
+    parser.add_argument("--manifest", default=None, help="File del manifest (default: INGEST_MANIFEST_PATH)")
+    parser.add_argument("--reset", action="store_true", help="Ignora il manifest e ricalcola tutti gli embedding")
+    parser.add_argument("--keep-missing", action="store_true",
+                        help="Non eliminare i punti dei file non più presenti nella cartella")
+    parser.add_argument("--new-version", action="store_true",
+                        help="Costruisci una nuova versione della collection e sposta l'alias al termine")
+    parser.add_argument("--no-swap", action="store_true", help="Con --new-version, non spostare l'alias")
+    args = parser.parse_args()
+
+    configure_logging()
+    pipeline = IngestionPipeline(args.root, collection_name=args.collection, manifest_path=args.manifest,
+                                 new_version=args.new_version)
+    stats = pipeline.run(reset=args.reset, keep_missing=args.keep_missing, swap=not args.no_swap)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Retrieval benchmarks for the CroceRossa Qdrant Cloud application.
+
+Usage:
+    python -m app.rag.benchmark transport [--iterations 50] [--top-k 70] [--random-vectors]
+    python -m app.rag.benchmark quantization [--oversampling 1 2 4] [--top-k 70] [--random-vectors]
+    python -m app.rag.benchmark matryoshka [--multipliers 2 4 8] [--top-k 70] [--random-vectors]
+
+The ``transport`` mode compares REST and gRPC search latency on the configured
+collection, returning RETRIEVAL_TOP_K points with the configured payload fields
+(``page_content`` and ``metadata`` by default).
+
+The ``quantization`` mode reports recall@k and latency of quantized search, for
+each oversampling factor with and without rescoring, against an exact search on
+the original float vectors.
+
+The ``matryoshka`` mode (QDRANT_VECTOR_MODE=matryoshka) reports recall@k and
+latency of the two-stage search for each shortlist multiplier, of a search on
+the short vector only and of the single-stage search on the full vector,
+against an exact search on the full vector.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from app.core.config import settings
+from app.core.logging import configure_logging, get_logger
+
+logger = get_logger(__name__)
+
+# Domande tipiche usate per generare embedding realistici
+SAMPLE_QUESTIONS = [
+    "Come posso diventare volontario della Croce Rossa?",
+    "Quali corsi di primo soccorso organizza la CRI?",
+    "Quando si terranno le prossime elezioni dei comitati?",
+    "Quali sono i sette Principi Fondamentali del Movimento?",
+    "Come funziona il servizio di trasporto sanitario?",
+    "Che cosa prevede il regolamento dei volontari CRI?",
+    "Come si rinnova la quota associativa?",
+    "Chi può partecipare al corso base per volontari?",
+]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    """Return the pct-th percentile (0-100) of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    """Summarize a list of latencies in milliseconds."""
+    return {
+        "runs": len(latencies_ms),
+        "mean_ms": round(statistics.fmean(latencies_ms), 2) if latencies_ms else 0.0,
+        "p50_ms": round(_percentile(latencies_ms, 50), 2),
+        "p95_ms": round(_percentile(latencies_ms, 95), 2),
+        "p99_ms": round(_percentile(latencies_ms, 99), 2),
+    }
+
+
+def time_calls(call: Callable[[Any], Any], inputs: List[Any], iterations: int, warmup: int = 3) -> List[float]:
+    """Call ``call`` cycling over ``inputs`` and return the latencies in milliseconds."""
+    for i in range(warmup):
+        call(inputs[i % len(inputs)])
+
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        call(inputs[i % len(inputs)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def load_query_vectors(client: Any, random_vectors: bool, count: int = len(SAMPLE_QUESTIONS)) -> List[List[float]]:
+    """Return query vectors: real embeddings of sample questions, or random unit vectors."""
+    if not random_vectors:
+        from app.rag.components import get_components
+
+        embed_model = get_components().embed_model
+        return [embed_model.get_query_embedding(question) for question in SAMPLE_QUESTIONS[:count]]
+
+    from app.rag.qdrant_search import FULL_VECTOR_NAME
+
+    info = client.get_collection(settings.QDRANT_COLLECTION)
+    vectors_config = info.config.params.vectors
+    size = vectors_config.size if hasattr(vectors_config, "size") else vectors_config[FULL_VECTOR_NAME].size
+    vectors = []
+    for _ in range(count):
+        vector = [random.gauss(0.0, 1.0) for _ in range(size)]
+        norm = sum(v * v for v in vector) ** 0.5
+        vectors.append([v / norm for v in vector])
+    return vectors
+
+
+def benchmark_transport(iterations: int, top_k: int, random_vectors: bool) -> Dict[str, Any]:
+    """Compare REST and gRPC search latency for the same queries and payloads."""
+    from app.rag.qdrant_search import create_qdrant_client, search_points
+
+    clients = {
+        "rest": create_qdrant_client(prefer_grpc=False),
+        "grpc": create_qdrant_client(prefer_grpc=True),
+    }
+    vectors = load_query_vectors(clients["rest"], random_vectors)
+
+    report: Dict[str, Any] = {
+        "collection": settings.QDRANT_COLLECTION,
+        "top_k": top_k,
+        "payload_fields": settings.QDRANT_PAYLOAD_FIELDS or "all",
+        "transports": {},
+    }
+    for name, client in clients.items():
+        logger.info(f"Benchmarking Qdrant {name} transport", iterations=iterations, top_k=top_k)
+        latencies = time_calls(lambda vector: search_points(client, vector, limit=top_k), vectors, iterations)
+        report["transports"][name] = summarize_latencies(latencies)
+
+    rest_p50 = report["transports"]["rest"]["p50_ms"]
+    grpc_p50 = report["transports"]["grpc"]["p50_ms"]
+    report["grpc_speedup_p50"] = round(rest_p50 / grpc_p50, 2) if grpc_p50 else None
+    return report
+
+
+def recall_at_k(baseline_ids: List[Any], candidate_ids: List[Any]) -> float:
+    """Return the fraction of baseline results also found by the candidate search."""
+    if not baseline_ids:
+        return 1.0
+    return len(set(baseline_ids) & set(candidate_ids)) / len(baseline_ids)
+
+
+def benchmark_quantization(oversampling_values: List[float], top_k: int,
+                           random_vectors: bool, iterations: int) -> Dict[str, Any]:
+    """Compare quantized search configurations against the exact float baseline."""
+    from app.rag.qdrant_search import create_qdrant_client, search_points
+
+    client = create_qdrant_client()
+    vectors = load_query_vectors(client, random_vectors)
+
+    def _ids(vector: List[float], **params: Any) -> List[Any]:
+        return [point.id for point in search_points(client, vector, limit=top_k, payload_fields=[], **params)]
+
+    # Baseline: ricerca esatta sui vettori float originali
+    baselines = [_ids(vector, exact=True, ignore_quantization=True) for vector in vectors]
+    baseline_latencies = time_calls(
+        lambda vector: _ids(vector, ignore_quantization=True), vectors, iterations
+    )
+
+    report: Dict[str, Any] = {
+        "collection": settings.QDRANT_COLLECTION,
+        "quantization": settings.QDRANT_QUANTIZATION,
+        "top_k": top_k,
+        "float_hnsw": {
+            "recall": round(statistics.fmean(
+                recall_at_k(base, _ids(vector, ignore_quantization=True))
+                for base, vector in zip(baselines, vectors)
+            ), 4),
+            **summarize_latencies(baseline_latencies),
+        },
+        "configurations": [],
+    }
+
+    for oversampling in oversampling_values:
+        for rescore in (True, False):
+            params = {"oversampling": oversampling, "rescore": rescore}
+            recall = statistics.fmean(
+                recall_at_k(base, _ids(vector, **params)) for base, vector in zip(baselines, vectors)
+            )
+            latencies = time_calls(lambda vector: _ids(vector, **params), vectors, iterations)
+            report["configurations"].append({
+                **params,
+                "recall": round(recall, 4),
+                **summarize_latencies(latencies),
+            })
+            logger.info("Benchmarked quantized search", recall=round(recall, 4), **params)
+
+    return report
+
+
+def benchmark_matryoshka(multipliers: List[float], top_k: int,
+                         random_vectors: bool, iterations: int) -> Dict[str, Any]:
+    """Compare two-stage matryoshka search against single-stage search on the full vector."""
+    from app.rag.qdrant_search import (
+        SHORT_VECTOR_NAME,
+        create_qdrant_client,
+        matryoshka_enabled,
+        search_points,
+    )
+
+    if not matryoshka_enabled():
+        raise ValueError("The matryoshka benchmark requires QDRANT_VECTOR_MODE=matryoshka")
+
+    client = create_qdrant_client()
+    vectors = load_query_vectors(client, random_vectors)
+
+    def _ids(vector: List[float], **params: Any) -> List[Any]:
+        return [point.id for point in search_points(client, vector, limit=top_k, payload_fields=[], **params)]
+
+    # Baseline: ricerca esatta a uno stadio sul vettore completo
+    baselines = [_ids(vector, two_stage=False, exact=True, ignore_quantization=True) for vector in vectors]
+
+    def _measure(name: str, **params: Any) -> Dict[str, Any]:
+        recall = statistics.fmean(recall_at_k(base, _ids(vector, **params)) for base, vector in zip(baselines, vectors))
+        latencies = time_calls(lambda vector: _ids(vector, **params), vectors, iterations)
+        logger.info(f"Benchmarked {name} search", recall=round(recall, 4))
+        return {"search": name, **params, "recall": round(recall, 4), **summarize_latencies(latencies)}
+
+    report: Dict[str, Any] = {
+        "collection": settings.QDRANT_COLLECTION,
+        "short_dimensions": settings.MATRYOSHKA_DIMENSIONS,
+        "full_dimensions": settings.EMBEDDING_DIMENSIONS,
+        "top_k": top_k,
+        "single_stage_full": _measure("single_stage_full", two_stage=False),
+        "short_only": _measure("short_only", two_stage=False, using=SHORT_VECTOR_NAME),
+        "two_stage": [_measure("two_stage", prefetch_multiplier=multiplier) for multiplier in multipliers],
+    }
+    return report
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark di retrieval per CRI Assistente")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    transport = subparsers.add_parser("transport", help="Confronta la latenza REST e gRPC di Qdrant")
+    transport.add_argument("--iterations", type=int, default=50, help="Numero di ricerche per transport")
+    transport.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K, help="Risultati per ricerca")
+    transport.add_argument("--random-vectors", action="store_true",
+                           help="Usa vettori casuali invece di embedding OpenAI")
+
+    quantization = subparsers.add_parser("quantization",
+                                         help="Confronta recall e latenza della ricerca quantizzata con la baseline float")
+    quantization.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0],
+                              help="Fattori di oversampling da confrontare")
+    quantization.add_argument("--iterations", type=int, default=20, help="Ricerche per configurazione")
+    quantization.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K, help="Risultati per ricerca")
+    quantization.add_argument("--random-vectors", action="store_true",
+                              help="Usa vettori casuali invece di embedding OpenAI")
+
+    matryoshka = subparsers.add_parser("matryoshka",
+                                       help="Confronta la ricerca a due stadi (vettore corto + completo) con quella a uno stadio")
+    matryoshka.add_argument("--multipliers", type=float, nargs="+", default=[2.0, 4.0, 8.0],
+                            help="Dimensioni della shortlist come multipli di top-k")
+    matryoshka.add_argument("--iterations", type=int, default=20, help="Ricerche per configurazione")
+    matryoshka.add_argument("--top-k", type=int, default=settings.RETRIEVAL_TOP_K, help="Risultati per ricerca")
+    matryoshka.add_argument("--random-vectors", action="store_true",
+                            help="Usa vettori casuali invece di embedding OpenAI")
+
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.mode == "transport":
+        report = benchmark_transport(args.iterations, args.top_k, args.random_vectors)
+    elif args.mode == "quantization":
+        report = benchmark_quantization(args.oversampling, args.top_k, args.random_vectors, args.iterations)
+    elif args.mode == "matryoshka":
+        report = benchmark_matryoshka(args.multipliers, args.top_k, args.random_vectors, args.iterations)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Versioned in-process caches for the CroceRossa Qdrant Cloud application.
+
+Every entry is stamped with the collection version it was computed against (the
+physical collection behind the Qdrant alias). An entry read with a different
+version is a miss, so a collection swap invalidates embedding, retrieval and
+answer caches without a restart. Expired entries stay until evicted, so that
+``get_stale`` can still serve them while an upstream is down.
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_cache_requests_total", "counter", "Cache lookups, by cache and result (hit, miss, stale)")
+metrics.describe("cri_cache_invalidations_total", "counter", "Cache flushes caused by a collection version change")
+
+# Tutte le cache create nel processo, svuotate al cambio di versione della collection
+_caches: "weakref.WeakSet[VersionedCache]" = weakref.WeakSet()
+# Tutte le cache, anche quelle che sopravvivono al cambio di versione, per il report della memoria
+_all_caches: "weakref.WeakSet[VersionedCache]" = weakref.WeakSet()
+
+
+class VersionedCache:
+    """Thread-safe LRU cache with TTL whose entries are stamped with a collection version."""
+
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float, invalidate_on_swap: bool = True):
+        """Create an empty cache.
+
+        Args:
+            name: Cache name, used as metrics label
+            max_entries: Maximum number of entries before evicting the least recently used
+            ttl_seconds: Lifetime of an entry (0 disables expiry)
+            invalidate_on_swap: Flush the cache when the collection version changes
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[str, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if invalidate_on_swap:
+            _caches.add(self)
+        _all_caches.add(self)
+
+    def get(self, key: Hashable, version: str) -> Optional[Any]:
+        """Return the cached value for key, or None if missing, expired or from another version."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result, value = "miss", None
+            else:
+                entry_version, stored_at, value = entry
+                expired = self.ttl_seconds > 0 and time.monotonic() - stored_at > self.ttl_seconds
+                if entry_version != version or expired:
+                    result, value = "stale", None
+                else:
+                    self._entries.move_to_end(key)
+                    result = "hit"
+        metrics.inc("cri_cache_requests_total", cache=self.name, result=result)
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key whatever its age and version, as a fallback."""
+        with self._lock:
+            entry = self._entries.get(key)
+        metrics.inc("cri_cache_requests_total", cache=self.name, result="fallback" if entry else "miss")
+        return entry[2] if entry is not None else None
+
+    def set(self, key: Hashable, value: Any, version: str) -> None:
+        """Store a value computed against the given collection version."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._entries)
+
+
+def all_caches() -> List[VersionedCache]:
+    """Return every cache alive in the process, by name."""
+    return sorted(_all_caches, key=lambda cache: cache.name)
+
+
+def invalidate_caches(old_version: Optional[str], new_version: str) -> None:
+    """Flush every cache after a collection version change."""
+    for cache in list(_caches):
+        cache.clear()
+        metrics.inc("cri_cache_invalidations_total", cache=cache.name)
+    logger.info("Caches invalidated after collection version change",
+                old_version=old_version, new_version=new_version)
@@ -0,0 +1,235 @@
+"""Production traffic capture for the CroceRossa Qdrant Cloud application.
+
+With CAPTURE_ENABLED every /api/query is recorded to gzip-compressed NDJSON
+files under CAPTURE_DIR, rotated every CAPTURE_MAX_BYTES of uncompressed data
+(the oldest files beyond CAPTURE_MAX_FILES are deleted). A query record holds
+the request and conversation history, the condensed and search questions, the
+retrieved and reranked chunk IDs with their scores, and every upstream call the
+pipeline made (embedding, Qdrant search, Cohere rerank, OpenAI completions) with
+its latency and response. Chunk texts are written once per file in ``chunk``
+records and referenced by ID, which keeps the files compact.
+
+Records are queued and written by a background thread, so capture never blocks
+a request; when the queue is full records are dropped and counted. The captured
+traffic is fed back through the engine by ``python -m app.rag.replay``.
+"""
+
+import glob
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_capture_records_total", "counter", "Query records written to the traffic capture")
+metrics.describe("cri_capture_dropped_total", "counter", "Query records dropped because the capture queue was full")
+
+FILE_PATTERN = "capture-*.ndjson.gz"
+
+
+def node_refs(nodes: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Return the ID and score of retrieved nodes, in order."""
+    refs = []
+    for node in nodes:
+        score = getattr(node, "score", None)
+        refs.append({"id": getattr(node, "node_id", None), "score": round(score, 6) if score is not None else None})
+    return refs
+
+
+def node_chunks(nodes: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the text and metadata of retrieved nodes, by ID."""
+    return {
+        node.node_id: {"text": getattr(node, "text", ""), "metadata": getattr(node, "metadata", {}) or {}}
+        for node in nodes
+        if getattr(node, "node_id", None)
+    }
+
+
+class QueryCapture:
+    """Trace of one query, filled in by the router and the RAG engine."""
+
+    def __init__(self, request: Dict[str, Any]):
+        """Start the trace of a request (query, session_id, scope, include_prompt, history)."""
+        self.record: Dict[str, Any] = {"type": "query", "ts": time.time(), "request": request, "upstream": []}
+        self.chunks: Dict[str, Dict[str, Any]] = {}
+        self._started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set(self, **fields: Any) -> None:
+        """Record pipeline fields (condensed_question, retrieved, reranked, model...)."""
+        with self._lock:
+            self.record.update(fields)
+
+    def upstream(self, upstream: str, call: str, latency: float, nodes: Optional[List[Any]] = None,
+                 **data: Any) -> None:
+        """Record an upstream call with its latency and response.
+
+        Args:
+            upstream: Upstream name (openai_embeddings, qdrant, cohere, openai_chat)
+            call: Pipeline call (embed, search, rerank, condensation, answer, answer_no_context)
+            latency: Seconds the call took
+            nodes: Retrieved or reranked nodes returned by the call, stored as IDs and scores
+            data: Other response fields (text, usage...)
+        """
+        entry = {"upstream": upstream, "call": call, "latency": round(latency, 6), **data}
+        if nodes is not None:
+            entry["results"] = node_refs(nodes)
+        with self._lock:
+            if nodes is not None:
+                self.chunks.update(node_chunks(nodes))
+            self.record["upstream"].append(entry)
+
+    def finish(self, status: int, result: Optional[Dict[str, Any]] = None) -> "QueryCapture":
+        """Record the outcome of the request."""
+        with self._lock:
+            self.record["status"] = status
+            self.record["elapsed"] = round(time.monotonic() - self._started_at, 6)
+            if result is not None:
+                self.record["response"] = {
+                    "request_id": result.get("request_id"),
+                    "answer_chars": len(result.get("answer") or ""),
+                    "source_ids": [doc.get("id") for doc in result.get("source_documents") or []],
+                    "metadata": result.get("metadata"),
+                }
+        return self
+
+
+class CaptureWriter:
+    """Background writer of rotated, compressed NDJSON capture files."""
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int, sample_rate: float = 1.0,
+                 queue_size: int = 1000, enabled: bool = True):
+        """Initialize the writer (the thread starts with the first record).
+
+        Args:
+            directory: Directory of the capture files
+            max_bytes: Uncompressed bytes after which the current file is rotated
+            max_files: Capture files kept (the oldest are deleted)
+            sample_rate: Fraction of the queries recorded
+            queue_size: Records waiting to be written before new ones are dropped
+            enabled: Whether queries are captured at all
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self._queue: "queue.Queue[QueryCapture]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._file: Optional[gzip.GzipFile] = None
+        self._written = 0
+        self._chunks_written: Set[str] = set()
+
+    def start(self, request: Dict[str, Any]) -> Optional[QueryCapture]:
+        """Return a trace for a new request, or None if it is not captured."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        return QueryCapture(request)
+
+    def submit(self, capture: QueryCapture) -> None:
+        """Queue a finished trace for writing (dropped if the queue is full)."""
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(capture)
+        except queue.Full:
+            metrics.inc("cri_capture_dropped_total")
+
+    def _run(self) -> None:
+        """Write queued traces, flushing whenever the queue is empty."""
+        while True:
+            capture = self._queue.get()
+            try:
+                with self._write_lock:
+                    self._write(capture)
+                    if self._queue.empty() and self._file is not None:
+                        self._file.flush()
+            except Exception as e:
+                logger.error(f"Could not write the traffic capture: {str(e)}")
+
+    def _write(self, capture: QueryCapture) -> None:
+        """Write the chunks not yet in the current file, then the query record."""
+        if self._file is None or self._written >= self.max_bytes:
+            self._rotate()
+        lines = []
+        for chunk_id, chunk in capture.chunks.items():
+            if chunk_id not in self._chunks_written:
+                self._chunks_written.add(chunk_id)
+                lines.append(json.dumps({"type": "chunk", "id": chunk_id, **chunk}, ensure_ascii=False, default=str))
+        lines.append(json.dumps(capture.record, ensure_ascii=False, default=str))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        self._file.write(data)
+        self._written += len(data)
+        metrics.inc("cri_capture_records_total")
+
+    def _rotate(self) -> None:
+        """Close the current file, open a new one and delete the oldest beyond max_files."""
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{int(time.time() * 1000) % 1000:03d}.ndjson.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "wb", compresslevel=6)
+        self._written = 0
+        self._chunks_written = set()
+        files = sorted(glob.glob(os.path.join(self.directory, FILE_PATTERN)), key=os.path.getmtime)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            os.remove(old)
+        logger.info(f"Traffic capture rotated to {name}")
+
+    def close(self) -> None:
+        """Write the queued traces and close the current file."""
+        with self._write_lock:
+            while not self._queue.empty():
+                self._write(self._queue.get_nowait())
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(paths: Iterable[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Read capture files and return their query records (by time) and the chunks they reference."""
+    records: List[Dict[str, Any]] = []
+    chunks: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        for item in _read_lines(path):
+            if item.get("type") == "chunk":
+                chunks[item["id"]] = {"text": item.get("text", ""), "metadata": item.get("metadata") or {}}
+            elif item.get("type") == "query":
+                records.append(item)
+    records.sort(key=lambda record: record.get("ts", 0.0))
+    return records, chunks
+
+
+def _read_lines(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the JSON records of a capture file, stopping at a truncated tail."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except (EOFError, ValueError, OSError) as e:
+        # Il file corrente di un processo ancora attivo può terminare a metà record
+        logger.warning(f"Capture file {path} ends early: {str(e)}")
+
+
+capture_writer = CaptureWriter(
+    settings.CAPTURE_DIR,
+    max_bytes=settings.CAPTURE_MAX_BYTES,
+    max_files=settings.CAPTURE_MAX_FILES,
+    sample_rate=settings.CAPTURE_SAMPLE_RATE,
+    queue_size=settings.CAPTURE_QUEUE_SIZE,
+    enabled=settings.CAPTURE_ENABLED,
+)
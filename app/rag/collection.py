@@ -0,0 +1,203 @@
+"""Qdrant collection management for the CroceRossa Qdrant Cloud application.
+
+Usage:
+    python -m app.rag.collection info
+    python -m app.rag.collection create [--name NAME] [--quantization scalar|binary|none]
+                                        [--vector-mode single|matryoshka] [--recreate]
+    python -m app.rag.collection quantize --quantization scalar|binary|none
+    python -m app.rag.collection indexes
+    python -m app.rag.collection versions
+    python -m app.rag.collection swap --to NAME
+    python -m app.rag.collection prune [--keep N]
+"""
+
+import argparse
+import json
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.logging import configure_logging, get_logger
+from app.rag.filters import payload_index_fields
+from app.rag.qdrant_search import (
+    FULL_VECTOR_NAME,
+    SHORT_VECTOR_NAME,
+    build_quantization_config,
+    create_qdrant_client,
+)
+from app.rag.versioning import list_versions, prune_versions, resolve_alias, swap_alias
+
+logger = get_logger(__name__)
+
+
+def collection_info(client: Any, collection_name: Optional[str] = None) -> Dict[str, Any]:
+    """Return a summary of the collection configuration."""
+    name = collection_name or settings.QDRANT_COLLECTION
+    info = client.get_collection(name)
+    quantization = info.config.quantization_config
+    return {
+        "collection": name,
+        "alias_of": resolve_alias(client, name),
+        "status": str(info.status),
+        "points_count": info.points_count,
+        "vectors": info.config.params.vectors.model_dump() if hasattr(info.config.params.vectors, "model_dump")
+        else {k: v.model_dump() for k, v in info.config.params.vectors.items()},
+        "quantization": quantization.model_dump() if quantization else None,
+        "payload_indexes": {key: str(schema.data_type) for key, schema in (info.payload_schema or {}).items()},
+    }
+
+
+def create_collection(client: Any,
+                      collection_name: Optional[str] = None,
+                      quantization: Optional[str] = None,
+                      recreate: bool = False,
+                      vector_mode: Optional[str] = None) -> str:
+    """Create the collection with the configured vector size and optional quantization.
+
+    When quantization is enabled the original float vectors are stored on disk and
+    only read for rescoring, while the quantized vectors stay in RAM. In matryoshka
+    mode the full vectors are always on disk, since they only rescore the shortlist
+    found on the short vectors.
+
+    Returns:
+        The name of the created collection
+    """
+    from qdrant_client.http import models as rest
+
+    name = collection_name or settings.QDRANT_COLLECTION
+    quantization_config = build_quantization_config(quantization)
+    vector_mode = (vector_mode or settings.QDRANT_VECTOR_MODE).lower()
+
+    full_vector = rest.VectorParams(
+        size=settings.EMBEDDING_DIMENSIONS,
+        distance=rest.Distance.COSINE,
+        on_disk=quantization_config is not None or vector_mode == "matryoshka",
+    )
+    if vector_mode == "matryoshka":
+        vectors_config: Any = {
+            FULL_VECTOR_NAME: full_vector,
+            SHORT_VECTOR_NAME: rest.VectorParams(size=settings.MATRYOSHKA_DIMENSIONS, distance=rest.Distance.COSINE),
+        }
+    elif vector_mode == "single":
+        vectors_config = full_vector
+    else:
+        raise ValueError(f"Unsupported vector mode: {vector_mode}")
+
+    if client.collection_exists(name):
+        if not recreate:
+            raise ValueError(f"Collection '{name}' already exists (use --recreate to replace it)")
+        logger.warning(f"Deleting existing collection '{name}'")
+        client.delete_collection(name)
+
+    client.create_collection(
+        collection_name=name,
+        vectors_config=vectors_config,
+        quantization_config=quantization_config,
+    )
+    logger.info(f"Created collection '{name}'", quantization=quantization or settings.QDRANT_QUANTIZATION,
+                vector_mode=vector_mode)
+    return name
+
+
+def migrate_quantization(client: Any, quantization: str, collection_name: Optional[str] = None) -> None:
+    """Enable, change or disable quantization on an existing collection.
+
+    Qdrant rebuilds the quantized vectors in background; the collection stays
+    searchable during the migration.
+    """
+    from qdrant_client.http import models as rest
+
+    name = collection_name or settings.QDRANT_COLLECTION
+    quantization_config = build_quantization_config(quantization)
+
+    client.update_collection(
+        collection_name=name,
+        quantization_config=quantization_config if quantization_config is not None else rest.Disabled.DISABLED,
+    )
+    logger.info(f"Updated quantization of collection '{name}'", quantization=quantization)
+
+
+def create_payload_indexes(client: Any, collection_name: Optional[str] = None) -> None:
+    """Create the payload indexes backing query scopes (source, type, committee, date)."""
+    from qdrant_client.http import models as rest
+
+    name = collection_name or settings.QDRANT_COLLECTION
+    existing = client.get_collection(name).payload_schema or {}
+
+    for field_name, schema in payload_index_fields().items():
+        if field_name in existing:
+            logger.info(f"Payload index on '{field_name}' already exists")
+            continue
+        client.create_payload_index(
+            collection_name=name,
+            field_name=field_name,
+            field_schema=rest.PayloadSchemaType(schema),
+            wait=True,
+        )
+        logger.info(f"Created {schema} payload index on '{field_name}'")
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Gestione della collection Qdrant di CRI Assistente")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info = subparsers.add_parser("info", help="Mostra la configurazione della collection")
+    info.add_argument("--name", default=None, help="Nome della collection (default: QDRANT_COLLECTION)")
+
+    create = subparsers.add_parser("create", help="Crea la collection")
+    create.add_argument("--name", default=None, help="Nome della collection (default: QDRANT_COLLECTION)")
+    create.add_argument("--quantization", choices=["none", "scalar", "binary"], default=None,
+                        help="Quantizzazione (default: QDRANT_QUANTIZATION)")
+    create.add_argument("--vector-mode", choices=["single", "matryoshka"], default=None,
+                        help="Vettore unico o vettori corto + completo (default: QDRANT_VECTOR_MODE)")
+    create.add_argument("--recreate", action="store_true", help="Elimina e ricrea la collection se esiste")
+
+    quantize = subparsers.add_parser("quantize", help="Abilita o modifica la quantizzazione di una collection esistente")
+    quantize.add_argument("--name", default=None, help="Nome della collection (default: QDRANT_COLLECTION)")
+    quantize.add_argument("--quantization", choices=["none", "scalar", "binary"], required=True)
+
+    indexes = subparsers.add_parser("indexes", help="Crea gli indici sul payload usati dagli scope delle query")
+    indexes.add_argument("--name", default=None, help="Nome della collection (default: QDRANT_COLLECTION)")
+
+    versions = subparsers.add_parser("versions", help="Elenca le versioni della collection dietro l'alias")
+    versions.add_argument("--name", default=None, help="Nome dell'alias (default: QDRANT_COLLECTION)")
+
+    swap = subparsers.add_parser("swap", help="Sposta l'alias su un'altra versione (es. rollback)")
+    swap.add_argument("--name", default=None, help="Nome dell'alias (default: QDRANT_COLLECTION)")
+    swap.add_argument("--to", required=True, help="Collection di destinazione")
+
+    prune = subparsers.add_parser("prune", help="Elimina le versioni vecchie non puntate dall'alias")
+    prune.add_argument("--name", default=None, help="Nome dell'alias (default: QDRANT_COLLECTION)")
+    prune.add_argument("--keep", type=int, default=None,
+                       help="Versioni più recenti da mantenere (default: COLLECTION_VERSIONS_TO_KEEP)")
+    prune.add_argument("--keep-unfinished", action="store_true",
+                       help="Non eliminare le versioni più recenti di quella attiva (build interrotte o --no-swap)")
+
+    args = parser.parse_args()
+    configure_logging()
+    client = create_qdrant_client()
+    alias = args.name or settings.QDRANT_COLLECTION
+
+    if args.command == "versions":
+        print(json.dumps({"alias": alias, "current": resolve_alias(client, alias),
+                          "versions": list_versions(client, alias)}, indent=2))
+        return
+    if args.command == "prune":
+        keep = args.keep if args.keep is not None else settings.COLLECTION_VERSIONS_TO_KEEP
+        print(json.dumps({"deleted": prune_versions(client, alias, keep, args.keep_unfinished)}, indent=2))
+        return
+
+    if args.command == "create":
+        create_collection(client, args.name, args.quantization, args.recreate, args.vector_mode)
+    elif args.command == "quantize":
+        migrate_quantization(client, args.quantization, args.name)
+    elif args.command == "indexes":
+        create_payload_indexes(client, args.name)
+    elif args.command == "swap":
+        swap_alias(client, alias, args.to)
+
+    print(json.dumps(collection_info(client, args.name), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Multi-collection registry and query routing for the CroceRossa Qdrant Cloud application.
+
+The documents can be split across several Qdrant collections (national
+regulations, training courses, local committee documents...), each with its own
+retrieval depth and reranker settings. The collections are described in the JSON
+file COLLECTIONS_CONFIG_PATH, a list of objects:
+
+    [
+      {"name": "normativa", "collection": "cri_normativa", "default": true,
+       "top_k": 50, "rerank_top_k": 8,
+       "keywords": ["regolament", "statut", "codice etico", "circolar"]},
+      {"name": "formazione", "collection": "cri_formazione",
+       "top_k": 30, "rerank_top_k": 6, "use_reranker": false,
+       "keywords": ["cors", "formazion", "istruttor", "esam"]}
+    ]
+
+``collection`` is the Qdrant collection or alias (default: ``name``); ``top_k``,
+``rerank_top_k`` and ``use_reranker`` default to RETRIEVAL_TOP_K, RERANK_TOP_K
+and the global reranker. A keyword matches the words of the question starting
+with it (word stems), or the question text if it holds several words.
+
+The router picks the collections whose keywords match the question, best first
+and at most COLLECTION_ROUTER_MAX; with no match the question goes to the
+``default`` collections (all of them if none is flagged). A ``collections``
+list in the query scope bypasses the router. Without a configuration file the
+application searches QDRANT_COLLECTION alone, as before.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+from app.rag.spelling import tokenize
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_collection_routes_total", "counter",
+                 "Queries routed to each collection, by collection and reason (keyword, default, scope)")
+
+# Ricerche sulle collection di una stessa query, eseguite in parallelo
+collection_search_executor = ThreadPoolExecutor(max_workers=settings.COLLECTION_SEARCH_CONCURRENCY,
+                                                thread_name_prefix="collection-search")
+
+
+@dataclass
+class CollectionSpec:
+    """Configuration of a searchable collection."""
+
+    name: str
+    collection: str
+    top_k: int
+    rerank_top_k: int
+    use_reranker: bool = True
+    default: bool = False
+    description: str = ""
+    keywords: List[str] = field(default_factory=list)
+
+    def matches(self, words: Sequence[str], text: str) -> int:
+        """Return how many keywords of the collection occur in a question."""
+        score = 0
+        for keyword in self.keywords:
+            if " " in keyword:
+                score += keyword in text
+            else:
+                score += any(word.startswith(keyword) for word in words)
+        return score
+
+
+def load_collection_specs(path: str) -> List[CollectionSpec]:
+    """Load the collection configuration file.
+
+    Raises:
+        ValueError: If the file is not a list of collections with unique names
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} must contain a non-empty list of collections")
+
+    specs: List[CollectionSpec] = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("name"):
+            raise ValueError(f"Every collection in {path} needs a name")
+        specs.append(CollectionSpec(
+            name=entry["name"],
+            collection=entry.get("collection") or entry["name"],
+            top_k=int(entry.get("top_k") or settings.RETRIEVAL_TOP_K),
+            rerank_top_k=int(entry.get("rerank_top_k") or settings.RERANK_TOP_K),
+            use_reranker=bool(entry.get("use_reranker", True)),
+            default=bool(entry.get("default", False)),
+            description=entry.get("description", ""),
+            keywords=[keyword.lower() for keyword in entry.get("keywords", [])],
+        ))
+
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate collection names in {path}: {names}")
+    return specs
+
+
+class CollectionHandle:
+    """Long-lived search objects of a collection: index, retriever, version tracker and reranker."""
+
+    def __init__(self, spec: CollectionSpec, index: Any, retriever: Any, version: Any,
+                 reranker: Any, build_retriever: Any):
+        """Bind the objects built by RAGComponents to a collection spec."""
+        self.spec = spec
+        self.index = index
+        self.retriever = retriever
+        self.version = version
+        # None se la collection non usa il reranker o se Cohere non è disponibile
+        self.reranker = reranker
+        self._build_retriever = build_retriever
+
+    @property
+    def name(self) -> str:
+        """Name of the collection in the configuration and in the answer sources."""
+        return self.spec.name
+
+    def top_k_for(self, top_k: Optional[int]) -> int:
+        """Return the retrieval depth of the collection, reduced with the request's when its budget is short."""
+        if top_k is None or top_k >= settings.RETRIEVAL_TOP_K:
+            return self.spec.top_k
+        return min(self.spec.top_k, top_k)
+
+    def retriever_for(self, query_filter: Any, top_k: int) -> Any:
+        """Return the long-lived retriever, or a one-off one for a filtered or shallower search."""
+        if query_filter is None and top_k == self.spec.top_k:
+            return self.retriever
+        return self._build_retriever(query_filter, top_k=top_k, index=self.index)
+
+
+class CollectionRegistry:
+    """The configured collections and the router choosing which of them a query searches."""
+
+    def __init__(self, handles: List[CollectionHandle]):
+        """Index the collection handles by name."""
+        self.handles: Dict[str, CollectionHandle] = {handle.name: handle for handle in handles}
+        self.defaults = [handle for handle in handles if handle.spec.default] or list(handles)
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def route(self, question: str, scope: Optional[Dict[str, Any]] = None) -> List[CollectionHandle]:
+        """Return the collections a question searches, best match first."""
+        requested = (scope or {}).get("collections") or []
+        if requested:
+            handles = [self.handles[name] for name in requested if name in self.handles]
+            unknown = [name for name in requested if name not in self.handles]
+            if unknown:
+                logger.warning(f"Ignoring unknown collections in scope: {unknown}")
+            if handles:
+                return self._record(handles, "scope")
+
+        text = question.lower()
+        words = tokenize(question)
+        scored = [(handle.spec.matches(words, text), handle) for handle in self.handles.values()]
+        matched = [handle for score, handle in sorted(scored, key=lambda item: -item[0]) if score > 0]
+        if matched:
+            return self._record(matched[:settings.COLLECTION_ROUTER_MAX], "keyword")
+        return self._record(self.defaults, "default")
+
+    def _record(self, handles: List[CollectionHandle], reason: str) -> List[CollectionHandle]:
+        """Count the routing decision and return its collections."""
+        for handle in handles:
+            metrics.inc("cri_collection_routes_total", collection=handle.name, reason=reason)
+        logger.debug(f"Routed query to collections {[handle.name for handle in handles]}", reason=reason)
+        return handles
+
+    @staticmethod
+    def version(handles: Sequence[CollectionHandle]) -> str:
+        """Return the joint version of a set of collections, used to key the retrieval caches."""
+        return "+".join(handle.version.current() for handle in handles)
+
+
+def merge_by_score(results: Sequence[List[Any]], limit: int) -> List[Any]:
+    """Merge the nodes retrieved from several collections, best similarity first, keeping `limit`."""
+    nodes = [node for result in results for node in result]
+    nodes.sort(key=lambda node: node.score if node.score is not None else float("-inf"), reverse=True)
+    return nodes[:limit]
+
+
+def configured_collections() -> List[CollectionSpec]:
+    """Return the configured collections, or an empty list to search QDRANT_COLLECTION alone."""
+    path = settings.COLLECTIONS_CONFIG_PATH
+    if not path:
+        return []
+    if not os.path.exists(path):
+        logger.warning(f"Collection configuration {path} not found, searching {settings.QDRANT_COLLECTION} only")
+        return []
+    specs = load_collection_specs(path)
+    logger.info(f"Loaded {len(specs)} collections from {path}", collections=[spec.name for spec in specs])
+    return specs
@@ -0,0 +1,286 @@
+"""Shared, process-wide RAG components for the CroceRossa Qdrant Cloud application.
+
+The LlamaIndex stack and the OpenAI, Qdrant and Cohere SDKs are expensive to
+import and to connect. They are imported lazily here and built once per process,
+so that the API can start serving immediately and every request reuses the same
+clients (and their connection pools) instead of rebuilding them.
+"""
+
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.connections import connection_manager
+from app.core.logging import get_logger
+from app.rag.cache import VersionedCache, invalidate_caches
+from app.rag.collection_router import CollectionHandle, CollectionRegistry, CollectionSpec, configured_collections
+from app.rag.spelling import SpellingIndex, load_spelling_index
+from app.rag.qdrant_search import FULL_VECTOR_NAME, build_search_params, create_qdrant_client, matryoshka_enabled
+from app.rag.prompts import (
+    SYSTEM_PROMPT,
+    CONDENSE_SYSTEM_PROMPT,
+    CONDENSE_QUESTION_PROMPT,
+    RAG_PROMPT,
+    NO_CONTEXT_PROMPT,
+)
+from app.rag.versioning import CollectionVersionTracker
+
+if TYPE_CHECKING:
+    from app.rag.precomputed import PrecomputedAnswerStore
+
+logger = get_logger(__name__)
+
+_components_lock = threading.Lock()
+_components: Optional["RAGComponents"] = None
+
+
+def create_embed_model(embed_batch_size: int = 100) -> Any:
+    """Create the OpenAI embedding model on the shared OpenAI connection pool."""
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    return OpenAIEmbedding(
+        model_name=settings.EMBEDDING_MODEL,
+        api_key=settings.OPENAI_API_KEY,
+        embed_batch_size=embed_batch_size,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        timeout=settings.OPENAI_TIMEOUT,
+        http_client=connection_manager.http_client("openai"),
+    )
+
+
+class RAGComponents:
+    """Container for the heavy, long-lived objects used by every RAGEngine."""
+
+    def __init__(self):
+        """Import the LlamaIndex stack and build LLM, embeddings, Qdrant and reranker."""
+        # Import differiti: evitano di caricare llama_index all'avvio dell'applicazione
+        from llama_index.core import Settings as LlamaIndexSettings
+        from llama_index.core.prompts import PromptTemplate
+        from llama_index.llms.openai import OpenAI
+
+        logger.info("Building shared RAG components")
+
+        # LLM, condensazione ed embedding condividono lo stesso pool verso OpenAI
+        openai_http_client = connection_manager.http_client("openai")
+        
+        self.llm = OpenAI(
+            model=settings.LLM_MODEL,
+            api_key=settings.OPENAI_API_KEY,
+            temperature=0.1,
+            system_prompt=SYSTEM_PROMPT,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            timeout=settings.OPENAI_TIMEOUT,
+            http_client=openai_http_client,
+        )
+        # Modello piccolo per le domande semplici (None se il routing è disattivato)
+        self.small_llm = None
+        if settings.MODEL_ROUTING_ENABLED:
+            self.small_llm = OpenAI(
+                model=settings.LLM_SMALL_MODEL,
+                api_key=settings.OPENAI_API_KEY,
+                temperature=0.1,
+                system_prompt=SYSTEM_PROMPT,
+                max_retries=settings.OPENAI_MAX_RETRIES,
+                timeout=settings.OPENAI_TIMEOUT,
+                http_client=openai_http_client,
+            )
+        # Temperatura più bassa per riformulazioni più deterministiche
+        self.condensation_llm = OpenAI(
+            model=settings.LLM_SMALL_MODEL if settings.MODEL_ROUTING_ENABLED else settings.LLM_MODEL,
+            api_key=settings.OPENAI_API_KEY,
+            temperature=0.0,
+            system_prompt=CONDENSE_SYSTEM_PROMPT,
+            max_retries=settings.OPENAI_MAX_RETRIES,
+            timeout=settings.OPENAI_TIMEOUT,
+            http_client=openai_http_client,
+        )
+        self.embed_model = create_embed_model()
+
+        # Set the global LlamaIndex settings
+        LlamaIndexSettings.llm = self.llm
+        LlamaIndexSettings.embed_model = self.embed_model
+
+        # Initialize prompt templates
+        self.condense_question_prompt = PromptTemplate(CONDENSE_QUESTION_PROMPT)
+        self.qa_prompt = PromptTemplate(RAG_PROMPT)
+        self.no_context_prompt = PromptTemplate(NO_CONTEXT_PROMPT)
+
+        self._initialize_qdrant()
+
+        logger.info("Shared RAG components ready")
+
+    def _initialize_qdrant(self) -> None:
+        """Initialize connection to Qdrant and set up the vector store with Cohere reranker."""
+        from app.rag.precomputed import load_precomputed_store
+
+        logger.info("Connecting to Qdrant",
+                    url=settings.QDRANT_URL,
+                    collection=settings.QDRANT_COLLECTION,
+                    prefer_grpc=settings.QDRANT_PREFER_GRPC)
+
+        # Initialize Qdrant client (REST on the shared keep-alive pool, or gRPC)
+        self.qdrant_client = create_qdrant_client()
+
+        # QDRANT_COLLECTION può essere un alias: al cambio di versione le cache vengono svuotate
+        self.collection_version = CollectionVersionTracker(self.qdrant_client)
+        self.collection_version.on_change(invalidate_caches)
+        self.embedding_cache = VersionedCache("embedding", settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_TTL)
+        self.retrieval_cache = VersionedCache("retrieval", settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_CACHE_TTL)
+        # Risposte a domande autonome, servite solo come ripiego mentre OpenAI non risponde
+        self.stale_answer_cache = VersionedCache("stale_answer", settings.STALE_ANSWER_CACHE_SIZE, 0,
+                                                 invalidate_on_swap=False)
+        # Vocabolario del corpus per la correzione ortografica, caricato in background (senza correzione
+        # finché non è pronto: ricostruirlo scorre tutta la collection) e ricaricato al cambio di versione;
+        # spelling_loader è l'ultimo caricamento avviato, per chi deve attenderlo (job offline)
+        self.spelling: Optional[SpellingIndex] = None
+        self.spelling_loader = self._reload_spelling(None, self.collection_version.current())
+        self.collection_version.on_change(self._reload_spelling)
+        # Risposte precalcolate alle domande frequenti, servite solo sulla versione su cui sono state generate
+        self.precomputed: Optional["PrecomputedAnswerStore"] = load_precomputed_store(self.collection_version.current())
+        self.collection_version.on_change(self._reload_precomputed)
+
+        # Create vector store index
+        self.index = self._build_index(settings.QDRANT_COLLECTION)
+
+        # Create retriever with top k and the configured search parameters
+        self.retriever = self.build_retriever()
+
+        # Initialize and enable Cohere reranker
+        self.reranker: Any = None
+        try:
+            logger.info(f"Initializing Cohere reranker with top_k={settings.RERANK_TOP_K}")
+            self.reranker = self._create_reranker(settings.RERANK_TOP_K)
+            self.use_reranker = True
+            logger.info("Cohere reranker initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize Cohere reranker: {str(e)}", exc_info=True)
+            self.use_reranker = False
+            logger.warning("Cohere reranker disabled due to initialization failure")
+
+        # Collection separate (normativa, formazione, comitati...), ognuna con retriever e reranker propri
+        self.collections: Optional[CollectionRegistry] = None
+        specs = configured_collections()
+        if specs:
+            self.collections = self._initialize_collections(specs)
+
+        logger.info("Qdrant and retrievers initialized successfully")
+
+    def _build_index(self, collection_name: str) -> Any:
+        """Create the LlamaIndex vector store index of a Qdrant collection."""
+        from llama_index.core import VectorStoreIndex
+        from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+        # Set up QdrantVectorStore with correct content field
+        vector_store = QdrantVectorStore(
+            client=self.qdrant_client,
+            collection_name=collection_name,
+            text_key="page_content",
+            dense_vector_name=FULL_VECTOR_NAME if matryoshka_enabled() else None,
+        )
+        return VectorStoreIndex.from_vector_store(vector_store)
+
+    def _create_reranker(self, top_n: int) -> Any:
+        """Create a Cohere reranker keeping `top_n` documents, on the shared Cohere connection pool."""
+        import cohere
+        from llama_index.postprocessor.cohere_rerank import CohereRerank
+
+        reranker = CohereRerank(
+            api_key=settings.COHERE_API_KEY,
+            top_n=top_n,
+            model="rerank-multilingual-v2.0",  # Supporta anche l'italiano
+            max_retries=settings.COHERE_MAX_RETRIES,
+        )
+        # Sostituisce il client interno con uno basato sul pool condiviso
+        reranker._client = cohere.ClientV2(
+            api_key=settings.COHERE_API_KEY,
+            timeout=settings.COHERE_TIMEOUT,
+            httpx_client=connection_manager.http_client("cohere"),
+        )
+        return reranker
+
+    def _initialize_collections(self, specs: List[CollectionSpec]) -> CollectionRegistry:
+        """Build the long-lived index, retriever, version tracker and reranker of each configured collection.
+
+        QDRANT_COLLECTION, if configured, reuses the objects built above; rerankers
+        are shared by the collections keeping the same number of documents.
+        """
+        rerankers: Dict[int, Any] = {settings.RERANK_TOP_K: self.reranker} if self.use_reranker else {}
+        handles = []
+        for spec in specs:
+            if spec.collection == settings.QDRANT_COLLECTION:
+                index, version = self.index, self.collection_version
+            else:
+                index = self._build_index(spec.collection)
+                version = CollectionVersionTracker(self.qdrant_client, alias=spec.collection)
+                version.on_change(invalidate_caches)
+            if index is self.index and spec.top_k == settings.RETRIEVAL_TOP_K:
+                retriever = self.retriever
+            else:
+                retriever = self.build_retriever(top_k=spec.top_k, index=index)
+
+            reranker = None
+            if spec.use_reranker and self.use_reranker:
+                if spec.rerank_top_k not in rerankers:
+                    rerankers[spec.rerank_top_k] = self._create_reranker(spec.rerank_top_k)
+                reranker = rerankers[spec.rerank_top_k]
+
+            handles.append(CollectionHandle(spec, index, retriever, version, reranker, self.build_retriever))
+            logger.info(f"Collection '{spec.name}' ready", collection=spec.collection, top_k=spec.top_k,
+                        rerank_top_k=spec.rerank_top_k, reranker=reranker is not None)
+        return CollectionRegistry(handles)
+
+    def _reload_spelling(self, old_version: Optional[str], new_version: str) -> threading.Thread:
+        """Load the spelling index of a collection version in the background; the previous one stays in use meanwhile."""
+        def _load() -> None:
+            spelling = load_spelling_index(self.qdrant_client, new_version)
+            # Un caricamento lento non sostituisce quello di una versione più recente
+            if spelling is not None and self.collection_version.version == new_version:
+                self.spelling = spelling
+
+        thread = threading.Thread(target=_load, name="spelling-reload", daemon=True)
+        thread.start()
+        self.spelling_loader = thread
+        return thread
+
+    def _reload_precomputed(self, old_version: Optional[str], new_version: str) -> None:
+        """Load the precomputed answers of a new collection version (None until they are regenerated)."""
+        from app.rag.precomputed import load_precomputed_store
+
+        self.precomputed = load_precomputed_store(new_version)
+
+    def build_retriever(self, query_filter: Any = None, top_k: Optional[int] = None, index: Any = None) -> Any:
+        """Create a retriever on the shared index (or another collection's), optionally restricted by a Qdrant filter."""
+        from llama_index.core.retrievers import VectorIndexRetriever
+
+        vector_store_kwargs = {}
+        search_params = build_search_params()
+        if search_params is not None:
+            vector_store_kwargs["search_params"] = search_params
+        if query_filter is not None:
+            vector_store_kwargs["qdrant_filters"] = query_filter
+
+        return VectorIndexRetriever(
+            index=index or self.index,
+            similarity_top_k=top_k or settings.RETRIEVAL_TOP_K,
+            vector_store_kwargs=vector_store_kwargs,
+        )
+
+
+def get_components() -> RAGComponents:
+    """Return the process-wide RAG components, building them on first use.
+
+    A failed build is not cached, so the next call retries it.
+    """
+    global _components
+    if _components is not None:
+        return _components
+
+    with _components_lock:
+        if _components is None:
+            _components = RAGComponents()
+    return _components
+
+
+def components_ready() -> bool:
+    """Return True if the shared components have already been built."""
+    return _components is not None
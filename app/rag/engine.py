@@ -1,70 +1,94 @@
 """RAG engine implementation for the CroceRossa Qdrant Cloud application."""
 
-import json
-import traceback
-from typing import Dict, List, Optional, Any
-
-from llama_index.core import Settings as LlamaIndexSettings
-from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.core.postprocessor import SimilarityPostprocessor
-from llama_index.core.response_synthesizers import CompactAndRefine
-from llama_index.core.llms import ChatMessage, MessageRole
-from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.llms.openai import OpenAI
-from llama_index.postprocessor.cohere_rerank import CohereRerank
-from llama_index.core import VectorStoreIndex
-from llama_index.core.prompts import PromptTemplate
-import qdrant_client
-from llama_index.core.schema import TextNode
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Tuple
 
+from app.core.admission import OverloadedError, upstream_limiter
+from app.core.circuit import CircuitOpenError, circuit_breakers
 from app.core.config import settings
+from app.core.deadline import Deadline
 from app.core.logging import get_logger
+from app.rag.capture import QueryCapture, node_refs
+from app.rag.collection_router import CollectionHandle, CollectionRegistry, collection_search_executor, merge_by_score
+from app.rag.components import RAGComponents, get_components
+from app.rag.filters import build_scope_filter, chunk_metadata, collapse_duplicates, normalize_node_metadata
+from app.rag.hedging import qdrant_hedger
 from app.rag.memory import ConversationMemory
-from app.rag.prompts import (
-    SYSTEM_PROMPT,
-    CONDENSE_QUESTION_PROMPT,
-    RAG_PROMPT,
-    NO_CONTEXT_PROMPT,
-)
+from app.rag.qdrant_search import matryoshka_enabled, search_points
+from app.rag.routing import SMALL, RoutingDecision, llm_timer, record_decision, route_query, simple_decision
+from app.rag.usage import record_token_usage, token_usage
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+
 logger = get_logger(__name__)
 
+# Evento di log delle domande senza storia, da cui il job delle risposte precalcolate estrae le più frequenti
+STANDALONE_QUESTION_EVENT = "Standalone question"
+
+# Metadata riportati nelle fonti della risposta; tutti i metadata restano negli artefatti di debug.
+# Retriever e ricerca diretta danno ai nodi gli stessi metadata del chunk (filters.chunk_metadata)
+SOURCE_METADATA_FIELDS = ("source", "filename", "page", "document_type", "committee", "date", "collection")
+
+
+def _source_documents(nodes: List[Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Return the compact source references of the answer and the full chunks for the debug artifacts."""
+    sources, chunks = [], []
+    for node in nodes:
+        metadata = getattr(node, 'metadata', {}) or {}
+        node_text = getattr(node, 'text', '') or ''
+        node_id = getattr(node, 'node_id', None)
+        score = getattr(node, 'score', None)
+        score = round(score, 4) if score is not None else None
+        
+        # Extract text preview safely
+        preview_chars = settings.SOURCE_PREVIEW_CHARS
+        if not node_text:
+            preview = "[Contenuto non disponibile]"
+        else:
+            preview = node_text[:preview_chars] + ("..." if len(node_text) > preview_chars else "")
+        
+        sources.append({
+            "id": node_id,
+            "score": score,
+            "preview": preview,
+            "metadata": {key: metadata[key] for key in SOURCE_METADATA_FIELDS if key in metadata},
+        })
+        chunks.append({"id": node_id, "score": score, "text": node_text, "metadata": metadata})
+    return sources, chunks
+
 
 class RAGEngine:
     """RAG Engine for the CroceRossa Qdrant Cloud application."""
     
-    def __init__(self, memory: ConversationMemory = None):
-        """Initialize the RAG engine with the required components and an optional memory instance."""
+    def __init__(self, memory: ConversationMemory = None, components: Optional[RAGComponents] = None):
+        """Initialize the RAG engine with the shared components and an optional memory instance."""
         logger.info("Initializing RAG Engine" + (" with provided memory instance" if memory else ""))
         self._initialization_failed = False # Initialize the flag
+        # Traccia della richiesta corrente per la cattura del traffico (None se non catturata)
+        self.capture: Optional[QueryCapture] = None
         
         # Use the provided memory instance or create a new one
         self.memory = memory or ConversationMemory()
         
-        self._qdrant_initialized = False  # Track Qdrant initialization
-        
         try:
-            # Set the global LlamaIndex settings
-            LlamaIndexSettings.llm = OpenAI(
-                model=settings.LLM_MODEL,
-                api_key=settings.OPENAI_API_KEY,
-                temperature=0.1,
-                system_prompt=SYSTEM_PROMPT,
-            )
-            
-            LlamaIndexSettings.embed_model = OpenAIEmbedding(
-                model_name=settings.EMBEDDING_MODEL,
-                api_key=settings.OPENAI_API_KEY,
-            )
-            
-            # Connect to Qdrant
-            self._initialize_qdrant()
-            
-            # Initialize prompt templates
-            self.condense_question_prompt = PromptTemplate(CONDENSE_QUESTION_PROMPT)
-            self.qa_prompt = PromptTemplate(RAG_PROMPT)
-            self.no_context_prompt = PromptTemplate(NO_CONTEXT_PROMPT)
+            # I componenti pesanti (LLM, embedding, Qdrant, Cohere) sono condivisi dal processo
+            components = components or get_components()
+            self.components = components
+            
+            self.llm = components.llm
+            self.small_llm = components.small_llm
+            self.condensation_llm = components.condensation_llm
+            self.embed_model = components.embed_model
+            self.qdrant_client = components.qdrant_client
+            self.index = components.index
+            self.retriever = components.retriever
+            self.reranker = components.reranker
+            self.use_reranker = components.use_reranker
+            
+            self.condense_question_prompt = components.condense_question_prompt
+            self.qa_prompt = components.qa_prompt
+            self.no_context_prompt = components.no_context_prompt
             
             logger.info("RAG Engine initialization complete")
         except Exception as e:
@@ -72,77 +96,57 @@ class RAGEngine:
             # Set flag to indicate initialization failure
             self._initialization_failed = True
     
-    def _initialize_qdrant(self) -> None:
-        """Initialize connection to Qdrant and set up the vector store with Cohere reranker."""
-        # Skip if already initialized to prevent multiple connections
-        if self._qdrant_initialized:
-            logger.debug("Qdrant already initialized, skipping")
-            return
-            
-        try:
-            logger.info("Connecting to Qdrant", 
-                        url=settings.QDRANT_URL, 
-                        collection=settings.QDRANT_COLLECTION)
-            
-            # Initialize Qdrant client
-            self.qdrant_client = qdrant_client.QdrantClient(
-                url=settings.QDRANT_URL, 
-                api_key=settings.QDRANT_API_KEY
-            )
-            
-            # Set up QdrantVectorStore with correct content field
-            vector_store = QdrantVectorStore(
-                client=self.qdrant_client,
-                collection_name=settings.QDRANT_COLLECTION,
-                content_payload_key="page_content"  # <-- Qui è il fix principale!
-            )
-            
-            # Create vector store index
-            self.index = VectorStoreIndex.from_vector_store(vector_store)
-            
-            # Create retriever with top k
-            self.retriever = VectorIndexRetriever(
-                index=self.index,
-                similarity_top_k=settings.RETRIEVAL_TOP_K,
-            )
-            
-            # Initialize and enable Cohere reranker
-            try:
-                logger.info(f"Initializing Cohere reranker with top_k={settings.RERANK_TOP_K}")
-                self.reranker = CohereRerank(
-                    api_key=settings.COHERE_API_KEY,
-                    top_n=settings.RERANK_TOP_K,
-                    model_name="rerank-multilingual-v2.0"  # Supporta anche l'italiano
-                )
-                self.use_reranker = True
-                logger.info("Cohere reranker initialized successfully")
-            except Exception as e:
-                logger.error(f"Failed to initialize Cohere reranker: {str(e)}", exc_info=True)
-                self.use_reranker = False
-                logger.warning("Cohere reranker disabled due to initialization failure")
-            
-            logger.info("Qdrant and retrievers initialized successfully")
-            self._qdrant_initialized = True
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize Qdrant: {str(e)}", exc_info=True)
-            raise
+    def _capture_upstream(self, upstream: str, call: str, started_at: float, **data: Any) -> None:
+        """Record an upstream call in the traffic capture of the current request, if any."""
+        if self.capture is not None:
+            self.capture.upstream(upstream, call, time.monotonic() - started_at, **data)
+    
+    def search_question(self, question: str) -> str:
+        """Return the form of a standalone question used for retrieval, caches and precomputed answers."""
+        spelling = self.components.spelling
+        return spelling.correct(question) if spelling else question
+    
+    @staticmethod
+    def retrieval_key(search_question: str, filter_key: str, top_k: int, collection_names: Tuple[str, ...]) -> tuple:
+        """Return the retrieval cache key of a search (filter_key is the JSON of the Qdrant filter, or "")."""
+        return (search_question, filter_key, top_k, collection_names)
+    
+    def _embed_query(self, query: str, version: str) -> List[float]:
+        """Return the query embedding, reusing the one cached for the current collection version."""
+        embedding = self.components.embedding_cache.get(query, version)
+        if embedding is None:
+            started_at = time.monotonic()
+            with upstream_limiter.slot("openai_embeddings"), circuit_breakers.guard("openai_embeddings"):
+                embedding = self.embed_model.get_query_embedding(query)
+            # Il vettore non viene catturato: in replay lo sostituisce un vettore deterministico
+            self._capture_upstream("openai_embeddings", "embed", started_at, dimensions=len(embedding))
+            self.components.embedding_cache.set(query, embedding, version)
+        return embedding
     
-    def _direct_search(self, query: str) -> List[TextNode]:
+    def _direct_search(self, query: str, query_embedding: Optional[List[float]] = None,
+                       **search_overrides: Any) -> List["NodeWithScore"]:
         """
         Esegue una ricerca diretta su Qdrant in caso di fallimento del retriever standard.
+        
+        I parametri di ricerca (hnsw_ef, exact, score_threshold, payload_fields, limit)
+        usano i valori di Settings salvo override espliciti per la singola query.
         """
+        from llama_index.core.schema import NodeWithScore, TextNode
+        
         try:
-            # Ottieni l'embedding per la query
-            query_embedding = LlamaIndexSettings.embed_model.get_query_embedding(query)
+            # Ottieni l'embedding per la query (se non già calcolato)
+            if query_embedding is None:
+                started_at = time.monotonic()
+                with upstream_limiter.slot("openai_embeddings"), circuit_breakers.guard("openai_embeddings"):
+                    query_embedding = self.embed_model.get_query_embedding(query)
+                self._capture_upstream("openai_embeddings", "embed", started_at, dimensions=len(query_embedding))
             
             # Esegui la ricerca direttamente con il client Qdrant
-            results = self.qdrant_client.search(
-                collection_name=settings.QDRANT_COLLECTION,
-                query_vector=query_embedding,
-                limit=settings.RETRIEVAL_TOP_K,
-                with_payload=True
-            )
+            started_at = time.monotonic()
+            with upstream_limiter.slot("qdrant"), circuit_breakers.guard("qdrant"):
+                results = qdrant_hedger.run(
+                    lambda: search_points(self.qdrant_client, query_embedding, **search_overrides)
+                )
             
             if not results:
                 logger.warning(f"No results found in direct search for query: {query}")
@@ -161,17 +165,109 @@ class RAGEngine:
                 # Usa page_content come campo di testo
                 if 'page_content' in payload and payload['page_content']:
                     node = TextNode(
+                        id_=str(point.id),
                         text=payload['page_content'],
-                        metadata=payload.get('metadata', {})
+                        metadata=chunk_metadata(payload)
                     )
-                    nodes.append(node)
+                    nodes.append(NodeWithScore(node=node, score=point.score))
             
+            self._capture_upstream("qdrant", "direct_search", started_at, nodes=nodes)
             return nodes
             
+        except OverloadedError:
+            raise
         except Exception as e:
             logger.error(f"Error in direct search: {str(e)}", exc_info=True)
             return []
     
+    def _retrieve(self, query: str, query_filter: Any, version: str, top_k: Optional[int] = None,
+                  collections: Optional[List[CollectionHandle]] = None) -> List[Any]:
+        """Retrieve the nodes for a query from QDRANT_COLLECTION or from the routed collections."""
+        query_embedding = self._embed_query(query, version)
+        if not collections:
+            return self._collapse(self._search(query, query_embedding, query_filter, top_k))
+        
+        if len(collections) == 1:
+            return self._collapse(self._search(query, query_embedding, query_filter,
+                                               collections[0].top_k_for(top_k), collections[0]))
+        
+        # Una ricerca per collection in parallelo; gli score usano lo stesso embedding e sono confrontabili
+        futures = [
+            collection_search_executor.submit(self._search, query, query_embedding, query_filter,
+                                              handle.top_k_for(top_k), handle)
+            for handle in collections
+        ]
+        results = [future.result() for future in futures]
+        # Al reranker arrivano tanti documenti quanti ne cerca la collection più profonda
+        limit = max(handle.top_k_for(top_k) for handle in collections)
+        return self._collapse(merge_by_score(results, limit))
+    
+    def _search(self, query: str, query_embedding: List[float], query_filter: Any, top_k: Optional[int],
+                collection: Optional[CollectionHandle] = None) -> List[Any]:
+        """Search one collection with the query embedding, falling back to a direct Qdrant search."""
+        from llama_index.core.schema import QueryBundle
+        
+        search_overrides: Dict[str, Any] = {}
+        if collection is not None:
+            search_overrides["collection_name"] = collection.spec.collection
+        
+        # La ricerca a due stadi (vettore corto + rescoring) non passa dal retriever di LlamaIndex
+        if matryoshka_enabled():
+            return self._tag_collection(self._direct_search(query, query_embedding=query_embedding,
+                                                            query_filter=query_filter, limit=top_k,
+                                                            **search_overrides), collection)
+        
+        if collection is not None:
+            retriever = collection.retriever_for(query_filter, top_k)
+        elif query_filter or (top_k and top_k != settings.RETRIEVAL_TOP_K):
+            retriever = self.components.build_retriever(query_filter, top_k=top_k)
+        else:
+            retriever = self.retriever
+        
+        # Tenta prima con il retriever standard
+        try:
+            started_at = time.monotonic()
+            with upstream_limiter.slot("qdrant"), circuit_breakers.guard("qdrant"):
+                query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+                retrieved_nodes = qdrant_hedger.run(lambda: retriever.retrieve(query_bundle))
+            # Il retriever lascia i metadata del chunk annidati nel payload: gruppi di duplicati, fonti e pagine li leggono al primo livello
+            valid_nodes = normalize_node_metadata(
+                [node for node in retrieved_nodes if hasattr(node, 'text') and node.text]
+            )
+            self._capture_upstream("qdrant", "search", started_at, nodes=valid_nodes)
+        except OverloadedError:
+            raise
+        except Exception as e:
+            # Se il fallimento ha aperto il circuito di Qdrant, la ricerca diretta fallisce subito
+            logger.warning(f"Standard retriever failed, falling back to direct search: {str(e)}")
+            valid_nodes = []
+        
+        # Se non abbiamo risultati validi, prova con la ricerca diretta
+        if not valid_nodes:
+            valid_nodes = self._direct_search(query, query_embedding=query_embedding, query_filter=query_filter,
+                                              limit=top_k, **search_overrides)
+        
+        # Il retriever di LlamaIndex non passa la soglia a Qdrant (la ricerca diretta sì): si applica qui
+        threshold = settings.QDRANT_SCORE_THRESHOLD
+        if threshold is not None:
+            valid_nodes = [node for node in valid_nodes if node.score is not None and node.score >= threshold]
+        return self._tag_collection(valid_nodes, collection)
+    
+    @staticmethod
+    def _tag_collection(nodes: List[Any], collection: Optional[CollectionHandle]) -> List[Any]:
+        """Record in the node metadata the collection the nodes were retrieved from."""
+        if collection is not None:
+            for node in nodes:
+                node.node.metadata["collection"] = collection.name
+        return nodes
+    
+    def _collapse(self, nodes: List[Any]) -> List[Any]:
+        """Drop the retrieved near-duplicates of better-scoring chunks, so each rerank slot holds distinct text."""
+        collapsed = collapse_duplicates(nodes)
+        if len(collapsed) < len(nodes):
+            logger.info(f"Collapsed {len(nodes) - len(collapsed)} near-duplicate chunks", kept=len(collapsed))
+        return collapsed
+    
     def _validate_condensed_question(self, original: str, condensed: str) -> str:
         """Validate the condensed question to ensure it meets quality standards."""
         # Check if condensed question is empty or too short
@@ -179,25 +275,9 @@ class RAGEngine:
             logger.warning(f"Condensed question too short or empty, using original: '{condensed}'")
             return original
             
-        # Simple dictionary check for common Italian words to detect typos
-        common_italian_words = ["elezioni", "maggio", "quando", "dove", "come", "giorno", "giornata", 
-                                "elettorale", "votazioni", "voto", "urne", "seggio", "candidati", 
-                                "croce", "rossa", "italiana", "nella", "sono", "stanno", "prossime"]
-        
-        # Check if specific words appear with typos
+        # I refusi si correggono lato ricerca (spelling.correct): nomi e dettagli personali
+        # aggiunti dalla riformulazione non sono refusi e non devono scartarla
         words = condensed.split()
-        for word in words:
-            word_lower = word.lower().strip(",.?!;:")
-            # Skip very short words
-            if len(word_lower) <= 2:
-                continue
-                
-            # Check if it's a common word with slight typos
-            for common_word in common_italian_words:
-                # If words are similar but not exact (likely typo)
-                if word_lower != common_word and self._similar_words(word_lower, common_word, max_distance=2):
-                    logger.warning(f"Possible typo detected: '{word_lower}' might be '{common_word}', using original question")
-                    return original
                     
         # Check if condensed question contains obvious errors or typos (single letter words that aren't valid)
         suspicious_words = [w for w in words if len(w) == 1 and w.lower() not in ['a', 'e', 'è', 'o', 'i']]
@@ -228,45 +308,19 @@ class RAGEngine:
         # Everything looks good
         return condensed
         
-    def _similar_words(self, word1: str, word2: str, max_distance: int = 2) -> bool:
-        """Check if two words are similar using Levenshtein distance."""
-        # Basic implementation of Levenshtein distance
-        if abs(len(word1) - len(word2)) > max_distance:
-            return False
-            
-        if len(word1) > 3 and len(word2) > 3:
-            # For longer words, check if they start with the same characters
-            prefix_len = min(3, min(len(word1), len(word2)))
-            if word1[:prefix_len] != word2[:prefix_len]:
-                return False
-                
-        # Calculate Levenshtein distance
-        m, n = len(word1), len(word2)
-        dp = [[0 for _ in range(n+1)] for _ in range(m+1)]
-        
-        for i in range(m+1):
-            dp[i][0] = i
-        for j in range(n+1):
-            dp[0][j] = j
-            
-        for i in range(1, m+1):
-            for j in range(1, n+1):
-                cost = 0 if word1[i-1] == word2[j-1] else 1
-                dp[i][j] = min(
-                    dp[i-1][j] + 1,      # deletion
-                    dp[i][j-1] + 1,      # insertion
-                    dp[i-1][j-1] + cost  # substitution
-                )
-        
-        return dp[m][n] <= max_distance
-
-    def _condense_question(self, question: str) -> str:
+    def _condense_question(self, question: str, deadline: Optional[Deadline] = None) -> str:
         """Condense a follow-up question using conversation history."""
-        # Se non c'è storia o la domanda è molto breve, non riformulare
-        if not self.memory.is_follow_up_question() or len(question.split()) <= 3:
-            logger.info(f"Skipping condensation: no history or question too short: '{question}'")
+        # Si riformulano solo le domande che dipendono dalla conversazione (anafore, ellissi...)
+        if not self.memory.is_follow_up_question(question):
+            logger.info(f"Skipping condensation: no history or standalone question: '{question}'")
+            return question
+        
+        # Con poco tempo rimasto si cerca direttamente con la domanda originale
+        if deadline is not None and not deadline.allows("condensation", settings.DEADLINE_CONDENSE_MIN_REMAINING):
             return question
         
+        from llama_index.core.llms import ChatMessage, MessageRole
+        
         try:
             # Prepara la storia della conversazione per il prompt
             chat_history_str = ""
@@ -284,14 +338,6 @@ class RAGEngine:
             
             logger.info(f"Using {len(history)} exchanges for condensation to preserve personal details")
             
-            # Imposta una temperatura più bassa per risposte più deterministiche
-            condensation_llm = OpenAI(
-                model=settings.LLM_MODEL,
-                api_key=settings.OPENAI_API_KEY,
-                temperature=0.0,
-                system_prompt="Sei un assistente specializzato nella riformulazione di domande in italiano. Riformula la domanda di follow-up in una domanda autonoma, completa e chiara. Mantieni l'ortografia corretta. La domanda riformulata DEVE essere una frase completa e grammaticalmente corretta. ISTRUZIONE IMPORTANTE: Devi includere TUTTI i riferimenti a informazioni personali dell'utente (come nomi, preferenze, dettagli biografici) che sono stati menzionati in precedenza."
-            )
-            
             # Usa il prompt di condensazione
             prompt_content = self.condense_question_prompt.format(
                 chat_history=chat_history_str, 
@@ -303,24 +349,43 @@ class RAGEngine:
                 ChatMessage(role=MessageRole.USER, content=prompt_content)
             ]
             
-            response = condensation_llm.chat(messages)
+            # Se OpenAI è saturo la domanda originale viene usata senza riformulazione
+            started_at = time.monotonic()
+            with upstream_limiter.slot("openai_chat"), circuit_breakers.guard("openai_chat"), \
+                    llm_timer(self.condensation_llm.model, "condensation"):
+                response = self.condensation_llm.chat(messages)
+            record_token_usage(response, "condensation")
             condensed_question = response.message.content.strip()
+            self._capture_upstream("openai_chat", "condensation", started_at, model=self.condensation_llm.model,
+                                   text=condensed_question, usage=token_usage(response))
             
             # Validazione basilare
             if len(condensed_question) < 10 or "?" not in condensed_question:
                 logger.warning("Condensed question seems invalid, using original")
                 return question
+            condensed_question = self._validate_condensed_question(question, condensed_question)
             
             logger.info(f"Successfully condensed question: '{question}' → '{condensed_question}'")
             return condensed_question
             
+        except CircuitOpenError:
+            if deadline is not None:
+                deadline.degrade("condensation", reason="circuit_open")
+            return question
         except Exception as e:
             logger.error(f"Error condensing question: {str(e)}")
             return question
     
-    def _apply_reranking(self, query: str, nodes: List[TextNode]) -> List[TextNode]:
-        """Applica il reranking ai nodi recuperati utilizzando Cohere."""
-        if not self.use_reranker or not hasattr(self, 'reranker') or len(nodes) <= 1:
+    def _apply_reranking(self, query: str, nodes: List["NodeWithScore"],
+                         deadline: Optional[Deadline] = None, reranker: Any = None,
+                         top_n: Optional[int] = None) -> List["NodeWithScore"]:
+        """Applica il reranking ai nodi recuperati utilizzando Cohere.
+        
+        Le collection configurate possono usare un proprio reranker, che tiene `top_n` documenti.
+        """
+        reranker = reranker or (self.reranker if self.use_reranker else None)
+        top_n = top_n or settings.RERANK_TOP_K
+        if reranker is None or len(nodes) <= 1:
             logger.info("Skipping reranking: reranker disabled or not applicable")
             return nodes
             
@@ -328,7 +393,11 @@ class RAGEngine:
             logger.info(f"Applying Cohere reranking to {len(nodes)} nodes")
             
             # Applica il reranker di Cohere
-            reranked_nodes = self.reranker.postprocess(nodes, query_str=query)
+            # Se Cohere è saturo si prosegue con l'ordine del retrieval
+            started_at = time.monotonic()
+            with upstream_limiter.slot("cohere"), circuit_breakers.guard("cohere"):
+                reranked_nodes = reranker.postprocess(nodes, query_str=query)
+            self._capture_upstream("cohere", "rerank", started_at, nodes=reranked_nodes)
             
             if reranked_nodes:
                 logger.info(f"Successfully reranked nodes, keeping top {len(reranked_nodes)} of {len(nodes)}")
@@ -337,14 +406,121 @@ class RAGEngine:
                 logger.warning("Reranking returned empty results, using original nodes")
                 return nodes
                 
+        except CircuitOpenError:
+            # Circuito di Cohere aperto: ordine della ricerca vettoriale, con lo stesso numero di documenti
+            if deadline is not None:
+                deadline.degrade("rerank", reason="circuit_open")
+            return nodes[:top_n]
         except Exception as e:
             logger.error(f"Error during reranking: {str(e)}", exc_info=True)
             # In caso di errore, torna ai nodi originali
             return nodes
     
-    def query(self, question: str, include_prompt: bool = False) -> Dict[str, Any]:
-        """Process a user query and generate a response using instance-specific memory."""
-        logger.info(f"Processing query with instance memory: '{question}'")
+    def _reranker_for(self, collections: Optional[List[CollectionHandle]]) -> Tuple[Any, int]:
+        """Return the reranker of a query and the documents it keeps.
+        
+        When the routed collections differ, the reranker of the one keeping the most
+        documents is used; collections without a reranker keep the best by similarity.
+        """
+        if not collections:
+            return (self.reranker if self.use_reranker else None), settings.RERANK_TOP_K
+        reranking = [handle for handle in collections if handle.reranker is not None]
+        if not reranking:
+            return None, max(handle.spec.rerank_top_k for handle in collections)
+        best = max(reranking, key=lambda handle: handle.spec.rerank_top_k)
+        return best.reranker, best.spec.rerank_top_k
+    
+    def _stale_answer(self, question: str, answer_key: Optional[tuple], deadline: Deadline) -> Optional[Dict[str, Any]]:
+        """Return a previously generated answer to the same standalone question, if any, as a fallback."""
+        if answer_key is None:
+            return None
+        cached = self.components.stale_answer_cache.get_stale(answer_key)
+        if cached is None:
+            return None
+        
+        deadline.degrade("answer", reason="circuit_open")
+        self.memory.add_exchange(question, cached["answer"])
+        result = dict(cached)
+        result["metadata"] = deadline.summary()
+        return result
+    
+    def _build_answer_prompt(self, question: str, nodes: List[Any]) -> str:
+        """Assemble the answer prompt: fixed instructions, documents, then conversation and question.
+        
+        The cached prefix is the system prompt and the instructions, longer than the
+        provider's caching threshold; the documents keep the reranker's relevance
+        order, most relevant first.
+        """
+        context_str = "\n\n".join([
+            f"Documento {i+1}:\n{node.text}" 
+            for i, node in enumerate(nodes)
+        ])
+        return self.qa_prompt.format(
+            context=context_str,
+            question=question,
+            chat_history="\n".join([f"User: {q}\nAssistant: {a}" for q, a in self.memory.get_history()])
+        )
+    
+    def _llm_for(self, decision: RoutingDecision) -> Any:
+        """Return the LLM of a routing decision (the large model if the small one is not available)."""
+        if decision.tier == SMALL and self.small_llm is not None:
+            return self.small_llm
+        return self.llm
+    
+    def _answer_kwargs(self, deadline: Deadline) -> Dict[str, Any]:
+        """Return the completion arguments of the answer, capping its length when the budget is short."""
+        if deadline.allows("answer_max_tokens", settings.DEADLINE_FULL_ANSWER_MIN_REMAINING):
+            return {}
+        return {"max_tokens": settings.DEADLINE_REDUCED_MAX_TOKENS}
+    
+    def _precomputed_answer(self, question: str, search_question: str, version: str,
+                            deadline: Deadline) -> Optional[Dict[str, Any]]:
+        """Return the precomputed answer of a frequent standalone question, if any.
+        
+        The text lookup needs no upstream call; the vector lookup reuses the query
+        embedding that retrieval would compute (and cache) anyway.
+        """
+        store = self.components.precomputed
+        if store is None or not len(store):
+            return None
+        entry = store.lookup_text(question) or store.lookup_text(search_question)
+        if entry is None:
+            try:
+                entry = store.lookup_vector(self._embed_query(search_question, version))
+            except CircuitOpenError:
+                return None
+        if entry is None:
+            return None
+        
+        logger.info(f"Serving precomputed answer for '{question}'", matched=entry["question"])
+        self.memory.add_exchange(question, entry["answer"])
+        return {
+            "answer": entry["answer"],
+            "source_documents": entry["source_documents"],
+            "condensed_question": question,
+            "metadata": dict(deadline.summary(), model=entry.get("model"), precomputed=True),
+            "debug": {"full_prompt": None, "source_documents": entry["source_documents"]},
+        }
+    
+    def query(self, question: str, include_prompt: bool = False,
+              scope: Optional[Dict[str, Any]] = None,
+              deadline: Optional[Deadline] = None,
+              use_precomputed: bool = True,
+              capture: Optional[QueryCapture] = None) -> Dict[str, Any]:
+        """Process a user query and generate a response using instance-specific memory.
+        
+        Args:
+            question: The user's question
+            include_prompt: Whether to return the full prompt
+            scope: Optional scope (sources, document_types, committees, date_from, date_to)
+                   turned into a Qdrant payload filter, and the collections to search
+            deadline: Latency budget of the request; stages are degraded when time runs short
+            use_precomputed: Whether a frequent standalone question may be served from the precomputed answers
+            capture: Traffic capture trace recording the pipeline and its upstream calls
+        """
+        logger.info(f"Processing query with instance memory: '{question}'", scope=scope)
+        deadline = deadline or Deadline()
+        self.capture = capture
         
         try:
             # Check if initialization failed (flag set in __init__)
@@ -357,20 +533,74 @@ class RAGEngine:
                     "error": "Initialization failed",
                 }
 
-            # Condense the question if it's a follow-up
-            condensed_question = self._condense_question(question)
-            
-            # Tenta prima con il retriever standard
-            try:
-                retrieved_nodes = self.retriever.retrieve(condensed_question)
-                valid_nodes = [node for node in retrieved_nodes if hasattr(node, 'text') and node.text]
-            except Exception as e:
-                logger.warning(f"Standard retriever failed, falling back to direct search: {str(e)}")
-                valid_nodes = []
+            # Solo le domande senza storia hanno una risposta riutilizzabile da altre conversazioni
+            history_depth = len(self.memory.get_history())
+            standalone = history_depth == 0
             
-            # Se non abbiamo risultati validi, prova con la ricerca diretta
-            if not valid_nodes:
-                valid_nodes = self._direct_search(condensed_question)
+            # Condense the question if it's a follow-up
+            condensed_question = self._condense_question(question, deadline)
+            
+            # Refusi corretti col vocabolario del corpus: ricerca migliore e più hit nelle cache
+            search_question = self.search_question(condensed_question)
+            
+            # Restringe la ricerca allo scope richiesto (filtro sul payload indicizzato)
+            query_filter = build_scope_filter(scope)
+            
+            # Le cache sono valide solo per la versione corrente della collection
+            version = self.components.collection_version.current()
+            
+            # Con più collection configurate il router sceglie quali interrogare
+            registry: Optional[CollectionRegistry] = self.components.collections
+            collections = registry.route(search_question, scope) if registry is not None else None
+            retrieval_version = CollectionRegistry.version(collections) if collections else version
+            collection_names = tuple(handle.name for handle in collections) if collections else ()
+            if capture is not None:
+                capture.set(condensed_question=condensed_question, search_question=search_question, collection=version,
+                            collections=list(collection_names) or None)
+            
+            # Domande frequenti senza storia né scope: risposta precalcolata, senza pipeline
+            if standalone:
+                logger.info(STANDALONE_QUESTION_EVENT, question=question)
+                if use_precomputed and query_filter is None and not (scope or {}).get("collections"):
+                    precomputed = self._precomputed_answer(question, search_question, version, deadline)
+                    if precomputed is not None:
+                        if capture is not None:
+                            capture.set(precomputed=True, model=precomputed["metadata"].get("model"))
+                        return precomputed
+            
+            # Con poco tempo rimasto si recuperano meno documenti (meno payload da Qdrant, rerank più rapido)
+            top_k = settings.RETRIEVAL_TOP_K
+            if not deadline.allows("retrieval_depth", settings.DEADLINE_FULL_RETRIEVAL_MIN_REMAINING):
+                top_k = min(top_k, settings.DEADLINE_REDUCED_RETRIEVAL_TOP_K)
+            
+            filter_key = query_filter.model_dump_json() if query_filter else ""
+            retrieval_key = self.retrieval_key(search_question, filter_key, top_k, collection_names)
+            answer_key = (search_question.casefold(), filter_key, collection_names) if standalone else None
+            cached_nodes = self.components.retrieval_cache.get(retrieval_key, retrieval_version)
+            
+            if cached_nodes is not None:
+                logger.info(f"Using {len(cached_nodes)} cached retrieval results")
+                valid_nodes = list(cached_nodes)
+            else:
+                try:
+                    valid_nodes = self._retrieve(search_question, query_filter, version, top_k=top_k,
+                                                 collections=collections)
+                except CircuitOpenError:
+                    # Qdrant o l'embedding non rispondono: risultati scaduti della stessa ricerca, o una risposta già data
+                    cached_nodes = self.components.retrieval_cache.get_stale(retrieval_key)
+                    if cached_nodes is None:
+                        stale_result = self._stale_answer(question, answer_key, deadline)
+                        if stale_result is None:
+                            raise
+                        return stale_result
+                    deadline.degrade("retrieval", reason="circuit_open")
+                    valid_nodes = list(cached_nodes)
+                else:
+                    if valid_nodes:
+                        self.components.retrieval_cache.set(retrieval_key, list(valid_nodes), retrieval_version)
+            if capture is not None:
+                capture.set(top_k=top_k, retrieval_cached=cached_nodes is not None,
+                            retrieved=node_refs(valid_nodes))
                 
             # Check if we have any valid results
             if not valid_nodes:
@@ -380,13 +610,26 @@ class RAGEngine:
                     question=condensed_question,
                     chat_history="\n".join([f"User: {q}\nAssistant: {a}" for q, a in self.memory.get_history()])
                 )
-                response_text = LlamaIndexSettings.llm.complete(prompt).text
+                # Il messaggio senza contesto non richiede ragionamento: modello piccolo
+                decision = simple_decision()
+                started_at = time.monotonic()
+                with upstream_limiter.slot("openai_chat"), circuit_breakers.guard("openai_chat"), \
+                        llm_timer(decision.model, "answer_no_context"):
+                    response = self._llm_for(decision).complete(prompt, **self._answer_kwargs(deadline))
+                record_token_usage(response, "answer_no_context")
+                response_text = response.text
+                self._capture_upstream("openai_chat", "answer_no_context", started_at, model=decision.model,
+                                       text=response_text, usage=token_usage(response))
+                if capture is not None:
+                    capture.set(model=decision.model)
                 self.memory.add_exchange(question, response_text)
                 
                 result = {
                     "answer": response_text,
                     "source_documents": [],
                     "condensed_question": condensed_question,
+                    "metadata": dict(deadline.summary(), model=decision.model),
+                    "debug": {"full_prompt": prompt, "source_documents": []},
                 }
                 
                 # Include il prompt completo se richiesto
@@ -396,41 +639,52 @@ class RAGEngine:
                 return result
             
             # Applica il reranking ai nodi recuperati
-            if self.use_reranker and len(valid_nodes) > 1:
-                valid_nodes = self._apply_reranking(condensed_question, valid_nodes)
-                logger.info(f"Using {len(valid_nodes)} nodes after reranking")
-            
-            # Create context string from retrieved nodes
-            context_str = "\n\n".join([
-                f"Documento {i+1}:\n{node.text}" 
-                for i, node in enumerate(valid_nodes)
-            ])
+            reranked = False
+            reranker, rerank_top_k = self._reranker_for(collections)
+            if reranker is not None and len(valid_nodes) > 1:
+                if deadline.allows("rerank", settings.DEADLINE_RERANK_MIN_REMAINING):
+                    valid_nodes = self._apply_reranking(search_question, valid_nodes, deadline,
+                                                        reranker=reranker, top_n=rerank_top_k)
+                    reranked = "rerank" not in deadline.degradations
+                    logger.info(f"Using {len(valid_nodes)} nodes after reranking")
+                else:
+                    # Senza Cohere si tiene l'ordine della ricerca vettoriale, con lo stesso numero di documenti
+                    valid_nodes = valid_nodes[:rerank_top_k]
+            elif collections:
+                # Collection senza reranker: i migliori per similarità, nel numero configurato
+                valid_nodes = valid_nodes[:rerank_top_k]
             
             # Generate response
-            prompt = self.qa_prompt.format(
-                context=context_str,
-                question=condensed_question,
-                chat_history="\n".join([f"User: {q}\nAssistant: {a}" for q, a in self.memory.get_history()])
-            )
+            prompt = self._build_answer_prompt(condensed_question, valid_nodes)
+            
+            # Domande semplici al modello piccolo, domande complesse o multi-documento al modello grande
+            decision = route_query(condensed_question, valid_nodes, history_depth=history_depth,
+                                   condensed=condensed_question != question, reranked=reranked)
+            record_decision(decision)
+            if capture is not None:
+                capture.set(reranked=node_refs(valid_nodes) if reranked else None, model=decision.model,
+                            routing_cues=decision.cues)
             
-            response_text = LlamaIndexSettings.llm.complete(prompt).text
+            try:
+                started_at = time.monotonic()
+                with upstream_limiter.slot("openai_chat"), circuit_breakers.guard("openai_chat"), \
+                        llm_timer(decision.model, "answer"):
+                    response = self._llm_for(decision).complete(prompt, **self._answer_kwargs(deadline))
+                record_token_usage(response, "answer")
+                response_text = response.text
+                self._capture_upstream("openai_chat", "answer", started_at, model=decision.model,
+                                       text=response_text, usage=token_usage(response))
+            except CircuitOpenError:
+                stale_result = self._stale_answer(question, answer_key, deadline)
+                if stale_result is None:
+                    raise
+                return stale_result
             
             # Add to conversation memory (self.memory is now session-specific)
             self.memory.add_exchange(question, response_text)
             
-            # Prepare source documents info
-            source_docs = []
-            for node in valid_nodes:
-                metadata = getattr(node, 'metadata', {}) or {}
-                
-                # Extract text preview safely
-                node_text = getattr(node, 'text', '')
-                text_preview = (node_text[:200] + "...") if node_text else "[Contenuto non disponibile]"
-                
-                source_docs.append({
-                    "text": text_preview,
-                    "metadata": metadata
-                })
+            # Fonti compatte nella risposta; prompt e testi completi solo negli artefatti di debug
+            source_docs, chunks = _source_documents(valid_nodes)
             
             logger.info("Query processed successfully")
             
@@ -439,6 +693,10 @@ class RAGEngine:
                 "source_documents": source_docs,
                 "condensed_question": condensed_question,
             }
+            if answer_key is not None:
+                self.components.stale_answer_cache.set(answer_key, dict(result), retrieval_version)
+            result["metadata"] = dict(deadline.summary(), model=decision.model)
+            result["debug"] = {"full_prompt": prompt, "source_documents": chunks, "routing_cues": decision.cues}
             
             # Include il prompt completo se richiesto
             if include_prompt:
@@ -446,6 +704,9 @@ class RAGEngine:
             
             return result
             
+        except OverloadedError:
+            # Sovraccarico o circuito aperto senza ripiego: l'API risponde 429/503, la memoria non viene toccata
+            raise
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}", exc_info=True)
             error_message = "Mi dispiace, si è verificato un errore durante l'elaborazione della tua richiesta. Riprova più tardi o contatta il supporto tecnico."
@@ -0,0 +1,114 @@
+"""Query scopes and Qdrant payload filters for the CroceRossa Qdrant Cloud application.
+
+A scope narrows a query to a slice of the collection (document source, document
+type, committee, date range). Each scope field maps to a ``metadata.*`` payload
+key, backed by a payload index created with ``python -m app.rag.collection indexes``.
+"""
+
+from datetime import date, datetime, time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+from app.core.logging import get_logger
+
+if TYPE_CHECKING:
+    from qdrant_client.http import models as rest
+
+logger = get_logger(__name__)
+
+# Campo dello scope -> (chiave del payload, tipo di indice Qdrant)
+SCOPE_PAYLOAD_FIELDS = {
+    "sources": ("metadata.source", "keyword"),
+    "document_types": ("metadata.document_type", "keyword"),
+    "committees": ("metadata.committee", "keyword"),
+}
+DATE_PAYLOAD_FIELD = ("metadata.date", "datetime")
+# Gruppo di chunk quasi duplicati assegnato dall'ingestion (chiave in metadata)
+DUPLICATE_GROUP_KEY = "duplicate_group"
+# Chiave del payload con i metadata del chunk; page_content, file_key e content_hash stanno al livello superiore
+CHUNK_METADATA_KEY = "metadata"
+
+
+def payload_index_fields() -> Dict[str, str]:
+    """Return the payload keys that need an index, with their schema type."""
+    fields = {key: schema for key, schema in SCOPE_PAYLOAD_FIELDS.values()}
+    fields[DATE_PAYLOAD_FIELD[0]] = DATE_PAYLOAD_FIELD[1]
+    return fields
+
+
+def chunk_metadata(payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Return the chunk metadata of a Qdrant payload, or of node metadata already holding only them."""
+    nested = (payload or {}).get(CHUNK_METADATA_KEY)
+    if isinstance(nested, dict):
+        return dict(nested)
+    return dict(payload or {})
+
+
+def normalize_node_metadata(nodes: List[Any]) -> List[Any]:
+    """Give the retrieved nodes the chunk metadata alone, whatever search produced them.
+
+    The LlamaIndex retriever reads our payloads with its legacy parser, which
+    keeps the whole payload as node metadata (chunk metadata nested under
+    ``metadata``); the direct search builds the nodes from the chunk metadata.
+    """
+    for node in nodes:
+        node.node.metadata = chunk_metadata(node.node.metadata)
+    return nodes
+
+
+def collapse_duplicates(nodes: List[Any]) -> List[Any]:
+    """Keep only the first (best) retrieved node of each duplicate group, in order."""
+    seen = set()
+    collapsed = []
+    for node in nodes:
+        group = (getattr(node, "metadata", {}) or {}).get(DUPLICATE_GROUP_KEY)
+        if group is not None:
+            if group in seen:
+                continue
+            seen.add(group)
+        collapsed.append(node)
+    return collapsed
+
+
+def _as_datetime(value: Union[str, date, datetime, None], end_of_day: bool = False) -> Optional[datetime]:
+    """Convert a date (or ISO string) to a datetime covering the whole day."""
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return datetime.combine(value, time.max if end_of_day else time.min)
+
+
+def build_scope_filter(scope: Optional[Dict[str, Any]]) -> Optional["rest.Filter"]:
+    """Build a Qdrant filter from a query scope.
+
+    Args:
+        scope: Dictionary with optional keys sources, document_types, committees
+               (lists of values, any of which may match) and date_from/date_to
+
+    Returns:
+        A Filter requiring every provided scope field, or None if the scope is empty
+    """
+    if not scope:
+        return None
+
+    from qdrant_client.http import models as rest
+
+    conditions: List[Any] = []
+    for field, (payload_key, _) in SCOPE_PAYLOAD_FIELDS.items():
+        values = [v for v in (scope.get(field) or []) if v]
+        if values:
+            conditions.append(rest.FieldCondition(key=payload_key, match=rest.MatchAny(any=values)))
+
+    date_from = _as_datetime(scope.get("date_from"))
+    date_to = _as_datetime(scope.get("date_to"), end_of_day=True)
+    if date_from or date_to:
+        conditions.append(rest.FieldCondition(
+            key=DATE_PAYLOAD_FIELD[0],
+            range=rest.DatetimeRange(gte=date_from, lte=date_to),
+        ))
+
+    if not conditions:
+        return None
+
+    logger.debug(f"Built scope filter with {len(conditions)} conditions")
+    return rest.Filter(must=conditions)
@@ -0,0 +1,189 @@
+"""Local follow-up detection for the CroceRossa Qdrant Cloud application.
+
+Every question asked with some conversation history used to go through the
+condensation LLM, although most second-turn questions start a new,
+self-contained topic. The detector decides locally whether a question depends
+on the conversation by scoring Italian linguistic cues, in microseconds and
+always the same way for the same input:
+
+- continuation openers ("e", "ma", "invece", "quindi", "e se"...);
+- anaphora: demonstratives and pronouns ("questo", "quella", "lo", "ne"...) and
+  enclitic pronouns ("farlo", "richiederla");
+- references to the conversation ("come hai detto", "di prima");
+- ellipsis: very short questions that cannot stand alone ("E a Milano?");
+- lexical overlap of a short question with the previous exchange.
+
+Only questions whose score reaches FOLLOW_UP_THRESHOLD are condensed.
+
+Usage:
+    python -m app.rag.followup "E quanto costa?" --previous "Come mi iscrivo al corso base?"
+    python -m app.rag.followup --evaluate etichette.jsonl
+"""
+
+import argparse
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_followup_decisions_total", "counter", "Follow-up detector decisions (follow_up, standalone)")
+metrics.describe("cri_followup_cues_total", "counter", "Follow-up cues found in questions with history, by cue")
+
+WORD_PATTERN = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+CONTINUATION_OPENERS = {
+    "e", "ed", "ma", "però", "invece", "quindi", "allora", "anche", "poi", "oppure", "inoltre", "dunque",
+    "perciò", "altrimenti", "comunque",
+}
+ANAPHORA = {
+    "questo", "questa", "questi", "queste", "quello", "quella", "quelli", "quelle", "quel", "quei", "quegli",
+    "ciò", "esso", "essa", "essi", "esse", "lui", "lei", "loro", "stesso", "stessa", "stessi", "stesse",
+    "suddetto", "suddetta", "tale", "tali", "medesimo", "medesima", "lì", "là", "ne", "glielo", "gliela", "gliene",
+}
+# "lo", "la", "le"... sono anche articoli: sono pronomi solo davanti a un verbo ("lo posso fare?")
+PROCLITICS = {"lo", "la", "li", "le", "gli"}
+CLITIC_VERBS = {
+    "posso", "puoi", "può", "possiamo", "possono", "devo", "deve", "devono", "dobbiamo", "faccio", "fa", "fanno",
+    "trovo", "trova", "richiedo", "chiedo", "pago", "prendo", "uso", "vedo", "so", "sai", "conosco", "ho", "hai",
+    "ha", "hanno", "mando", "invio", "consegno", "porto", "rinnovo", "compilo", "scarico", "ricevo", "ottengo",
+}
+ENCLITIC_PATTERN = re.compile(r"\w+(?:ar|er|ir|and|end)(?:lo|la|li|le|ne|gli|celo|cela|cene|glielo|gliela)$")
+CONVERSATION_REFERENCES = (
+    "hai detto", "hai scritto", "mi hai", "di prima", "prima hai", "detto prima", "come sopra", "appena detto",
+    "ho detto", "ti ho", "a proposito", "riguardo a questo", "in tal caso",
+)
+STOPWORDS = {
+    "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "di", "a", "da", "in", "con", "su", "per", "tra",
+    "fra", "del", "dello", "della", "dei", "degli", "delle", "al", "allo", "alla", "ai", "agli", "alle", "dal",
+    "dalla", "dai", "nel", "nella", "nei", "nelle", "sul", "sulla", "sui", "che", "chi", "cosa", "come", "quando",
+    "dove", "perché", "quale", "quali", "quanto", "quanti", "quanta", "quante", "e", "ed", "o", "ma", "non", "si",
+    "mi", "ti", "ci", "vi", "è", "sono", "ho", "hai", "ha", "posso", "puoi", "può", "devo", "deve", "serve",
+    "servono", "fare", "essere", "avere", "mio", "mia", "miei", "mie", "tuo", "tua", "suo", "sua",
+}
+
+CUE_WEIGHTS: Dict[str, float] = {
+    "continuation": 2.0,
+    "anaphora": 2.0,
+    "enclitic": 2.0,
+    "conversation_reference": 2.0,
+    "ellipsis": 2.0,
+    "overlap": 1.0,
+}
+
+
+@dataclass
+class FollowUpDecision:
+    """Outcome of the follow-up detection for a question."""
+
+    is_follow_up: bool
+    score: float
+    cues: List[str] = field(default_factory=list)
+
+
+def _content_words(words: Sequence[str]) -> List[str]:
+    """Return the words carrying meaning (no stopwords, no very short words)."""
+    return [w for w in words if w not in STOPWORDS and len(w) > 2]
+
+
+def detect_follow_up(question: str,
+                     previous: Optional[Tuple[str, str]] = None,
+                     threshold: Optional[float] = None) -> FollowUpDecision:
+    """Decide whether a question needs the conversation to be understood.
+
+    Args:
+        question: The new user question
+        previous: The previous (question, answer) exchange, if any
+        threshold: Score from which the question is a follow-up (default FOLLOW_UP_THRESHOLD)
+    """
+    threshold = settings.FOLLOW_UP_THRESHOLD if threshold is None else threshold
+    lowered = question.lower()
+    words = WORD_PATTERN.findall(lowered)
+    if previous is None or not words:
+        return FollowUpDecision(False, 0.0)
+
+    cues: List[str] = []
+    # "E' possibile...?" è il verbo scritto con l'apostrofo, non la congiunzione
+    if words[0] in CONTINUATION_OPENERS and not lowered.lstrip().startswith(("e'", "e’")):
+        cues.append("continuation")
+    if any(w in ANAPHORA for w in words) or any(
+        w in PROCLITICS and following in CLITIC_VERBS for w, following in zip(words, words[1:])
+    ):
+        cues.append("anaphora")
+    if any(ENCLITIC_PATTERN.match(w) for w in words):
+        cues.append("enclitic")
+    if any(reference in lowered for reference in CONVERSATION_REFERENCES):
+        cues.append("conversation_reference")
+
+    content = _content_words(words)
+    # Domanda senza contenuto proprio ("E a Roma?", "Quanto costa?", "Perché?")
+    if len(content) <= 1:
+        cues.append("ellipsis")
+    # Domanda breve che riprende le parole dello scambio precedente
+    previous_words = set(_content_words(WORD_PATTERN.findall(" ".join(previous).lower())))
+    if content and len(words) <= 8 and sum(w in previous_words for w in content) / len(content) >= 0.5:
+        cues.append("overlap")
+
+    score = sum(CUE_WEIGHTS[cue] for cue in cues)
+    return FollowUpDecision(score >= threshold, score, cues)
+
+
+def record_decision(decision: FollowUpDecision) -> None:
+    """Count a decision and its cues in the metrics."""
+    metrics.inc("cri_followup_decisions_total", decision="follow_up" if decision.is_follow_up else "standalone")
+    for cue in decision.cues:
+        metrics.inc("cri_followup_cues_total", cue=cue)
+
+
+def evaluate(path: str) -> Dict[str, float]:
+    """Measure the detector on labeled JSONL lines {"previous": [q, a] or q, "question": ..., "follow_up": bool}."""
+    tp = fp = fn = tn = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            previous = item.get("previous")
+            if isinstance(previous, str):
+                previous = (previous, "")
+            predicted = detect_follow_up(item["question"], tuple(previous) if previous else None).is_follow_up
+            expected = bool(item["follow_up"])
+            tp += predicted and expected
+            fp += predicted and not expected
+            fn += expected and not predicted
+            tn += not predicted and not expected
+    total = tp + fp + fn + tn
+    return {
+        "examples": total,
+        "accuracy": round((tp + tn) / total, 3) if total else 0.0,
+        "precision": round(tp / (tp + fp), 3) if tp + fp else 0.0,
+        "recall": round(tp / (tp + fn), 3) if tp + fn else 0.0,
+        "condensation_rate": round((tp + fp) / total, 3) if total else 0.0,
+    }
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Rileva se una domanda dipende dalla conversazione")
+    parser.add_argument("question", nargs="?", help="Domanda da classificare")
+    parser.add_argument("--previous", default="", help="Domanda (o scambio) precedente")
+    parser.add_argument("--evaluate", default=None,
+                        help="File JSONL etichettato: {\"previous\", \"question\", \"follow_up\"} per riga")
+    args = parser.parse_args()
+
+    if args.evaluate:
+        print(json.dumps(evaluate(args.evaluate), indent=2))
+    elif args.question:
+        decision = detect_follow_up(args.question, (args.previous, "") if args.previous else None)
+        print(json.dumps({"follow_up": decision.is_follow_up, "score": decision.score, "cues": decision.cues}))
+    else:
+        parser.error("specify a question or --evaluate")
+
+
+if __name__ == "__main__":
+    main()
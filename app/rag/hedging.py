@@ -0,0 +1,222 @@
+"""Hedged requests for the CroceRossa Qdrant Cloud application.
+
+A search that has not answered within a high percentile of the recent search
+latencies is sent a second time; whichever copy answers first is used. The
+duplicate only costs the slow tail (about 100 - QDRANT_HEDGE_PERCENTILE percent
+of the searches) and cuts the p99 latency of the vector search, which sits on
+the critical path of every query.
+
+The original call runs in the caller's upstream slot; the hedged copy takes a
+second slot of the same upstream without waiting, and is not sent when the
+upstream is saturated, so hedging never pushes Qdrant past its concurrency
+limit. The losing call is not interrupted (the clients cannot abort a request
+in flight): it runs to completion, or to the client timeout, on the hedger's
+executor, whose max_workers bounds the abandoned calls still running.
+
+Calls never queue behind those losers: a copy is handed to the executor only
+when a worker is free right away. Otherwise the original call runs unhedged in
+the caller's thread and the hedge is skipped, so the hedging delay and the
+recorded latencies only ever measure Qdrant, from the moment a call starts.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Callable, Deque, Dict, Iterable, Optional, Tuple, TypeVar
+
+from app.core.admission import UpstreamLimiter, upstream_limiter
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_hedge_requests_total", "counter",
+                 "Hedgeable calls by outcome (fast, primary_won, hedge_won, no_slot, no_worker, failed)")
+metrics.describe("cri_hedge_latency_won_seconds", "histogram",
+                 "Latency saved when the hedged copy answered before the original call",
+                 buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+metrics.describe("cri_hedge_delay_seconds", "gauge", "Current delay before a call is hedged")
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    """Thread-safe rolling window of the most recent latencies."""
+
+    def __init__(self, size: int):
+        """Create an empty window holding at most ``size`` samples."""
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        """Record a latency in seconds."""
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        """Return the number of samples."""
+        return len(self._samples)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Return the given percentile (0-100) of the window, or None if it is empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100.0))
+        return samples[index]
+
+
+class Hedger:
+    """Runs calls with a hedged duplicate after a latency-percentile delay."""
+
+    def __init__(self,
+                 name: str,
+                 percentile: float,
+                 min_delay: float,
+                 window_size: int,
+                 min_samples: int,
+                 max_workers: int,
+                 enabled: bool = True,
+                 limiter: Optional[UpstreamLimiter] = None):
+        """Initialize the hedger.
+
+        Args:
+            name: Upstream name, used as metrics label
+            percentile: Latency percentile after which a call is hedged
+            min_delay: Lower bound of the hedging delay, in seconds
+            window_size: Recent latencies used to compute the percentile
+            min_samples: Samples required before hedging starts
+            max_workers: Threads running the original calls and their hedges
+            enabled: Whether calls are hedged at all
+            limiter: Concurrency limits from which each hedged copy takes a slot of
+                     the ``name`` upstream (the original call uses the caller's)
+        """
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.limiter = limiter
+        self.latencies = LatencyWindow(window_size)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-hedge")
+        # Worker liberi: una chiamata va all'executor solo se parte subito
+        self._free_workers = threading.BoundedSemaphore(max_workers)
+
+    def delay(self) -> Optional[float]:
+        """Return the current hedging delay, or None while hedging is off or warming up."""
+        if not self.enabled or len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.percentile(self.percentile) or 0.0)
+
+    def _timed(self, fn: Callable[[], T]) -> T:
+        """Run a call and record its latency, from the moment it starts, if it succeeds."""
+        started_at = time.monotonic()
+        result = fn()
+        self.latencies.add(time.monotonic() - started_at)
+        return result
+
+    def _submit(self, fn: Callable[[], T]) -> "Optional[Future[T]]":
+        """Start a call on a free worker, or return None if every worker is busy."""
+        if not self._free_workers.acquire(blocking=False):
+            return None
+        future = self._executor.submit(self._timed, fn)
+        future.add_done_callback(lambda _: self._free_workers.release())
+        return future
+
+    def run(self, fn: Callable[[], T]) -> T:
+        """Run ``fn``, starting an identical copy if it is slower than the hedging delay.
+
+        The first successful result is returned; the other call is cancelled if it
+        has not started, otherwise its result is discarded. An error is raised only
+        when every copy failed. With no free upstream slot or worker the call is not
+        hedged.
+        """
+        delay = self.delay()
+        if delay is None:
+            return self._timed(fn)
+
+        primary = self._submit(fn)
+        if primary is None:
+            # Tutti i worker sono occupati (anche da chiamate perdenti): niente coda, si esegue qui
+            metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="no_worker")
+            return self._timed(fn)
+
+        started_at = time.monotonic()
+        try:
+            result = primary.result(timeout=delay)
+            metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="fast")
+            return result
+        except FutureTimeoutError:
+            pass
+        except Exception:
+            metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="failed")
+            raise
+
+        if self.limiter is not None and not self.limiter.try_acquire(self.name):
+            metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="no_slot")
+            return primary.result()
+        hedge = self._submit(fn)
+        if hedge is None:
+            if self.limiter is not None:
+                self.limiter.release(self.name)
+            metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="no_worker")
+            return primary.result()
+        if self.limiter is not None:
+            # Lo slot resta occupato finché la copia gira, anche se la sua risposta viene scartata
+            hedge.add_done_callback(lambda _: self.limiter.release(self.name))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                answered_after = time.monotonic() - started_at
+                for other in pending:
+                    other.cancel()
+                if future is hedge:
+                    metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="hedge_won")
+                    primary.add_done_callback(
+                        lambda f: self._record_latency_won(f, started_at, answered_after)
+                    )
+                else:
+                    metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="primary_won")
+                logger.debug(f"Hedged {self.name} call answered", delay=round(delay, 3),
+                             elapsed=round(answered_after, 3), winner="hedge" if future is hedge else "primary")
+                return future.result()
+
+        metrics.inc("cri_hedge_requests_total", upstream=self.name, outcome="failed")
+        raise error
+
+    def _record_latency_won(self, primary: "Future[object]", started_at: float, answered_after: float) -> None:
+        """Observe how much later the original call answered than its hedge."""
+        if primary.cancelled() or primary.exception() is not None:
+            return
+        metrics.observe("cri_hedge_latency_won_seconds", time.monotonic() - started_at - answered_after,
+                        upstream=self.name)
+
+
+qdrant_hedger = Hedger(
+    "qdrant",
+    percentile=settings.QDRANT_HEDGE_PERCENTILE,
+    min_delay=settings.QDRANT_HEDGE_MIN_DELAY,
+    window_size=settings.QDRANT_HEDGE_WINDOW,
+    min_samples=settings.QDRANT_HEDGE_MIN_SAMPLES,
+    max_workers=2 * settings.UPSTREAM_CONCURRENCY_QDRANT,
+    enabled=settings.QDRANT_HEDGE_ENABLED,
+    limiter=upstream_limiter,
+)
+
+
+def _collect_hedge_metrics() -> Iterable[Tuple[str, Dict[str, object], float]]:
+    """Expose the current hedging delay at scrape time."""
+    delay = qdrant_hedger.delay()
+    if delay is not None:
+        yield "cri_hedge_delay_seconds", {"upstream": qdrant_hedger.name}, delay
+
+
+metrics.register_collector(_collect_hedge_metrics)
@@ -14,6 +14,7 @@ if __name__ == "__main__":
 
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.rag.followup import detect_follow_up, record_decision
 
 logger = get_logger(__name__)
 
@@ -146,15 +147,30 @@ class ConversationMemory:
             if last_exchange:
                 logger.debug(f"Last exchange: Q={last_exchange[0][:30]}..., A={last_exchange[1][:30]}...")
 
-    def is_follow_up_question(self) -> bool:
-        """Check if there's any conversation history, indicating a follow-up question.
+    def is_follow_up_question(self, question: Optional[str] = None) -> bool:
+        """Check whether a question depends on the conversation history.
         
+        Without history nothing is a follow-up. With history, the question is
+        classified by the local follow-up detector (anaphora, ellipsis,
+        continuation openers, overlap with the previous exchange); without a
+        question, or with detection disabled, any history counts as follow-up.
+        
+        Args:
+            question: The new user question
+            
         Returns:
-            True if there is conversation history, False otherwise
+            True if the question should be condensed with the history
         """
         has_history = len(self.memory) > 0
-        logger.debug(f"Checking if follow-up question: {has_history} (memory size: {len(self.memory)})")
-        return has_history
+        if not has_history or question is None or not settings.FOLLOW_UP_DETECTION_ENABLED:
+            logger.debug(f"Checking if follow-up question: {has_history} (memory size: {len(self.memory)})")
+            return has_history
+        
+        decision = detect_follow_up(question, self.memory[-1])
+        record_decision(decision)
+        logger.debug(f"Checking if follow-up question: {decision.is_follow_up}",
+                     score=decision.score, cues=decision.cues)
+        return decision.is_follow_up
         
     def get_recent_history(self, max_exchanges: int = 3) -> List[Tuple[str, str]]:
         """Get the most recent conversation exchanges, up to a specified limit.
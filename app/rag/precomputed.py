@@ -0,0 +1,243 @@
+"""Precomputed answers to frequent questions for the CroceRossa Qdrant Cloud application.
+
+A few hundred standalone questions make up most of the traffic. A batch job
+mines them from the application logs (the ``Standalone question`` events),
+runs each one through the full RAG pipeline offline and writes the answer, the
+sources and the question embedding to a compact store (one ``.npz`` file with
+float16 embeddings) that is loaded at startup.
+
+Online, a standalone question without scope is first looked up by its
+normalized text (no upstream call at all), then by cosine similarity of its
+embedding, which the pipeline computes and caches anyway, against the stored
+ones. The store is stamped with the physical collection it was built on and is
+only served while that collection is current; the ingestion pipeline refreshes
+it after each re-index.
+
+Usage:
+    python -m app.rag.precomputed build logs/app-*.log --top 300
+    python -m app.rag.precomputed refresh
+"""
+
+import argparse
+import glob
+import json
+import os
+import tempfile
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.api.coalescing import normalize_question
+from app.core.config import settings
+from app.core.logging import configure_logging, get_logger
+from app.core.metrics import metrics
+from app.rag.engine import STANDALONE_QUESTION_EVENT, RAGEngine
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_precomputed_requests_total", "counter",
+                 "Standalone questions looked up in the precomputed answer store (text, vector, miss)")
+
+
+class PrecomputedAnswerStore:
+    """In-memory precomputed answers, looked up by question text or embedding."""
+
+    def __init__(self, entries: List[Dict[str, Any]], embeddings: np.ndarray, collection_name: Optional[str]):
+        """Index the entries.
+
+        Args:
+            entries: One dict per question (question, search_question, answer, source_documents, model, count)
+            embeddings: Question embeddings, one row per entry
+            collection_name: Physical collection the answers were generated from
+        """
+        self.entries = entries
+        self.collection_name = collection_name
+        # Testo originale e forma corretta dall'ortografia, quella con cui cerca la pipeline
+        self._by_text = {}
+        for i, entry in enumerate(entries):
+            for text in (entry.get("search_question"), entry["question"]):
+                if text:
+                    self._by_text[normalize_question(text)] = i
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if len(entries):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.maximum(norms, 1e-12)
+        self._matrix = matrix
+
+    def __len__(self) -> int:
+        """Return the number of precomputed answers."""
+        return len(self.entries)
+
+    def lookup_text(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return the entry of a question with the same normalized text, if any."""
+        index = self._by_text.get(normalize_question(question))
+        if index is None:
+            return None
+        metrics.inc("cri_precomputed_requests_total", result="text")
+        return self.entries[index]
+
+    def lookup_vector(self, embedding: Sequence[float], min_similarity: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Return the entry whose question embedding is the most similar, if above min_similarity."""
+        min_similarity = settings.PRECOMPUTED_MIN_SIMILARITY if min_similarity is None else min_similarity
+        if not len(self.entries):
+            metrics.inc("cri_precomputed_requests_total", result="miss")
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self._matrix.shape[1]:
+            metrics.inc("cri_precomputed_requests_total", result="miss")
+            return None
+        similarities = self._matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            metrics.inc("cri_precomputed_requests_total", result="miss")
+            return None
+        metrics.inc("cri_precomputed_requests_total", result="vector")
+        return self.entries[best]
+
+    def save(self, path: str) -> None:
+        """Write the store atomically (entries as JSON, embeddings as float16)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        header = {"collection": self.collection_name, "entries": self.entries}
+        with tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".npz", delete=False) as f:
+            np.savez_compressed(f, embeddings=self._matrix.astype(np.float16),
+                                header=np.array(json.dumps(header, ensure_ascii=False)))
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PrecomputedAnswerStore":
+        """Read a store written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data["header"]))
+            embeddings = data["embeddings"]
+        return cls(header["entries"], embeddings, header.get("collection"))
+
+
+def load_precomputed_store(collection_name: str, path: Optional[str] = None) -> Optional[PrecomputedAnswerStore]:
+    """Return the store if it was built on the given collection version, otherwise None."""
+    if not settings.PRECOMPUTED_ENABLED:
+        return None
+    path = path or settings.PRECOMPUTED_STORE_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        store = PrecomputedAnswerStore.load(path)
+    except Exception as e:
+        logger.error(f"Could not load the precomputed answer store: {str(e)}")
+        return None
+    if store.collection_name != collection_name:
+        logger.warning("Precomputed answers belong to another collection version, not serving them",
+                       store_collection=store.collection_name, current_collection=collection_name)
+        return None
+    logger.info(f"Loaded {len(store)} precomputed answers", path=path)
+    return store
+
+
+def mine_questions(paths: Iterable[str], top: int, min_count: int = 2) -> List[Tuple[str, int]]:
+    """Return the most frequent standalone questions in JSON log files, as (question, count)."""
+    counts: Counter = Counter()
+    first_seen: Dict[str, str] = {}
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if STANDALONE_QUESTION_EVENT not in line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("event") != STANDALONE_QUESTION_EVENT or not event.get("question"):
+                    continue
+                key = normalize_question(event["question"])
+                counts[key] += 1
+                # Si conserva la prima forma vista della domanda, con maiuscole e punteggiatura
+                first_seen.setdefault(key, " ".join(event["question"].split()))
+    return [(first_seen[key], count) for key, count in counts.most_common(top) if count >= min_count]
+
+
+def build_store(questions: Sequence[Tuple[str, int]]) -> PrecomputedAnswerStore:
+    """Run each (question, count) through the full RAG pipeline and collect the answers.
+
+    Questions whose answer has no sources (no documents found, errors) are left
+    out: the online pipeline handles them. Each question is embedded in the
+    spelling-corrected form that the online lookup searches with.
+    """
+    from app.core.deadline import Deadline
+    from app.rag.components import get_components
+    from app.rag.memory import ConversationMemory
+
+    components = get_components()
+    collection_name = components.collection_version.current()
+    # Senza il vocabolario le domande verrebbero salvate senza la correzione applicata online
+    components.spelling_loader.join()
+    entries: List[Dict[str, Any]] = []
+    embeddings: List[List[float]] = []
+    for question, count in questions:
+        engine = RAGEngine(memory=ConversationMemory(), components=components)
+        # Offline il budget di latenza non conta: pipeline completa, senza degradazioni
+        result = engine.query(question, deadline=Deadline(0), use_precomputed=False)
+        if result.get("error") or not result.get("source_documents"):
+            logger.warning(f"No precomputed answer for '{question}'", error=result.get("error"))
+            continue
+        search_question = engine.search_question(question)
+        entries.append({
+            "question": question,
+            "search_question": search_question,
+            "answer": result["answer"],
+            "source_documents": result["source_documents"],
+            "model": (result.get("metadata") or {}).get("model"),
+            "count": count,
+        })
+        # Già calcolato (e in cache) dalla ricerca della pipeline
+        embeddings.append(engine._embed_query(search_question, collection_name))
+        logger.info(f"Precomputed answer {len(entries)}/{len(questions)}: '{question}'")
+    dimensions = len(embeddings[0]) if embeddings else settings.EMBEDDING_DIMENSIONS
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), dimensions)
+    return PrecomputedAnswerStore(entries, matrix, collection_name)
+
+
+def refresh_store(path: Optional[str] = None) -> Optional[PrecomputedAnswerStore]:
+    """Regenerate every answer of an existing store against the current collection version."""
+    path = path or settings.PRECOMPUTED_STORE_PATH
+    if not os.path.exists(path):
+        return None
+    previous = PrecomputedAnswerStore.load(path)
+    store = build_store([(entry["question"], entry.get("count", 0)) for entry in previous.entries])
+    store.save(path)
+    logger.info(f"Refreshed {len(store)} of {len(previous)} precomputed answers", collection=store.collection_name)
+    return store
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Risposte precalcolate alle domande più frequenti")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Estrai le domande più frequenti dai log e precalcola le risposte")
+    build_parser.add_argument("logs", nargs="+", help="File di log JSON dell'applicazione (anche pattern glob)")
+    build_parser.add_argument("--top", type=int, default=300, help="Numero massimo di domande")
+    build_parser.add_argument("--min-count", type=int, default=2, help="Occorrenze minime di una domanda")
+    build_parser.add_argument("--output", default=None, help="File dello store (default: PRECOMPUTED_STORE_PATH)")
+
+    refresh_parser = subparsers.add_parser("refresh", help="Rigenera le risposte dello store sulla versione corrente")
+    refresh_parser.add_argument("--output", default=None, help="File dello store (default: PRECOMPUTED_STORE_PATH)")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.command == "build":
+        paths = sorted({path for pattern in args.logs for path in glob.glob(pattern)})
+        questions = mine_questions(paths, args.top, args.min_count)
+        logger.info(f"Mined {len(questions)} frequent standalone questions from {len(paths)} log files")
+        store = build_store(questions)
+        store.save(args.output or settings.PRECOMPUTED_STORE_PATH)
+        print(json.dumps({"questions": len(questions), "precomputed": len(store),
+                          "collection": store.collection_name}, indent=2))
+    else:
+        store = refresh_store(args.output)
+        print(json.dumps({"precomputed": len(store) if store else 0,
+                          "collection": store.collection_name if store else None}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
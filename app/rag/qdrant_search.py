@@ -0,0 +1,230 @@
+"""Qdrant client factory and search helpers for the CroceRossa Qdrant Cloud application.
+
+Centralizes the transport choice (REST or gRPC), the quantization config and
+the per-query search parameters (``hnsw_ef``, exact search, quantization
+oversampling/rescore, score threshold, payload selection), so
+that the engine, the warm-up and the benchmarks all query Qdrant the same way.
+
+With ``QDRANT_VECTOR_MODE=matryoshka`` every point stores two named vectors: the
+full embedding and its first MATRYOSHKA_DIMENSIONS components, renormalized
+(``text-embedding-3`` models are trained so that this truncation is itself a
+valid embedding). Searches run on the short vector first and rescore the
+shortlist with the full one.
+"""
+
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
+
+from app.core.config import settings
+from app.core.connections import connection_manager
+from app.core.logging import get_logger
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+    from qdrant_client.http import models as rest
+
+logger = get_logger(__name__)
+
+# Nomi dei vettori in modalità matryoshka
+FULL_VECTOR_NAME = "full"
+SHORT_VECTOR_NAME = "short"
+
+
+def matryoshka_enabled() -> bool:
+    """Return True if the collection stores short and full named vectors."""
+    return settings.QDRANT_VECTOR_MODE.lower() == "matryoshka"
+
+
+def truncate_embedding(vector: List[float], dimensions: Optional[int] = None) -> List[float]:
+    """Return the first ``dimensions`` components of an embedding, L2-normalized."""
+    truncated = list(vector[:dimensions or settings.MATRYOSHKA_DIMENSIONS])
+    norm = math.sqrt(sum(v * v for v in truncated))
+    return [v / norm for v in truncated] if norm else truncated
+
+
+def point_vectors(vector: Union[List[float], Dict[str, List[float]]]) -> Union[List[float], Dict[str, List[float]]]:
+    """Return the vector(s) to store for a point in the configured vector mode.
+
+    Accepts a plain embedding or the named vectors of an existing point, so that
+    stored vectors can be copied between collections with different layouts.
+    """
+    full = vector[FULL_VECTOR_NAME] if isinstance(vector, dict) else vector
+    if not matryoshka_enabled():
+        return full
+    return {FULL_VECTOR_NAME: full, SHORT_VECTOR_NAME: truncate_embedding(full)}
+
+
+def create_qdrant_client(prefer_grpc: Optional[bool] = None) -> "QdrantClient":
+    """Create a Qdrant client using the configured transport.
+
+    Args:
+        prefer_grpc: Force gRPC (True) or REST (False); defaults to QDRANT_PREFER_GRPC
+
+    Returns:
+        A QdrantClient; REST calls always run on the shared keep-alive pool
+    """
+    import qdrant_client
+
+    if prefer_grpc is None:
+        prefer_grpc = settings.QDRANT_PREFER_GRPC
+
+    # Senza transport esplicito il client REST disabilita il keep-alive
+    return qdrant_client.QdrantClient(
+        url=settings.QDRANT_URL,
+        api_key=settings.QDRANT_API_KEY,
+        timeout=int(settings.QDRANT_TIMEOUT),
+        prefer_grpc=prefer_grpc,
+        grpc_port=settings.QDRANT_GRPC_PORT,
+        transport=connection_manager.transport("qdrant"),
+    )
+
+
+def build_quantization_config(mode: Optional[str] = None) -> Any:
+    """Build the collection quantization config for "scalar", "binary" or "none".
+
+    Returns:
+        A Qdrant quantization config, or None when quantization is disabled
+    """
+    from qdrant_client.http import models as rest
+
+    mode = (mode or settings.QDRANT_QUANTIZATION).lower()
+    if mode == "scalar":
+        return rest.ScalarQuantization(
+            scalar=rest.ScalarQuantizationConfig(
+                type=rest.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM,
+            )
+        )
+    if mode == "binary":
+        return rest.BinaryQuantization(
+            binary=rest.BinaryQuantizationConfig(always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM)
+        )
+    if mode == "none":
+        return None
+    raise ValueError(f"Unsupported quantization mode: {mode}")
+
+
+def build_search_params(hnsw_ef: Optional[int] = None,
+                        exact: Optional[bool] = None,
+                        oversampling: Optional[float] = None,
+                        rescore: Optional[bool] = None,
+                        ignore_quantization: bool = False) -> Optional["rest.SearchParams"]:
+    """Build Qdrant SearchParams from explicit values or the configured defaults.
+
+    Quantization parameters are sent only when the collection is quantized
+    (QDRANT_QUANTIZATION != "none") or when the caller asks to bypass it.
+
+    Returns:
+        SearchParams, or None when every parameter is left to the server default
+    """
+    from qdrant_client.http import models as rest
+
+    hnsw_ef = hnsw_ef if hnsw_ef is not None else settings.QDRANT_HNSW_EF
+    exact = exact if exact is not None else settings.QDRANT_EXACT_SEARCH
+
+    quantization = None
+    if ignore_quantization:
+        quantization = rest.QuantizationSearchParams(ignore=True)
+    elif settings.QDRANT_QUANTIZATION.lower() != "none":
+        quantization = rest.QuantizationSearchParams(
+            ignore=False,
+            rescore=rescore if rescore is not None else settings.QDRANT_QUANTIZATION_RESCORE,
+            oversampling=oversampling if oversampling is not None else settings.QDRANT_QUANTIZATION_OVERSAMPLING,
+        )
+
+    if hnsw_ef is None and not exact and quantization is None:
+        return None
+    return rest.SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization)
+
+
+def payload_selector(payload_fields: Optional[List[str]] = None) -> Union[bool, List[str]]:
+    """Return the with_payload value for a search.
+
+    An explicit empty list disables the payload; None uses QDRANT_PAYLOAD_FIELDS,
+    where an empty list means the whole payload.
+    """
+    if payload_fields is not None:
+        return list(payload_fields) if payload_fields else False
+    return list(settings.QDRANT_PAYLOAD_FIELDS) if settings.QDRANT_PAYLOAD_FIELDS else True
+
+
+def search_points(client: "QdrantClient",
+                  query_vector: List[float],
+                  limit: Optional[int] = None,
+                  collection_name: Optional[str] = None,
+                  hnsw_ef: Optional[int] = None,
+                  exact: Optional[bool] = None,
+                  oversampling: Optional[float] = None,
+                  rescore: Optional[bool] = None,
+                  ignore_quantization: bool = False,
+                  score_threshold: Optional[float] = None,
+                  payload_fields: Optional[List[str]] = None,
+                  query_filter: Any = None,
+                  two_stage: Optional[bool] = None,
+                  prefetch_multiplier: Optional[float] = None,
+                  using: Optional[str] = None) -> List["rest.ScoredPoint"]:
+    """Run a vector search with the configured (or overridden) search parameters.
+
+    Args:
+        client: The Qdrant client to use
+        query_vector: The query embedding
+        limit: Number of results; defaults to RETRIEVAL_TOP_K
+        collection_name: Target collection; defaults to QDRANT_COLLECTION
+        hnsw_ef: Override for QDRANT_HNSW_EF
+        exact: Override for QDRANT_EXACT_SEARCH
+        oversampling: Override for QDRANT_QUANTIZATION_OVERSAMPLING
+        rescore: Override for QDRANT_QUANTIZATION_RESCORE
+        ignore_quantization: Search the original float vectors only
+        score_threshold: Override for QDRANT_SCORE_THRESHOLD
+        payload_fields: Override for QDRANT_PAYLOAD_FIELDS ([] = no payload)
+        query_filter: Optional Qdrant filter
+        two_stage: In matryoshka mode, search the short vector and rescore with the
+                   full one (default); False runs a single-stage search on ``using``
+        prefetch_multiplier: Override for MATRYOSHKA_PREFETCH_MULTIPLIER
+        using: Named vector of a single-stage matryoshka search (default: full)
+
+    Returns:
+        The scored points, best first
+    """
+    from qdrant_client.http import models as rest
+
+    limit = limit or settings.RETRIEVAL_TOP_K
+    search_params = build_search_params(
+        hnsw_ef=hnsw_ef,
+        exact=exact,
+        oversampling=oversampling,
+        rescore=rescore,
+        ignore_quantization=ignore_quantization,
+    )
+    query: Any = query_vector
+    prefetch = None
+
+    if matryoshka_enabled():
+        using = using or FULL_VECTOR_NAME
+        if two_stage is None or two_stage:
+            # Primo stadio sul vettore corto, poi rescoring della shortlist con il vettore completo
+            multiplier = prefetch_multiplier or settings.MATRYOSHKA_PREFETCH_MULTIPLIER
+            prefetch = rest.Prefetch(
+                query=truncate_embedding(query_vector),
+                using=SHORT_VECTOR_NAME,
+                limit=max(limit, math.ceil(limit * multiplier)),
+                filter=query_filter,
+                params=search_params,
+            )
+            using, search_params = FULL_VECTOR_NAME, None
+        elif using == SHORT_VECTOR_NAME:
+            query = truncate_embedding(query_vector)
+
+    response = client.query_points(
+        collection_name=collection_name or settings.QDRANT_COLLECTION,
+        query=query,
+        using=using,
+        prefetch=prefetch,
+        limit=limit,
+        query_filter=query_filter,
+        search_params=search_params,
+        score_threshold=score_threshold if score_threshold is not None else settings.QDRANT_SCORE_THRESHOLD,
+        with_payload=payload_selector(payload_fields),
+    )
+    return response.points
@@ -0,0 +1,410 @@
+"""Deterministic replay of captured traffic for the CroceRossa Qdrant Cloud application.
+
+Feeds the queries recorded by the traffic capture (see ``app.rag.capture``)
+through the real RAGEngine, with its caches, condensation, spelling correction,
+precomputed answers, routing, hedging and concurrency limits, while every
+upstream call is answered locally:
+
+- ``recorded``: each call returns the response recorded for that query (search
+  results, rerank order, LLM texts and token usage) after its recorded latency;
+  calls the original request did not make fall back to the fakes;
+- ``fake``: deterministic local fakes with fixed latencies, for load tests that
+  do not depend on what the upstreams answered.
+
+Embeddings are never recorded: both modes use a deterministic vector derived
+from the query text. Queries are sent at their original inter-arrival times
+divided by --speed, or at a fixed --rate; the summary reports latency
+percentiles, errors, divergences from the recorded responses and cache hits.
+
+Usage:
+    python -m app.rag.replay "data/capture/*.ndjson.gz" --mode recorded --speed 2
+    python -m app.rag.replay "data/capture/*.ndjson.gz" --mode fake --rate 20 --concurrency 32
+"""
+
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.deadline import Deadline
+from app.core.logging import configure_logging, get_logger
+from app.core.metrics import metrics
+from app.rag.cache import VersionedCache
+from app.rag.capture import read_capture
+from app.rag.engine import RAGEngine
+from app.rag.memory import ConversationMemory
+
+logger = get_logger(__name__)
+
+RECORDED = "recorded"
+FAKE = "fake"
+
+# Latenze dei fake, in secondi (moltiplicate da --latency-scale)
+FAKE_LATENCIES: Dict[str, float] = {
+    "embed": 0.05,
+    "search": 0.03,
+    "direct_search": 0.03,
+    "rerank": 0.15,
+    "condensation": 0.6,
+    "answer": 2.0,
+    "answer_no_context": 0.8,
+}
+
+FAKE_ANSWER = "Risposta simulata per il replay del traffico."
+
+
+def fake_embedding(text: str, dimensions: Optional[int] = None) -> List[float]:
+    """Return a deterministic unit vector derived from a text."""
+    dimensions = dimensions or settings.EMBEDDING_DIMENSIONS
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class RecordTape:
+    """Upstream responses of one captured query, served in recording order."""
+
+    def __init__(self, record: Dict[str, Any], chunks: Dict[str, Dict[str, Any]], mode: str, latency_scale: float):
+        """Index the recorded upstream calls of a query by pipeline call."""
+        self.record = record
+        self.chunks = chunks
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.fallbacks = 0
+        self._calls: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        for entry in record.get("upstream", []):
+            self._calls.setdefault(entry["call"], []).append(entry)
+
+    def take(self, call: str) -> Optional[Dict[str, Any]]:
+        """Wait for and return the next recorded response of a call (None when the fakes must answer it)."""
+        entry = None
+        if self.mode == RECORDED:
+            with self._lock:
+                entries = self._calls.get(call)
+                entry = entries.pop(0) if entries else None
+                if entry is None:
+                    self.fallbacks += 1
+        latency = entry["latency"] if entry is not None else FAKE_LATENCIES.get(call, 0.0)
+        time.sleep(latency * self.latency_scale)
+        return entry
+
+    def nodes(self, refs: List[Dict[str, Any]]) -> List[Any]:
+        """Rebuild retrieved nodes from recorded IDs and scores and the captured chunk texts."""
+        from llama_index.core.schema import NodeWithScore, TextNode
+
+        nodes = []
+        for ref in refs:
+            chunk = self.chunks.get(ref["id"]) or {}
+            node = TextNode(id_=ref["id"], text=chunk.get("text") or f"Documento {ref['id']}",
+                            metadata=chunk.get("metadata") or {})
+            nodes.append(NodeWithScore(node=node, score=ref.get("score")))
+        return nodes
+
+    def fake_nodes(self, query: str, top_k: int) -> List[Any]:
+        """Return a deterministic selection of captured chunks (or synthetic ones) for a query."""
+        ids = sorted(self.chunks, key=lambda chunk_id: hashlib.sha256(f"{query}|{chunk_id}".encode("utf-8")).digest())
+        if not ids:
+            ids = [f"fake-{hashlib.sha256(f'{query}|{i}'.encode('utf-8')).hexdigest()[:16]}" for i in range(top_k)]
+        return self.nodes([{"id": chunk_id, "score": round(0.9 - i * 0.01, 6)} for i, chunk_id in enumerate(ids[:top_k])])
+
+
+class ReplayLLM:
+    """LLM answering with the recorded text of each call, or a fixed fake text."""
+
+    def __init__(self, tape: RecordTape, model: str):
+        """Bind the LLM to the tape of a query."""
+        self.tape = tape
+        self.model = model
+
+    def _response(self, call: str) -> SimpleNamespace:
+        """Return a response object with text, message and raw usage, like the LlamaIndex ones."""
+        entry = self.tape.take(call)
+        if entry is not None:
+            text, usage = entry.get("text", ""), entry.get("usage") or {}
+        else:
+            text, usage = (self.tape.record.get("condensed_question") if call == "condensation" else None) or FAKE_ANSWER, {}
+        raw = {"usage": {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "prompt_tokens_details": {"cached_tokens": usage.get("cached_tokens", 0)},
+        }}
+        return SimpleNamespace(text=text, message=SimpleNamespace(content=text), raw=raw)
+
+    def chat(self, messages: List[Any], **kwargs: Any) -> SimpleNamespace:
+        """Answer the condensation call."""
+        return self._response("condensation")
+
+    def complete(self, prompt: str, **kwargs: Any) -> SimpleNamespace:
+        """Answer the answer call (with or without context)."""
+        # Il prompt senza contesto non contiene la sezione dei documenti
+        call = "answer" if "Documento 1:" in prompt else "answer_no_context"
+        return self._response(call)
+
+
+class ReplayEmbedding:
+    """Embedding model returning deterministic vectors after the recorded latency."""
+
+    def __init__(self, tape: RecordTape):
+        """Bind the model to the tape of a query."""
+        self.tape = tape
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        """Return the vector of a query."""
+        entry = self.tape.take("embed")
+        return fake_embedding(query, entry.get("dimensions") if entry else None)
+
+
+class ReplayRetriever:
+    """Retriever returning the recorded search results of a query."""
+
+    def __init__(self, tape: RecordTape, call: str = "search", top_k: Optional[int] = None):
+        """Bind the retriever to the tape of a query."""
+        self.tape = tape
+        self.call = call
+        self.top_k = top_k
+        self._result: Optional[List[Any]] = None
+        self._lock = threading.Lock()
+
+    def retrieve(self, query_bundle: Any) -> List[Any]:
+        """Return the recorded results (once: a hedged duplicate gets the same answer)."""
+        with self._lock:
+            if self._result is None:
+                self._result = self._search(getattr(query_bundle, "query_str", query_bundle))
+            return list(self._result)
+
+    def _search(self, query: str) -> List[Any]:
+        """Return the recorded results, those of the response if the search was cached, or fake ones."""
+        top_k = self.top_k or self.tape.record.get("top_k") or settings.RETRIEVAL_TOP_K
+        entry = self.tape.take(self.call)
+        if entry is not None:
+            return self.tape.nodes(entry.get("results", []))
+        if self.tape.mode == RECORDED and self.tape.record.get("retrieved"):
+            return self.tape.nodes(self.tape.record["retrieved"])
+        return self.tape.fake_nodes(query, top_k)
+
+
+class ReplayReranker:
+    """Reranker returning the recorded rerank order of a query."""
+
+    def __init__(self, tape: RecordTape):
+        """Bind the reranker to the tape of a query."""
+        self.tape = tape
+
+    def postprocess(self, nodes: List[Any], query_str: str = "") -> List[Any]:
+        """Return the recorded order and scores, or the retrieval order cut to RERANK_TOP_K."""
+        entry = self.tape.take("rerank")
+        refs = entry.get("results") if entry is not None else None
+        if refs is None and self.tape.mode == RECORDED:
+            refs = self.tape.record.get("reranked")
+        if refs is None:
+            return nodes[:settings.RERANK_TOP_K]
+        by_id = {node.node_id: node for node in nodes}
+        reranked = []
+        for ref, rebuilt in zip(refs, self.tape.nodes(refs)):
+            node = by_id.get(ref["id"])
+            if node is not None:
+                rebuilt.node = node.node
+            reranked.append(rebuilt)
+        return reranked
+
+
+class ReplayComponents:
+    """Stand-in for RAGComponents: real caches, prompts and local stores, no upstream client."""
+
+    def __init__(self, collection_name: str):
+        """Build the shared caches and load the spelling and precomputed stores if present."""
+        from llama_index.core.prompts import PromptTemplate
+
+        from app.rag.precomputed import PrecomputedAnswerStore
+        from app.rag.prompts import CONDENSE_QUESTION_PROMPT, NO_CONTEXT_PROMPT, RAG_PROMPT
+        from app.rag.spelling import SpellingIndex
+
+        self.collection_version = SimpleNamespace(current=lambda: collection_name)
+        self.embedding_cache = VersionedCache("embedding", settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_TTL)
+        self.retrieval_cache = VersionedCache("retrieval", settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_CACHE_TTL)
+        self.stale_answer_cache = VersionedCache("stale_answer", settings.STALE_ANSWER_CACHE_SIZE, 0,
+                                                 invalidate_on_swap=False)
+        self.condense_question_prompt = PromptTemplate(CONDENSE_QUESTION_PROMPT)
+        self.qa_prompt = PromptTemplate(RAG_PROMPT)
+        self.no_context_prompt = PromptTemplate(NO_CONTEXT_PROMPT)
+        self.qdrant_client = None
+        self.index = None
+        self.use_reranker = True
+        # Il replay interroga solo QDRANT_COLLECTION: le query multi-collection usano la prima ricerca registrata
+        self.collections = None
+
+        # Stessi file locali della produzione, senza il controllo della versione (la collection non è contattata)
+        self.spelling = None
+        if settings.SPELLING_ENABLED and os.path.exists(settings.SPELLING_VOCABULARY_PATH):
+            self.spelling = SpellingIndex.load(settings.SPELLING_VOCABULARY_PATH,
+                                               max_edit_distance=settings.SPELLING_MAX_EDIT_DISTANCE)
+        self.precomputed = None
+        if settings.PRECOMPUTED_ENABLED and os.path.exists(settings.PRECOMPUTED_STORE_PATH):
+            self.precomputed = PrecomputedAnswerStore.load(settings.PRECOMPUTED_STORE_PATH)
+
+    def for_record(self, tape: RecordTape) -> "ReplayComponents":
+        """Return components sharing the caches and stores, with upstreams bound to a query's tape."""
+        components = copy.copy(self)
+        components.tape = tape
+        components.llm = ReplayLLM(tape, settings.LLM_MODEL)
+        components.small_llm = ReplayLLM(tape, settings.LLM_SMALL_MODEL) if settings.MODEL_ROUTING_ENABLED else None
+        components.condensation_llm = ReplayLLM(
+            tape, settings.LLM_SMALL_MODEL if settings.MODEL_ROUTING_ENABLED else settings.LLM_MODEL
+        )
+        components.embed_model = ReplayEmbedding(tape)
+        components.retriever = ReplayRetriever(tape)
+        components.reranker = ReplayReranker(tape)
+        return components
+
+    def build_retriever(self, query_filter: Any = None, top_k: Optional[int] = None) -> ReplayRetriever:
+        """Return the retriever of the bound query (the recorded results already reflect the filter)."""
+        return ReplayRetriever(self.tape, top_k=top_k)
+
+
+class ReplayEngine(RAGEngine):
+    """RAGEngine whose direct Qdrant search is answered from the tape."""
+
+    def _direct_search(self, query: str, query_embedding: Optional[List[float]] = None,
+                       **search_overrides: Any) -> List[Any]:
+        """Return the recorded direct search results of the query."""
+        if query_embedding is None:
+            query_embedding = self.embed_model.get_query_embedding(query)
+        return ReplayRetriever(self.components.tape, call="direct_search",
+                               top_k=search_overrides.get("limit")).retrieve(query)
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    """Return a percentile of some values (nearest rank), or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))], 4)
+
+
+def _memory_for(record: Dict[str, Any]) -> ConversationMemory:
+    """Return a memory holding the conversation history the query was answered with."""
+    memory = ConversationMemory()
+    items = []
+    for question, answer in record["request"].get("history") or []:
+        items += [{"type": "user", "content": question}, {"type": "assistant", "content": answer}]
+    if items:
+        memory.load_history(items)
+    return memory
+
+
+def replay(records: List[Dict[str, Any]], chunks: Dict[str, Dict[str, Any]], mode: str = RECORDED,
+           speed: float = 1.0, rate: Optional[float] = None, concurrency: int = 16,
+           latency_scale: float = 1.0) -> Dict[str, Any]:
+    """Replay captured queries through the engine and return the run summary.
+
+    Args:
+        records: Query records, sorted by time
+        chunks: Captured chunk texts, by ID
+        mode: ``recorded`` (recorded upstream responses) or ``fake`` (local fakes)
+        speed: Factor dividing the original inter-arrival times
+        rate: Fixed arrival rate in queries per second, overriding speed
+        concurrency: Queries processed at once
+        latency_scale: Factor applied to the recorded or fake upstream latencies
+
+    Latencies are measured from the scheduled send time, so queueing behind a
+    saturated engine counts as it would for a real client.
+    """
+    collection = next((record["collection"] for record in records if record.get("collection")), "replay")
+    components = ReplayComponents(collection)
+    first_ts = records[0]["ts"] if records else 0.0
+    latencies: List[float] = []
+    outcome = {"errors": 0, "diverged": 0, "fallbacks": 0}
+    lock = threading.Lock()
+
+    def _run(record: Dict[str, Any], scheduled_at: float) -> None:
+        tape = RecordTape(record, chunks, mode, latency_scale)
+        engine = ReplayEngine(memory=_memory_for(record), components=components.for_record(tape))
+        request = record["request"]
+        error = False
+        try:
+            result = engine.query(request["query"], include_prompt=bool(request.get("include_prompt")),
+                                  scope=request.get("scope"), deadline=Deadline())
+            error = bool(result.get("error"))
+        except Exception as e:
+            logger.warning(f"Replayed query failed: {str(e)}", query=request["query"])
+            result, error = {}, True
+        elapsed = time.monotonic() - scheduled_at
+        # In modalità recorded una risposta diversa da quella registrata segnala un cambiamento della pipeline
+        recorded = record.get("response") or {}
+        diverged = mode == RECORDED and bool(recorded) and not error and (
+            [doc.get("id") for doc in result.get("source_documents") or []] != recorded.get("source_ids")
+            or (result.get("metadata") or {}).get("model") != (recorded.get("metadata") or {}).get("model")
+        )
+        with lock:
+            latencies.append(elapsed)
+            outcome["errors"] += error
+            outcome["diverged"] += diverged
+            outcome["fallbacks"] += tape.fallbacks
+
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as executor:
+        for i, record in enumerate(records):
+            offset = i / rate if rate else (record["ts"] - first_ts) / speed
+            scheduled_at = started_at + offset
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(_run, record, scheduled_at)
+    duration = time.monotonic() - started_at
+
+    return {
+        "mode": mode,
+        "queries": len(records),
+        "duration": round(duration, 3),
+        "achieved_rate": round(len(records) / duration, 3) if duration > 0 else None,
+        **outcome,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+        "cache_hits": {
+            name: metrics.get_counter("cri_cache_requests_total", cache=name, result="hit")
+            for name in ("embedding", "retrieval")
+        },
+        "precomputed_hits": sum(metrics.get_counter("cri_precomputed_requests_total", result=result)
+                                for result in ("text", "vector")),
+    }
+
+
+def main() -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Replay del traffico catturato attraverso il motore RAG")
+    parser.add_argument("captures", nargs="+", help="File di cattura .ndjson.gz (anche pattern glob)")
+    parser.add_argument("--mode", choices=[RECORDED, FAKE], default=RECORDED,
+                        help="Risposte registrate degli upstream o fake locali")
+    parser.add_argument("--speed", type=float, default=1.0, help="Fattore di accelerazione dei tempi originali")
+    parser.add_argument("--rate", type=float, default=None, help="Ritmo fisso in richieste al secondo (ignora --speed)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Richieste elaborate in parallelo")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Fattore applicato alle latenze degli upstream")
+    parser.add_argument("--limit", type=int, default=None, help="Numero massimo di richieste da riprodurre")
+    args = parser.parse_args()
+
+    configure_logging()
+    paths = sorted({path for pattern in args.captures for path in glob.glob(pattern)})
+    records, chunks = read_capture(paths)
+    if args.limit:
+        records = records[:args.limit]
+    logger.info(f"Replaying {len(records)} captured queries from {len(paths)} files", mode=args.mode)
+    summary = replay(records, chunks, mode=args.mode, speed=args.speed, rate=args.rate,
+                     concurrency=args.concurrency, latency_scale=args.latency_scale)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
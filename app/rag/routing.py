@@ -0,0 +1,118 @@
+"""Query-complexity model routing for the CroceRossa Qdrant Cloud application.
+
+Most questions are simple lookups answered by one or two chunks of the same
+document, and do not need the large model. The router scores each query
+locally, after retrieval and reranking, on cues of complexity:
+
+- long questions (several requests or conditions in the same question);
+- low retrieval confidence: the best reranked chunk is a weak match, so the
+  answer must be assembled or reasoned about;
+- multi-document questions: the relevant chunks come from several sources;
+- deep follow-ups: a condensed question late in a long conversation.
+
+Queries whose score reaches ROUTING_COMPLEX_THRESHOLD are answered by
+LLM_MODEL, the others by LLM_SMALL_MODEL. Question condensation and the
+no-context fallback always use the small model.
+"""
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Sequence
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_model_routing_decisions_total", "counter", "Answers routed to each model, by tier (small, large)")
+metrics.describe("cri_model_routing_cues_total", "counter", "Complexity cues found by the model router, by cue")
+metrics.describe("cri_llm_latency_seconds", "histogram", "LLM call latency, by model and call",
+                 buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0, 30.0, 60.0))
+
+SMALL = "small"
+LARGE = "large"
+
+CUE_WEIGHTS: Dict[str, float] = {
+    "low_confidence": 2.0,
+    "multi_document": 2.0,
+    "long_question": 1.0,
+    "deep_follow_up": 1.0,
+}
+
+
+@dataclass
+class RoutingDecision:
+    """Model chosen for an answer and the cues behind the choice."""
+
+    tier: str
+    model: str
+    score: float = 0.0
+    cues: List[str] = field(default_factory=list)
+
+
+def _decision(tier: str, score: float = 0.0, cues: Sequence[str] = ()) -> RoutingDecision:
+    """Build a decision for a tier (everything goes to the large model when routing is off)."""
+    if not settings.MODEL_ROUTING_ENABLED:
+        tier = LARGE
+    model = settings.LLM_MODEL if tier == LARGE else settings.LLM_SMALL_MODEL
+    return RoutingDecision(tier, model, score, list(cues))
+
+
+def route_query(question: str, nodes: Sequence[Any], history_depth: int = 0,
+                condensed: bool = False, reranked: bool = True) -> RoutingDecision:
+    """Choose the model answering a question from the question and its retrieved chunks.
+
+    Args:
+        question: The question used for retrieval (condensed if it was a follow-up)
+        nodes: Chunks that will go in the prompt, best first, with their scores
+        history_depth: Exchanges already in the conversation
+        condensed: Whether the question was rewritten from the conversation
+        reranked: Whether node scores are reranker relevance scores (confidence is
+                  only judged on those, vector similarities use another scale)
+    """
+    cues: List[str] = []
+    if len(question.split()) >= settings.ROUTING_LONG_QUESTION_WORDS:
+        cues.append("long_question")
+
+    scores = [node.score for node in nodes if getattr(node, "score", None) is not None]
+    if reranked and scores and max(scores) < settings.ROUTING_MIN_CONFIDENCE:
+        cues.append("low_confidence")
+
+    # Fonti distinte tra i chunk pertinenti: la risposta va composta da più documenti
+    sources = {
+        (getattr(node, "metadata", {}) or {}).get("source")
+        for node in nodes
+        if not reranked or (getattr(node, "score", None) or 0.0) >= settings.ROUTING_RELEVANT_SCORE
+    }
+    sources.discard(None)
+    if len(sources) >= settings.ROUTING_MULTI_DOCUMENT_SOURCES:
+        cues.append("multi_document")
+
+    if condensed and history_depth >= settings.ROUTING_DEEP_FOLLOW_UP:
+        cues.append("deep_follow_up")
+
+    score = sum(CUE_WEIGHTS[cue] for cue in cues)
+    return _decision(LARGE if score >= settings.ROUTING_COMPLEX_THRESHOLD else SMALL, score, cues)
+
+
+def simple_decision() -> RoutingDecision:
+    """Return the decision for calls that never need the large model (condensation, no-context answers)."""
+    return _decision(SMALL)
+
+
+def record_decision(decision: RoutingDecision) -> None:
+    """Count a routing decision and its cues in the metrics."""
+    metrics.inc("cri_model_routing_decisions_total", model=decision.model, tier=decision.tier)
+    for cue in decision.cues:
+        metrics.inc("cri_model_routing_cues_total", cue=cue)
+    logger.info(f"Routing answer to {decision.model}", tier=decision.tier, score=decision.score, cues=decision.cues)
+
+
+@contextmanager
+def llm_timer(model: str, call: str) -> Iterator[None]:
+    """Observe the latency of a successful LLM call in cri_llm_latency_seconds."""
+    started_at = time.monotonic()
+    yield
+    metrics.observe("cri_llm_latency_seconds", time.monotonic() - started_at, model=model, call=call)
@@ -0,0 +1,283 @@
+"""Corpus-derived spelling index for the CroceRossa Qdrant Cloud application.
+
+The vocabulary (word -> frequency) is built from the ``page_content`` of the
+collection and indexed with symmetric deletes (SymSpell): every word is stored
+under the strings obtained by deleting up to ``max_edit_distance`` characters,
+so the candidates of a misspelled word are found with a few dictionary lookups
+instead of comparing it with the whole vocabulary.
+
+The index normalizes user questions before embedding (better retrieval and more
+cache hits). It only rewrites words with no plausible reading of their own:
+words missing from the corpus because they are another inflection of a corpus
+word (``iscrivermi`` / ``iscriversi``), short words and names are kept.
+"""
+
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_spelling_corrections_total", "counter", "Words corrected in user questions before retrieval")
+
+# Parole italiane: lettere, anche accentate; apostrofi e cifre separano i token
+WORD_PATTERN = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Return the lowercase words of a text."""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Return the optimal string alignment distance of two words, or max_distance + 1 if larger.
+
+    Common prefix and suffix are stripped first and only the diagonal band of
+    width max_distance is computed, so the cost is linear in the word length.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if not a or not b:
+        return min(max(len(a), len(b)), max_distance + 1)
+
+    too_far = max_distance + 1
+    previous2: List[int] = []
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= max_distance else too_far
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            # Trasposizione di due caratteri adiacenti
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = min(value, too_far)
+        if min(current) > max_distance:
+            return too_far
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """Symmetric-delete spelling index over a word frequency vocabulary."""
+
+    # Esiti delle ricerche di parole sconosciute: le domande degli utenti si ripetono
+    LOOKUP_CACHE_SIZE = 10000
+
+    def __init__(self, words: Dict[str, int], max_edit_distance: int = 2, prefix_length: int = 7,
+                 collection_name: Optional[str] = None):
+        """Index a vocabulary.
+
+        Args:
+            words: Word frequencies
+            max_edit_distance: Maximum edit distance of a correction
+            prefix_length: Only the first characters of a word are indexed (bounds the deletes per word)
+            collection_name: Physical collection the vocabulary was built from
+        """
+        self.words = words
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.collection_name = collection_name
+        self._deletes: Dict[str, List[str]] = {}
+        self._lookups: Dict[str, Optional[Tuple[str, int]]] = {}
+        for word in words:
+            for variant in self._variants(word[:prefix_length]):
+                self._deletes.setdefault(variant, []).append(word)
+
+    def _variant_levels(self, word: str) -> List[Set[str]]:
+        """Return the strings obtained deleting 0, 1, ... max_edit_distance characters from the word."""
+        levels = [{word}]
+        for _ in range(self.max_edit_distance):
+            levels.append({w[:i] + w[i + 1:] for w in levels[-1] if len(w) > 1 for i in range(len(w))})
+        return levels
+
+    def _variants(self, word: str) -> Set[str]:
+        """Return the word and every string obtained deleting up to max_edit_distance characters."""
+        return set().union(*self._variant_levels(word))
+
+    def __contains__(self, word: str) -> bool:
+        """Return whether the word is in the vocabulary."""
+        return word in self.words
+
+    def __len__(self) -> int:
+        """Return the vocabulary size."""
+        return len(self.words)
+
+    def lookup(self, word: str) -> Optional[Tuple[str, int]]:
+        """Return the best correction of an unknown word and its distance, or None.
+
+        Known words are returned unchanged with distance 0. Among the candidates
+        the closest wins, then the most frequent in the corpus.
+        """
+        if word in self.words:
+            return word, 0
+        if word in self._lookups:
+            return self._lookups[word]
+
+        best: Optional[Tuple[str, int]] = None
+        best_count = 0
+        checked: Set[str] = set()
+        for level, variants in enumerate(self._variant_levels(word[:self.prefix_length])):
+            # Una parola a distanza d condivide una cancellazione di al massimo d caratteri:
+            # trovata una correzione a distanza d, i livelli successivi non possono migliorarla
+            if best is not None and level > best[1]:
+                break
+            candidates = [c for variant in variants for c in self._deletes.get(variant, ()) if c not in checked]
+            for candidate in candidates:
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                # Un candidato non può battere il migliore con una distanza maggiore
+                limit = best[1] if best is not None else self.max_edit_distance
+                if abs(len(candidate) - len(word)) > limit:
+                    continue
+                distance = edit_distance(word, candidate, limit)
+                if distance > limit:
+                    continue
+                count = self.words[candidate]
+                if best is None or distance < best[1] or count > best_count:
+                    best, best_count = (candidate, distance), count
+
+        if len(self._lookups) >= self.LOOKUP_CACHE_SIZE:
+            self._lookups.clear()
+        self._lookups[word] = best
+        return best
+
+    # Lettere finali in cui due parole possono differire restando forme della stessa parola
+    INFLECTION_SUFFIX_LENGTH = 2
+
+    def suggest(self, word: str, min_length: int = 6) -> Optional[str]:
+        """Return the correction of a probably misspelled word, or None if it looks fine.
+
+        Short words (often names: "marco" is one edit from "marzo"), words without
+        a close vocabulary entry (names, acronyms, terms missing from the corpus)
+        and words differing from the correction only in their ending (another
+        inflection of a corpus word) are left alone.
+        """
+        word = word.lower()
+        if len(word) < min_length or word in self.words:
+            return None
+        match = self.lookup(word)
+        # Su parole brevi due modifiche sono spesso un'altra forma della stessa parola: al massimo una
+        if match is None or match[1] > (1 if len(word) < 9 else self.max_edit_distance):
+            return None
+        if self._same_stem(word, match[0]):
+            return None
+        return match[0]
+
+    def _same_stem(self, word: str, candidate: str) -> bool:
+        """Return whether two words differ only in their last letters (desinenza, pronome enclitico)."""
+        prefix = 0
+        for a, b in zip(word, candidate):
+            if a != b:
+                break
+            prefix += 1
+        return prefix >= max(len(word), len(candidate)) - self.INFLECTION_SUFFIX_LENGTH
+
+    def correct(self, text: str) -> str:
+        """Return the text with the misspelled words replaced, keeping spacing and punctuation.
+
+        Capitalized words are only corrected at the start of the text, since
+        elsewhere they are usually proper names.
+        """
+        corrections = 0
+
+        def _replace(match: "re.Match[str]") -> str:
+            nonlocal corrections
+            token = match.group(0)
+            if token.isupper() or (token[0].isupper() and match.start() > 0):
+                return token
+            suggestion = self.suggest(token)
+            if suggestion is None:
+                return token
+            corrections += 1
+            return suggestion.capitalize() if token[0].isupper() else suggestion
+
+        corrected = WORD_PATTERN.sub(_replace, " ".join(text.split()))
+        if corrections:
+            metrics.inc("cri_spelling_corrections_total", corrections)
+            logger.info(f"Corrected question spelling: '{text}' → '{corrected}'")
+        return corrected
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], min_count: Optional[int] = None, **kwargs: Any) -> "SpellingIndex":
+        """Build the index from the word frequencies of some texts (words seen fewer than min_count times are dropped)."""
+        min_count = settings.SPELLING_MIN_FREQUENCY if min_count is None else min_count
+        counts: Counter = Counter()
+        for text in texts:
+            counts.update(word for word in tokenize(text) if len(word) > 1)
+        return cls({word: count for word, count in counts.items() if count >= min_count}, **kwargs)
+
+    def save(self, path: str) -> None:
+        """Write the vocabulary atomically to a JSON file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as f:
+            json.dump({"collection": self.collection_name, "words": self.words}, f, ensure_ascii=False)
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "SpellingIndex":
+        """Read a vocabulary written by save()."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["words"], collection_name=data.get("collection"), **kwargs)
+
+
+def build_spelling_index(client: Any, collection_name: str, batch_size: int = 256) -> SpellingIndex:
+    """Build the spelling index from the ``page_content`` of every point of a collection."""
+
+    def _texts() -> Iterable[str]:
+        offset = None
+        while True:
+            points, offset = client.scroll(collection_name=collection_name, limit=batch_size, offset=offset,
+                                           with_payload=["page_content"], with_vectors=False)
+            for point in points:
+                text = (point.payload or {}).get("page_content")
+                if text:
+                    yield text
+            if offset is None:
+                break
+
+    index = SpellingIndex.from_texts(_texts(), max_edit_distance=settings.SPELLING_MAX_EDIT_DISTANCE,
+                                     collection_name=collection_name)
+    logger.info(f"Built spelling index of {len(index)} words from '{collection_name}'")
+    return index
+
+
+def load_spelling_index(client: Any, collection_name: str, path: Optional[str] = None) -> Optional[SpellingIndex]:
+    """Return the spelling index of a collection version, rebuilding the vocabulary file if stale.
+
+    Returns None (no spelling correction) when the index is disabled or cannot be built.
+    """
+    if not settings.SPELLING_ENABLED:
+        return None
+    path = path or settings.SPELLING_VOCABULARY_PATH
+    try:
+        if os.path.exists(path):
+            index = SpellingIndex.load(path, max_edit_distance=settings.SPELLING_MAX_EDIT_DISTANCE)
+            if index.collection_name == collection_name:
+                logger.info(f"Loaded spelling index of {len(index)} words", path=path)
+                return index
+        index = build_spelling_index(client, collection_name)
+        index.save(path)
+        return index
+    except Exception as e:
+        logger.error(f"Could not load the spelling index: {str(e)}", exc_info=True)
+        return None
@@ -0,0 +1,56 @@
+"""Token usage accounting for the LLM calls of the CroceRossa Qdrant Cloud application.
+
+OpenAI reports, for every call, the prompt tokens, the completion tokens and how
+many prompt tokens were served from its prompt cache (an identical prompt
+prefix of at least 1024 tokens seen recently). The counters make the cache hit
+rate of each call visible: cached / prompt tokens.
+"""
+
+from typing import Any, Dict
+
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_llm_prompt_tokens_total", "counter", "Prompt tokens sent to the LLM, by call")
+metrics.describe("cri_llm_cached_prompt_tokens_total", "counter", "Prompt tokens served from the provider prompt cache, by call")
+metrics.describe("cri_llm_completion_tokens_total", "counter", "Completion tokens generated by the LLM, by call")
+
+
+def _field(obj: Any, name: str) -> Any:
+    """Read a field from an SDK object or from its dict form."""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def token_usage(response: Any) -> Dict[str, int]:
+    """Return the token counts of a LlamaIndex chat or completion response (empty if not reported)."""
+    usage = _field(getattr(response, "raw", None), "usage")
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": _field(usage, "prompt_tokens") or 0,
+        "cached_tokens": _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+    }
+
+
+def record_token_usage(response: Any, call: str) -> Dict[str, int]:
+    """Count the tokens of an LLM response in the metrics and return them.
+
+    Args:
+        response: LlamaIndex ChatResponse or CompletionResponse
+        call: Pipeline call the response belongs to (condensation, answer, ...)
+    """
+    usage = token_usage(response)
+    if not usage:
+        return usage
+    metrics.inc("cri_llm_prompt_tokens_total", usage["prompt_tokens"], call=call)
+    metrics.inc("cri_llm_cached_prompt_tokens_total", usage["cached_tokens"], call=call)
+    metrics.inc("cri_llm_completion_tokens_total", usage["completion_tokens"], call=call)
+    logger.debug(f"LLM usage for {call}", **usage)
+    return usage
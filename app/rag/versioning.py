@@ -0,0 +1,148 @@
+"""Versioned collections behind a Qdrant alias for the CroceRossa Qdrant Cloud application.
+
+``QDRANT_COLLECTION`` can be an alias pointing to a versioned physical collection
+(``<alias>_v<timestamp>``). A re-index builds a new version and then repoints the
+alias atomically, so queries never see a half-built collection. Running engines
+poll the alias and, when it moves, flush the caches stamped with the old version.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(__name__)
+
+metrics.describe("cri_collection_version_changes_total", "counter", "Collection alias swaps detected by this process")
+
+VERSION_SEPARATOR = "_v"
+
+
+def versioned_name(alias: str) -> str:
+    """Return the name of a new physical collection version for an alias."""
+    return f"{alias}{VERSION_SEPARATOR}{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+
+
+def resolve_alias(client: Any, alias: str) -> Optional[str]:
+    """Return the collection an alias points to, or None if the alias does not exist."""
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def list_versions(client: Any, alias: str) -> List[str]:
+    """Return the physical versions of an alias, oldest first."""
+    prefix = alias + VERSION_SEPARATOR
+    return sorted(c.name for c in client.get_collections().collections if c.name.startswith(prefix))
+
+
+def swap_alias(client: Any, alias: str, collection_name: str) -> Optional[str]:
+    """Atomically point an alias to a collection.
+
+    Returns:
+        The collection the alias pointed to before the swap, if any
+    """
+    from qdrant_client.http import models as rest
+
+    if alias in {c.name for c in client.get_collections().collections}:
+        raise ValueError(f"'{alias}' is a collection, not an alias: set QDRANT_COLLECTION to a new alias name")
+
+    previous = resolve_alias(client, alias)
+    operations: List[Any] = []
+    if previous is not None:
+        operations.append(rest.DeleteAliasOperation(delete_alias=rest.DeleteAlias(alias_name=alias)))
+    operations.append(rest.CreateAliasOperation(
+        create_alias=rest.CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+    # Le operazioni di una stessa richiesta sono applicate in modo atomico
+    client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info(f"Alias '{alias}' now points to '{collection_name}'", previous=previous)
+    return previous
+
+
+def prune_versions(client: Any, alias: str, keep: int = 2, keep_unfinished: bool = False) -> List[str]:
+    """Delete old and unfinished versions, keeping the newest ``keep`` and the one the alias points to.
+
+    A version newer than the alias target was never swapped in: a build that was
+    interrupted (or run with ``--no-swap``). Do not prune while a build is running
+    unless ``keep_unfinished`` is set.
+
+    Returns:
+        The deleted collections
+    """
+    current = resolve_alias(client, alias)
+    versions = list_versions(client, alias)
+    unfinished = [name for name in versions if current is not None and name > current]
+    finished = [name for name in versions if name not in unfinished]
+    retained = set(finished[-keep:]) if keep > 0 else set()
+    if keep_unfinished:
+        retained.update(unfinished)
+    deleted = [name for name in versions if name not in retained and name != current]
+    for name in deleted:
+        client.delete_collection(name)
+        logger.info(f"Deleted old collection version '{name}'")
+    return deleted
+
+
+class CollectionVersionTracker:
+    """Tracks the collection behind the configured alias and reports changes.
+
+    The alias is resolved at most every ``check_interval`` seconds, on the
+    caller's thread; listeners run when the resolved collection changes.
+    """
+
+    def __init__(self, client: Any, alias: Optional[str] = None, check_interval: Optional[float] = None):
+        """Initialize the tracker; the first call to current() resolves the alias."""
+        self.client = client
+        self.alias = alias or settings.QDRANT_COLLECTION
+        self.check_interval = check_interval if check_interval is not None else settings.COLLECTION_VERSION_CHECK_INTERVAL
+        self.version: Optional[str] = None
+        self.checked_at = 0.0
+        self._listeners: List[Callable[[Optional[str], str], None]] = []
+        self._lock = threading.Lock()
+
+    def on_change(self, listener: Callable[[Optional[str], str], None]) -> None:
+        """Register a callback invoked with (old_version, new_version)."""
+        self._listeners.append(listener)
+
+    def _resolve(self) -> str:
+        """Return the physical collection name, or the configured name if it is not an alias."""
+        try:
+            return resolve_alias(self.client, self.alias) or self.alias
+        except Exception as e:
+            logger.warning(f"Could not resolve collection alias '{self.alias}': {str(e)}")
+            return self.version or self.alias
+
+    def current(self) -> str:
+        """Return the current collection version, refreshing it when the check interval elapsed."""
+        if self.version is not None and time.monotonic() - self.checked_at < self.check_interval:
+            return self.version
+
+        # Un solo thread interroga Qdrant; gli altri usano la versione nota
+        if not self._lock.acquire(blocking=self.version is None):
+            return self.version
+        try:
+            new_version = self._resolve()
+            self.checked_at = time.monotonic()
+            old_version, self.version = self.version, new_version
+        finally:
+            self._lock.release()
+
+        if old_version is not None and old_version != new_version:
+            logger.info(f"Collection version changed: {old_version} -> {new_version}", alias=self.alias)
+            metrics.inc("cri_collection_version_changes_total")
+            for listener in self._listeners:
+                try:
+                    listener(old_version, new_version)
+                except Exception as e:
+                    logger.error(f"Collection version listener failed: {str(e)}", exc_info=True)
+        return new_version
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the alias and the last resolved version."""
+        return {"alias": self.alias, "version": self.version}
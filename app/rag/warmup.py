@@ -0,0 +1,224 @@
+"""Startup warm-up and readiness state for the CroceRossa Qdrant Cloud application.
+
+A warm-up whose critical checks fail is retried in the background with
+exponential backoff (WARMUP_RETRY_BACKOFF, up to WARMUP_RETRY_MAX_BACKOFF), so
+the worker becomes ready as soon as the upstreams recover instead of staying
+"failed" until it is restarted.
+"""
+
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class WarmupState:
+    """Tracks the progress of the startup warm-up and per-dependency latency.
+
+    Status values: "pending", "running", "ready", "failed", "skipped".
+    """
+
+    # Dipendenze senza le quali il worker non può servire query
+    CRITICAL_DEPENDENCIES = ("components", "openai_embeddings", "qdrant")
+
+    def __init__(self):
+        """Initialize an empty warm-up state."""
+        self._lock = threading.Lock()
+        self.status = "pending"
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.dependencies: Dict[str, Dict[str, Any]] = {}
+        self.attempts = 0
+        self.next_retry_at: Optional[str] = None
+
+    def start(self) -> None:
+        """Mark a warm-up pass as running."""
+        with self._lock:
+            self.status = "running"
+            self.started_at = datetime.now(timezone.utc).isoformat()
+            self.dependencies = {}
+            self.attempts += 1
+            self.next_retry_at = None
+
+    def schedule_retry(self, delay: float) -> None:
+        """Record when the failed warm-up will be retried."""
+        with self._lock:
+            self.next_retry_at = datetime.fromtimestamp(time.time() + delay, timezone.utc).isoformat()
+
+    def failed_dependencies(self) -> List[str]:
+        """Return the critical dependencies whose last check failed."""
+        with self._lock:
+            return [name for name in self.CRITICAL_DEPENDENCIES
+                    if not self.dependencies.get(name, {}).get("ok", False)]
+
+    def record(self, name: str, latency_ms: float, error: Optional[str] = None) -> None:
+        """Record the outcome of a single dependency check."""
+        with self._lock:
+            self.dependencies[name] = {
+                "ok": error is None,
+                "latency_ms": round(latency_ms, 1),
+                "error": error,
+            }
+
+    def finish(self, status: Optional[str] = None) -> None:
+        """Mark the warm-up as completed, deriving the status from critical dependencies."""
+        with self._lock:
+            if status is None:
+                critical_ok = all(
+                    self.dependencies.get(name, {}).get("ok", False)
+                    for name in self.CRITICAL_DEPENDENCIES
+                )
+                status = "ready" if critical_ok else "failed"
+            self.status = status
+            self.finished_at = datetime.now(timezone.utc).isoformat()
+
+    @property
+    def is_ready(self) -> bool:
+        """Return True if the worker can receive live traffic."""
+        return self.status in ("ready", "skipped")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-serializable view of the warm-up state."""
+        with self._lock:
+            return {
+                "ready": self.is_ready,
+                "status": self.status,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "attempts": self.attempts,
+                "next_retry_at": self.next_retry_at,
+                "dependencies": {name: dict(info) for name, info in self.dependencies.items()},
+            }
+
+
+# Global warm-up state shared by the whole process
+warmup_state = WarmupState()
+# Interrompe i retry del warm-up allo shutdown
+_stop_event = threading.Event()
+
+
+def _timed_check(name: str, check: Callable[[], Any]) -> Any:
+    """Run a dependency check, recording its latency and any error."""
+    start = time.perf_counter()
+    try:
+        result = check()
+        warmup_state.record(name, (time.perf_counter() - start) * 1000)
+        return result
+    except Exception as e:
+        warmup_state.record(name, (time.perf_counter() - start) * 1000, error=str(e))
+        logger.error(f"Warm-up check '{name}' failed: {str(e)}")
+        return None
+
+
+def stop_warmup() -> None:
+    """Stop retrying a failed warm-up (application shutdown)."""
+    _stop_event.set()
+
+
+def run_warmup() -> None:
+    """Build the shared components and open connections to every upstream, retrying until they answer.
+
+    Meant to run in a background thread while the server already answers /health;
+    returns once the worker is ready or stop_warmup() is called.
+    """
+    if not settings.WARMUP_ENABLED:
+        logger.info("Warm-up disabled, components will be built on first request")
+        warmup_state.finish("skipped")
+        return
+
+    delay = settings.WARMUP_RETRY_BACKOFF
+    while True:
+        _warmup_pass()
+        if warmup_state.is_ready or _stop_event.is_set():
+            return
+        logger.warning(f"Warm-up failed, retrying in {delay:.0f}s",
+                       failed=warmup_state.failed_dependencies(), attempts=warmup_state.attempts)
+        warmup_state.schedule_retry(delay)
+        if _stop_event.wait(delay):
+            return
+        delay = min(delay * 2, settings.WARMUP_RETRY_MAX_BACKOFF)
+
+
+def _warm_retrieval(engine: Any, components: Any, question: str, version: str, embedding: List[float]) -> List[Any]:
+    """Retrieve the warm-up query as a live query would and cache the results.
+
+    Retrieval answers an empty list when Qdrant fails: without results a direct
+    one-result search tells an empty answer from an unreachable Qdrant.
+    """
+    from app.rag.collection_router import CollectionRegistry
+    from app.rag.qdrant_search import search_points
+
+    registry = components.collections
+    collections = registry.route(question, None) if registry is not None else None
+    top_k = settings.RETRIEVAL_TOP_K
+    nodes = engine._retrieve(question, None, version, top_k=top_k, collections=collections)
+    if not nodes:
+        search_points(components.qdrant_client, embedding, limit=1, payload_fields=[])
+        return nodes
+
+    collection_names = tuple(handle.name for handle in collections) if collections else ()
+    retrieval_version = CollectionRegistry.version(collections) if collections else version
+    components.retrieval_cache.set(engine.retrieval_key(question, "", top_k, collection_names),
+                                   list(nodes), retrieval_version)
+    return nodes
+
+
+def _warmup_pass() -> None:
+    """Run one warm-up pass and derive the readiness from its critical checks.
+
+    Sends WARMUP_QUERY through the engine's embedding and retrieval (filling their
+    caches and connection pools, behind the same limits and breakers as live
+    queries), opens the OpenAI chat connection and (optionally) runs a one-document
+    Cohere rerank, then primes the tokenizer.
+    """
+    from app.rag.components import get_components
+    from app.rag.engine import RAGEngine
+    from app.rag.memory import ConversationMemory
+
+    logger.info("Starting warm-up", attempt=warmup_state.attempts + 1)
+    warmup_state.start()
+
+    components = _timed_check("components", get_components)
+    if components is None:
+        warmup_state.finish()
+        return
+
+    engine = RAGEngine(memory=ConversationMemory(), components=components)
+    version = components.collection_version.current()
+    question = engine.search_question(settings.WARMUP_QUERY)
+    embedding = _timed_check("openai_embeddings", lambda: engine._embed_query(question, version))
+
+    if embedding is not None:
+        _timed_check("qdrant", lambda: _warm_retrieval(engine, components, question, version, embedding))
+    else:
+        warmup_state.record("qdrant", 0.0, error="Skipped: no warm-up embedding available")
+
+    # Apre la connessione al client chat senza generare token
+    _timed_check(
+        "openai_chat",
+        lambda: components.llm._get_client().models.retrieve(settings.LLM_MODEL),
+    )
+
+    if settings.WARMUP_INCLUDE_RERANK and components.use_reranker:
+        def _rerank_check() -> Any:
+            from llama_index.core.schema import NodeWithScore, TextNode
+
+            nodes = [NodeWithScore(node=TextNode(text=settings.WARMUP_QUERY))]
+            return components.reranker.postprocess_nodes(nodes, query_str=settings.WARMUP_QUERY)
+
+        _timed_check("cohere", _rerank_check)
+
+    def _prime_tokenizer() -> Any:
+        from llama_index.core.utils import get_tokenizer
+
+        return get_tokenizer()(settings.WARMUP_QUERY)
+
+    _timed_check("tokenizer", _prime_tokenizer)
+
+    warmup_state.finish()
+    logger.info("Warm-up completed", status=warmup_state.status)
@@ -1,26 +1,48 @@
 """Main entry point for the CroceRossa Qdrant Cloud FastAPI application."""
 
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 import time
 import os
 
+from app.api.admin import router as admin_router
+from app.api.assets import asset_store
 from app.api.router import router
 from app.core.config import settings
+from app.core.connections import connection_manager
+from app.core.metrics import metrics
 from app.core.logging import configure_logging, get_logger
+from app.rag.capture import capture_writer
+from app.rag.warmup import run_warmup, stop_warmup, warmup_state
 
 # Configure logging
 configure_logging()
 logger = get_logger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the warm-up in background so /health answers while upstreams are being opened."""
+    warmup_task = asyncio.create_task(asyncio.to_thread(run_warmup))
+    yield
+    stop_warmup()
+    if not warmup_task.done():
+        warmup_task.cancel()
+    connection_manager.close()
+    capture_writer.close()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="CroceRossa Qdrant Cloud",
     description="Assistente virtuale conversazionale per la Croce Rossa Italiana",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -32,13 +54,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-try:
-    app.mount("/static", StaticFiles(directory="static"), name="static")
-except:
-    # Directory potrebbe non esistere ancora
-    os.makedirs("static", exist_ok=True)
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+# Compressione delle risposte (JSON delle query, frontend)
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=settings.GZIP_MINIMUM_SIZE,
+    compresslevel=settings.GZIP_COMPRESS_LEVEL,
+)
+
+# Frontend e file statici letti e compressi una sola volta all'avvio
+os.makedirs(settings.FRONTEND_STATIC_DIR, exist_ok=True)
+asset_store.load_file("/", settings.FRONTEND_INDEX_PATH, settings.FRONTEND_CACHE_CONTROL)
+asset_store.load_directory(settings.FRONTEND_STATIC_DIR, "/static", settings.STATIC_CACHE_CONTROL)
 
 # Add request ID middleware
 @app.middleware("http")
@@ -69,14 +95,25 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 # Include API router
 app.include_router(router, prefix="/api")
+app.include_router(admin_router, prefix="/api/admin")
 
 # Root endpoint che serve il file HTML
-@app.get("/")
-async def serve_html():
-    """Serve the HTML frontend."""
-    with open("index.html", "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content, media_type="text/html")
+@app.api_route("/", methods=["GET", "HEAD"])
+async def serve_html(request: Request):
+    """Serve the HTML frontend from memory."""
+    asset = asset_store.get("/")
+    if asset is None:
+        return PlainTextResponse("Frontend non disponibile", status_code=404)
+    return asset_store.respond(request, asset)
+
+# File statici
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def serve_static(request: Request, path: str):
+    """Serve a static file from memory."""
+    asset = asset_store.get(f"/static/{path}")
+    if asset is None:
+        return PlainTextResponse("Not Found", status_code=404)
+    return asset_store.respond(request, asset)
 
 # Health check endpoint
 @app.get("/health")
@@ -84,6 +121,19 @@ async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 503 until the warm-up has opened all critical upstreams."""
+    state = warmup_state.snapshot()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+# Metrics endpoint
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose application metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 if __name__ == "__main__":
     logger.info(
@@ -0,0 +1,13 @@
+"""Test configuration: the settings required by app.core.config, without real credentials."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for _name in ("OPENAI_API_KEY", "QDRANT_API_KEY", "COHERE_API_KEY"):
+    os.environ.setdefault(_name, "test")
+os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+os.environ.setdefault("QDRANT_COLLECTION", "test")
+os.environ.setdefault("WARMUP_ENABLED", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,225 @@
+"""Tests of the client rate limiter, the admission queue and the upstream concurrency limits."""
+
+import asyncio
+import threading
+import types
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import app.api.router as router_module
+import app.core.admission as admission
+from app.core.admission import (
+    AdmissionController,
+    ClientRateLimiter,
+    OverloadedError,
+    UpstreamBusyError,
+    UpstreamLimiter,
+    client_key,
+)
+from app.core.config import settings
+
+
+class FakeClock:
+    """Monotonic clock moved by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+def test_bucket_allows_the_burst_then_rejects(clock):
+    limiter = ClientRateLimiter(requests_per_minute=60, burst=3)
+    for _ in range(3):
+        limiter.check("session:a")
+    with pytest.raises(OverloadedError) as excinfo:
+        limiter.check("session:a")
+    assert excinfo.value.reason == "rate_limited"
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+    assert excinfo.value.retry_after_header == "1"
+
+
+def test_bucket_refills_over_time(clock):
+    limiter = ClientRateLimiter(requests_per_minute=30, burst=2)
+    limiter.check("session:a")
+    limiter.check("session:a")
+
+    clock.now += 1.0
+    with pytest.raises(OverloadedError) as excinfo:
+        limiter.check("session:a")
+    # Mezzo token accumulato: manca un altro secondo
+    assert excinfo.value.retry_after == pytest.approx(1.0)
+
+    clock.now += 1.0
+    limiter.check("session:a")
+
+    # Il bucket non supera il burst, per quanto a lungo il client resti inattivo
+    clock.now += 3600
+    limiter.check("session:a")
+    limiter.check("session:a")
+    with pytest.raises(OverloadedError):
+        limiter.check("session:a")
+
+
+def test_buckets_are_per_client(clock):
+    limiter = ClientRateLimiter(requests_per_minute=60, burst=1)
+    limiter.check(client_key("a", "10.0.0.1"))
+    with pytest.raises(OverloadedError):
+        limiter.check(client_key("a", "10.0.0.2"))
+    limiter.check(client_key("b", "10.0.0.1"))
+    limiter.check(client_key(None, "10.0.0.1"))
+    with pytest.raises(OverloadedError):
+        limiter.check(client_key(None, "10.0.0.1"))
+    limiter.check(client_key(None, "10.0.0.2"))
+
+
+def test_least_recent_clients_are_dropped(clock):
+    limiter = ClientRateLimiter(requests_per_minute=60, burst=1, max_clients=2)
+    for key in ("a", "b", "c"):
+        limiter.check(key)
+    # Il bucket di "a" è stato scartato: riparte pieno
+    limiter.check("a")
+    with pytest.raises(OverloadedError):
+        limiter.check("c")
+
+
+def test_admission_rejects_beyond_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        running = asyncio.ensure_future(hold())
+        queued = asyncio.ensure_future(hold())
+        await asyncio.sleep(0.01)
+        assert (controller.active, controller.queued) == (1, 1)
+
+        with pytest.raises(OverloadedError) as excinfo:
+            async with controller.admit():
+                pass
+        assert excinfo.value.reason == "queue_full"
+
+        release.set()
+        await asyncio.gather(running, queued)
+        return controller.active, controller.queued
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+def test_admission_rejects_after_the_queue_timeout():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=5, queue_timeout=0.05)
+        async with controller.admit():
+            with pytest.raises(OverloadedError) as excinfo:
+                async with controller.admit():
+                    pass
+        assert excinfo.value.reason == "queue_timeout"
+        # Lo slot liberato è di nuovo disponibile
+        async with controller.admit():
+            return controller.active, controller.queued
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_query_beyond_the_queue_gets_429(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(settings, "QUERY_COALESCING_ENABLED", True)
+    monkeypatch.setattr(router_module, "admission_controller",
+                        AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5))
+    started, release = threading.Event(), threading.Event()
+
+    class Engine:
+        memory = None
+
+        def query(self, question, **kwargs):
+            started.set()
+            assert release.wait(5)
+            return {"answer": "ok", "source_documents": [], "condensed_question": question}
+
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api")
+    app.dependency_overrides[router_module.get_rag_engine] = Engine
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.ensure_future(client.post("/api/query", json={"query": "Prima domanda?"}))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            rejected = await client.post("/api/query", json={"query": "Seconda domanda?"})
+            release.set()
+            return await first, rejected
+
+    try:
+        first, rejected = asyncio.run(scenario())
+    finally:
+        release.set()
+        router_module.session_memories.clear()
+    assert first.status_code == 200
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == OverloadedError("queue_full", settings.OVERLOAD_RETRY_AFTER).retry_after_header
+
+
+def test_rate_limited_query_gets_429(monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(router_module, "rate_limiter", ClientRateLimiter(requests_per_minute=1, burst=0))
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api")
+    app.dependency_overrides[router_module.get_rag_engine] = lambda: None
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/query", json={"query": "Domanda?", "session_id": "a"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "60"
+
+
+def test_upstream_slots_are_bounded_per_upstream():
+    limiter = UpstreamLimiter({"cohere": 2, "qdrant": 1}, acquire_timeout=0.05)
+    with limiter.slot("cohere"), limiter.slot("cohere"):
+        assert limiter.in_flight() == {"cohere": 2, "qdrant": 0}
+        assert not limiter.try_acquire("cohere")
+        with pytest.raises(UpstreamBusyError) as excinfo:
+            with limiter.slot("cohere"):
+                pass
+        assert excinfo.value.reason == "upstream_busy_cohere"
+        # Un upstream saturo non blocca gli altri
+        with limiter.slot("qdrant"):
+            assert limiter.in_flight() == {"cohere": 2, "qdrant": 1}
+    assert limiter.in_flight() == {"cohere": 0, "qdrant": 0}
+
+
+def test_upstream_slot_is_released_on_error():
+    limiter = UpstreamLimiter({"qdrant": 1}, acquire_timeout=0.05)
+    with pytest.raises(ConnectionError):
+        with limiter.slot("qdrant"):
+            raise ConnectionError("down")
+    assert limiter.try_acquire("qdrant")
+    limiter.release("qdrant")
+    assert limiter.in_flight() == {"qdrant": 0}
+
+
+def test_upstream_slot_waits_for_a_release():
+    limiter = UpstreamLimiter({"openai_chat": 1}, acquire_timeout=5)
+    assert limiter.try_acquire("openai_chat")
+    timer = threading.Timer(0.05, limiter.release, args=("openai_chat",))
+    timer.start()
+    with limiter.slot("openai_chat"):
+        assert limiter.in_flight() == {"openai_chat": 1}
+    timer.join()
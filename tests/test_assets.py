@@ -0,0 +1,121 @@
+"""Tests of the in-memory frontend assets: encoding negotiation, ETag/304 and HEAD."""
+
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.api.assets import AssetStore, _accepted_encodings
+
+PAGE = ("<!DOCTYPE html><html><body>" + "<p>Croce Rossa Italiana</p>" * 200 + "</body></html>").encode()
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "index.html").write_bytes(PAGE)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG" + bytes(range(256)) * 4)
+    store = AssetStore()
+    store.load_file("/", str(tmp_path / "index.html"), "no-cache")
+    store.load_file("/static/logo.png", str(tmp_path / "logo.png"), "public, max-age=86400")
+    return store
+
+
+@pytest.fixture
+def client(store):
+    app = FastAPI()
+
+    @app.api_route("/{path:path}", methods=["GET", "HEAD"])
+    async def serve(request: Request, path: str):
+        return store.respond(request, store.get("/" + path))
+
+    return TestClient(app)
+
+
+def _get(client, path="/", method="GET", **headers):
+    return client.request(method, path, headers=headers)
+
+
+def test_gzip_variant_is_served_when_accepted(client):
+    response = _get(client, **{"Accept-Encoding": "gzip, deflate"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert response.content == PAGE
+
+
+def test_identity_when_gzip_is_refused(client, store):
+    for accept in ("identity", "gzip;q=0", "gzip; q=0.0, identity", ""):
+        response = _get(client, **{"Accept-Encoding": accept})
+        assert "Content-Encoding" not in response.headers, accept
+        assert response.headers["ETag"] == store.get("/").etag_for(None)
+        assert response.content == PAGE
+
+
+def test_brotli_is_preferred_when_available(client, store):
+    # Variante br fittizia (il pacchetto brotli può mancare): HEAD, il client non deve decodificarla
+    asset = store.get("/")
+    asset.encoded["br"] = b"br-variant"
+    response = _get(client, method="HEAD", **{"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["ETag"] == asset.etag_for("br")
+    assert response.headers["Content-Length"] == str(len(b"br-variant"))
+    response = _get(client, method="HEAD", **{"Accept-Encoding": "gzip, br;q=0"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_precompressed_types_are_not_encoded(client):
+    response = _get(client, "/static/logo.png", **{"Accept-Encoding": "gzip, br"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.headers["Cache-Control"] == "public, max-age=86400"
+
+
+def test_matching_etag_gets_304(client):
+    etag = _get(client, **{"Accept-Encoding": "gzip"}).headers["ETag"]
+    response = _get(client, **{"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    # Anche con un'altra codifica, un tag debole o un elenco la copia del client è valida
+    assert _get(client, **{"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 304
+    assert _get(client, **{"If-None-Match": "W/" + etag}).status_code == 304
+    assert _get(client, **{"If-None-Match": f'"vecchio", {etag}'}).status_code == 304
+    assert _get(client, **{"If-None-Match": "*"}).status_code == 304
+
+
+def test_stale_etag_gets_the_body(client):
+    response = _get(client, **{"Accept-Encoding": "gzip", "If-None-Match": '"vecchio-gzip"'})
+    assert response.status_code == 200
+    assert response.content == PAGE
+
+
+def test_head_has_the_headers_without_the_body(client):
+    get = _get(client, **{"Accept-Encoding": "gzip"})
+    head = _get(client, method="HEAD", **{"Accept-Encoding": "gzip"})
+    assert head.status_code == 200
+    assert head.content == b""
+    assert head.headers["ETag"] == get.headers["ETag"]
+    assert head.headers["Content-Encoding"] == "gzip"
+    assert int(head.headers["Content-Length"]) == len(gzip.compress(PAGE, compresslevel=9, mtime=0))
+
+
+def test_accepted_encodings():
+    assert _accepted_encodings("gzip, br;q=0.5, deflate;q=0") == {"gzip", "br"}
+    assert _accepted_encodings("GZIP;q=1.0") == {"gzip"}
+    assert _accepted_encodings("br;q=abc") == set()
+    assert _accepted_encodings("") == set()
+
+
+def test_app_middleware_does_not_compress_twice():
+    import main
+
+    client = TestClient(main.app)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    if response.status_code == 404:
+        pytest.skip("frontend index not available")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.text.lstrip().startswith("<!DOCTYPE html>")
@@ -0,0 +1,221 @@
+"""Tests of the upstream circuit breakers and of the fallbacks they trigger."""
+
+import types
+
+import pytest
+
+import app.core.circuit as circuit
+from app.core.admission import OverloadedError
+from app.core.circuit import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakers,
+    CircuitOpenError,
+    is_upstream_failure,
+)
+
+
+class FakeClock:
+    """Monotonic clock moved by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeStatusError(Exception):
+    """Stand-in for an SDK error carrying an HTTP status."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+# Confrontato per nome come gli errori degli SDK veri
+FakeStatusError.__module__ = "httpx"
+FakeStatusError.__qualname__ = "HTTPStatusError"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit, "time", types.SimpleNamespace(monotonic=fake.monotonic))
+    return fake
+
+
+def _fail(breaker: CircuitBreaker, error: Exception) -> None:
+    with pytest.raises(type(error)):
+        with breaker.guard():
+            raise error
+
+
+def _succeed(breaker: CircuitBreaker) -> None:
+    with breaker.guard():
+        pass
+
+
+def test_opens_after_consecutive_upstream_failures(clock):
+    breaker = CircuitBreaker("qdrant", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        _fail(breaker, ConnectionError("down"))
+    assert breaker.state == CLOSED
+    _fail(breaker, TimeoutError("slow"))
+    assert breaker.state == OPEN
+
+    clock.advance(10)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        _succeed(breaker)
+    assert excinfo.value.upstream == "qdrant"
+    assert excinfo.value.retry_after == pytest.approx(20)
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("qdrant", failure_threshold=2, reset_timeout=30)
+    _fail(breaker, ConnectionError("down"))
+    _succeed(breaker)
+    _fail(breaker, ConnectionError("down"))
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker("cohere", failure_threshold=1, reset_timeout=30)
+    _fail(breaker, ConnectionError("down"))
+    clock.advance(30)
+
+    with breaker.guard():
+        assert breaker.state == HALF_OPEN
+        # Una sola chiamata di prova alla volta
+        with pytest.raises(CircuitOpenError):
+            _succeed(breaker)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    _succeed(breaker)
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker("cohere", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        _fail(breaker, ConnectionError("down"))
+    clock.advance(31)
+
+    _fail(breaker, TimeoutError("still down"))
+    assert breaker.state == OPEN
+    assert breaker.opened_at == clock.now
+    with pytest.raises(CircuitOpenError) as excinfo:
+        _succeed(breaker)
+    assert excinfo.value.retry_after == pytest.approx(30)
+
+
+def test_local_errors_do_not_count(clock):
+    breaker = CircuitBreaker("openai_chat", failure_threshold=1, reset_timeout=30)
+    _fail(breaker, ValueError("bad json"))
+    _fail(breaker, KeyError("missing"))
+    _fail(breaker, FakeStatusError(400))
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_local_error_releases_the_probe(clock):
+    breaker = CircuitBreaker("openai_chat", failure_threshold=1, reset_timeout=30)
+    _fail(breaker, ConnectionError("down"))
+    clock.advance(30)
+
+    _fail(breaker, ValueError("bad json"))
+    assert breaker.state == HALF_OPEN
+    # La prova non ha detto nulla sull'upstream: ne passa un'altra
+    _succeed(breaker)
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_count_as_failures(clock):
+    breaker = CircuitBreaker("openai_embeddings", failure_threshold=2, reset_timeout=30, slow_call_seconds=5)
+    for _ in range(2):
+        with breaker.guard():
+            clock.advance(6)
+    assert breaker.state == OPEN
+
+
+@pytest.mark.parametrize("status, upstream", [
+    (400, False), (401, False), (404, False), (422, False),
+    (408, True), (429, True), (500, True), (503, True),
+])
+def test_upstream_failure_by_status(status, upstream):
+    assert is_upstream_failure(FakeStatusError(status)) is upstream
+
+
+def test_upstream_failure_by_type():
+    assert is_upstream_failure(ConnectionError("reset"))
+    assert is_upstream_failure(TimeoutError("timeout"))
+    assert not is_upstream_failure(RuntimeError("bug"))
+    assert not is_upstream_failure(CircuitOpenError("qdrant", 1.0))
+
+
+def test_circuit_open_is_an_overload():
+    error = CircuitOpenError("cohere", 12.5)
+    assert isinstance(error, OverloadedError)
+    assert error.retry_after == 12.5
+
+
+def test_disabled_breakers_never_open(clock):
+    breaker = CircuitBreaker("qdrant", failure_threshold=1, reset_timeout=30)
+    breakers = CircuitBreakers({"qdrant": breaker}, enabled=False)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            with breakers.guard("qdrant"):
+                raise ConnectionError("down")
+    assert breakers.states() == {"qdrant": CLOSED}
+
+
+def _open_breakers(*names: str) -> CircuitBreakers:
+    breakers = {}
+    for name in names:
+        breaker = CircuitBreaker(name, failure_threshold=1, reset_timeout=3600)
+        _fail(breaker, ConnectionError("down"))
+        breakers[name] = breaker
+    return CircuitBreakers(breakers)
+
+
+def test_open_cohere_keeps_the_retrieval_order(monkeypatch):
+    import app.rag.engine as engine_module
+    from app.core.deadline import Deadline
+    from app.rag.engine import RAGEngine
+
+    class Reranker:
+        def postprocess(self, nodes, query_str):
+            raise AssertionError("Cohere must not be called while its circuit is open")
+
+    monkeypatch.setattr(engine_module, "circuit_breakers", _open_breakers("cohere"))
+    engine = object.__new__(RAGEngine)
+    deadline = Deadline(0)
+
+    nodes = ["a", "b", "c", "d"]
+    assert engine._apply_reranking("domanda", nodes, deadline, reranker=Reranker(), top_n=2) == ["a", "b"]
+    assert deadline.degradations == ["rerank"]
+
+
+def test_stale_answer_fallback():
+    from app.core.deadline import Deadline
+    from app.rag.cache import VersionedCache
+    from app.rag.engine import RAGEngine
+    from app.rag.memory import ConversationMemory
+
+    engine = object.__new__(RAGEngine)
+    engine.memory = ConversationMemory()
+    engine.components = types.SimpleNamespace(
+        stale_answer_cache=VersionedCache("stale_answer_test", 10, 0, invalidate_on_swap=False))
+    key = ("cos'è il bls?", "", ())
+    engine.components.stale_answer_cache.set(key, {"answer": "Il BLS è...", "source_documents": []}, "v1")
+    deadline = Deadline(0)
+
+    assert engine._stale_answer("Cos'è il BLS?", ("altro", "", ()), deadline) is None
+    result = engine._stale_answer("Cos'è il BLS?", key, deadline)
+    assert result["answer"] == "Il BLS è..."
+    assert result["metadata"]["degradations"] == ["answer"]
+    assert engine.memory.get_history() == [("Cos'è il BLS?", "Il BLS è...")]
@@ -0,0 +1,171 @@
+"""Tests of query coalescing and idempotent replays on /api/query, with a fake engine."""
+
+import asyncio
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import app.api.router as router_module
+from app.api.coalescing import SingleFlight, coalescing_key, normalize_question, query_flight, replay_cache
+from app.core.config import settings
+
+
+class FakeEngine:
+    """Stand-in for RAGEngine: records its calls and answers once released."""
+
+    def __init__(self, calls, release):
+        self.calls = calls
+        self.release = release
+        self.memory = None
+
+    def query(self, question, include_prompt=False, scope=None, deadline=None, capture=None):
+        self.calls.append((question, id(self.memory)))
+        assert self.release.wait(5)
+        answer = f"Risposta a: {question}"
+        self.memory.add_exchange(question, answer)
+        return {"answer": answer, "source_documents": [], "condensed_question": question}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Return the app, the engine calls and the event releasing the engine."""
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(settings, "QUERY_COALESCING_ENABLED", True)
+    router_module.session_memories.clear()
+    replay_cache.clear()
+    calls, release = [], threading.Event()
+
+    app = FastAPI()
+    app.include_router(router_module.router, prefix="/api")
+    app.dependency_overrides[router_module.get_rag_engine] = lambda: FakeEngine(calls, release)
+    yield app, calls, release
+    router_module.session_memories.clear()
+    replay_cache.clear()
+
+
+async def _wait_for(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+async def _concurrent(app, calls, release, payloads):
+    """Send the payloads together, releasing the engine once they have all been received."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        tasks = [asyncio.ensure_future(client.post("/api/query", json=payload)) for payload in payloads]
+        await _wait_for(lambda: calls)
+        # Le altre richieste si accodano all'esecuzione in corso o ne avviano una propria
+        await asyncio.sleep(0.2)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+
+def test_standalone_question_is_shared_across_sessions(api):
+    app, calls, release = api
+    responses = asyncio.run(_concurrent(app, calls, release, [
+        {"query": "Come divento volontario?", "session_id": "a"},
+        {"query": "  come divento  VOLONTARIO? ", "session_id": "b"},
+    ]))
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(calls) == 1
+    assert responses[0].json()["answer"] == responses[1].json()["answer"]
+    # Ognuna riceve il proprio request_id
+    assert responses[0].json()["request_id"] != responses[1].json()["request_id"]
+    assert len(query_flight) == 0
+
+
+def test_follower_exchange_is_written_to_its_own_session(api):
+    app, calls, release = api
+    asyncio.run(_concurrent(app, calls, release, [
+        {"query": "Come divento volontario?", "session_id": "a"},
+        {"query": "come divento volontario?", "session_id": "b"},
+    ]))
+
+    memories = router_module.session_memories
+    assert memories["a"] is not memories["b"]
+    # Ogni sessione registra la domanda nella forma in cui l'ha posta, una sola volta
+    assert memories["a"].get_history() == [("Come divento volontario?", "Risposta a: Come divento volontario?")]
+    assert memories["b"].get_history() == [("come divento volontario?", "Risposta a: Come divento volontario?")]
+
+
+def test_question_with_history_is_not_shared(api):
+    app, calls, release = api
+    router_module.get_session_memory("a").add_exchange("Cos'è il BLS?", "Il BLS è...")
+    responses = asyncio.run(_concurrent(app, calls, release, [
+        {"query": "E quanto dura il corso?", "session_id": "a"},
+        {"query": "E quanto dura il corso?", "session_id": "b"},
+    ]))
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(calls) == 2
+    assert len(router_module.session_memories["a"].get_history()) == 2
+    assert len(router_module.session_memories["b"].get_history()) == 1
+
+
+def test_idempotent_retry_is_replayed(api):
+    app, calls, release = api
+    release.set()
+
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            payload = {"query": "Come divento volontario?", "session_id": "a", "idempotency_key": "k1"}
+            first = await client.post("/api/query", json=payload)
+            retry = await client.post("/api/query", json=payload)
+            other_session = await client.post("/api/query", json=dict(payload, session_id="b"))
+            return first, retry, other_session
+
+    first, retry, other_session = asyncio.run(send())
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.json() == first.json()
+    assert "Idempotent-Replayed" not in other_session.headers
+    # Il retry non riesegue la pipeline né scrive di nuovo nella memoria
+    assert len(calls) == 2
+    assert len(router_module.session_memories["a"].get_history()) == 1
+
+
+@pytest.mark.parametrize("has_history, shared", [(False, True), (True, False)])
+def test_coalescing_key_depends_on_history(has_history, shared):
+    key_a = coalescing_key("Come divento volontario?", "a", has_history, None, False)
+    key_b = coalescing_key("Come divento volontario?", "b", has_history, None, False)
+    assert (key_a == key_b) is shared
+    assert key_a[0] == ("standalone" if shared else "session")
+
+
+def test_coalescing_key_separates_scope_and_prompt():
+    base = coalescing_key("Domanda?", "a", False, {"sources": ["a.pdf"]}, False)
+    assert base == coalescing_key(" domanda? ", "b", False, {"sources": ["a.pdf"]}, False)
+    assert base != coalescing_key("Domanda?", "a", False, {"sources": ["b.pdf"]}, False)
+    assert base != coalescing_key("Domanda?", "a", False, {"sources": ["a.pdf"]}, True)
+    assert coalescing_key("Domanda?", None, True, None, False)[0] == "standalone"
+
+
+def test_normalize_question():
+    assert normalize_question("  Cos'è\til  BLS? ") == "cos'è il bls?"
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    async def scenario():
+        flight = SingleFlight()
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def work():
+            started.set()
+            await release.wait()
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("key", work))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        return await follower, len(flight)
+
+    assert asyncio.run(scenario()) == (("done", False), 0)
@@ -0,0 +1,89 @@
+"""Tests of the near-duplicate detection: MinHash signatures, LSH banding and group assignment."""
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.ingestion.dedup import DROP, TAG, DuplicateIndex, MinHasher, lsh_bands
+from app.ingestion.loader import Chunk
+from app.rag.filters import DUPLICATE_GROUP_KEY
+
+SECTION = ("Il volontario che intende partecipare alle attività di emergenza deve aver completato "
+           "il corso di formazione di base e il modulo di protezione civile previsto dal regolamento "
+           "nazionale, e deve essere iscritto al comitato territoriale competente da almeno sei mesi")
+OTHER = ("La sede del comitato di Milano organizza ogni anno una raccolta fondi per le attività "
+         "sociali rivolte alle persone senza dimora, con distribuzione di pasti caldi e coperte")
+
+
+def _chunk(file_key: str, text: str, **metadata) -> Chunk:
+    return Chunk(file_key, 0, text, dict(metadata, source=file_key))
+
+
+def test_signature_is_deterministic():
+    assert np.array_equal(MinHasher(64).signature(SECTION), MinHasher(64).signature(SECTION))
+    assert MinHasher(64).signature(SECTION).shape == (64,)
+
+
+def test_signature_agreement_estimates_similarity():
+    hasher = MinHasher(128)
+    near = SECTION.replace("sei mesi", "un anno")
+    assert np.mean(hasher.signature(SECTION) == hasher.signature(near)) > 0.7
+    assert np.mean(hasher.signature(SECTION) == hasher.signature(OTHER)) < 0.1
+
+
+@pytest.mark.parametrize("num_perm, threshold", [(128, 0.85), (128, 0.5), (16, 0.5), (64, 0.9)])
+def test_lsh_bands_split_the_signature_below_the_threshold(num_perm, threshold):
+    bands, rows = lsh_bands(num_perm, threshold)
+    assert bands * rows == num_perm
+    assert (1 / bands) ** (1 / rows) <= threshold
+
+
+def test_lsh_bands_pick_the_closest_split():
+    assert lsh_bands(128, 0.85) == (16, 8)
+    assert lsh_bands(16, 0.5) == (8, 2)
+
+
+def test_tag_mode_indexes_every_copy_with_its_metadata(monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_DEDUP_MODE", TAG)
+    index = DuplicateIndex("test", threshold=0.8, num_perm=64)
+    kept, duplicates = index.assign("regolamento.pdf", [_chunk("regolamento.pdf", SECTION)])
+    assert len(kept) == 1 and duplicates == 0
+
+    copy = _chunk("circolare_2024.pdf", SECTION, committee="Comitato di Roma", date="2024-05-10")
+    kept, duplicates = index.assign("circolare_2024.pdf", [copy, _chunk("circolare_2024.pdf", OTHER)])
+    assert duplicates == 1
+    assert kept[0] is copy and kept[0].metadata["committee"] == "Comitato di Roma"
+    assert copy.metadata[DUPLICATE_GROUP_KEY] == index.entries[0][2]
+    assert kept[1].metadata[DUPLICATE_GROUP_KEY] != copy.metadata[DUPLICATE_GROUP_KEY]
+
+
+def test_drop_mode_keeps_only_canonical_chunks(monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_DEDUP_MODE", DROP)
+    index = DuplicateIndex("test", threshold=0.8, num_perm=64)
+    index.assign("regolamento.pdf", [_chunk("regolamento.pdf", SECTION)])
+    kept, duplicates = index.assign("circolare.pdf", [_chunk("circolare.pdf", SECTION),
+                                                      _chunk("circolare.pdf", OTHER)])
+    assert duplicates == 1
+    assert [chunk.text for chunk in kept] == [OTHER]
+
+
+def test_removed_canonical_chunk_orphans_its_group():
+    index = DuplicateIndex("test", threshold=0.8, num_perm=64)
+    index.assign("a.pdf", [_chunk("a.pdf", SECTION)])
+    index.assign("b.pdf", [_chunk("b.pdf", SECTION)])
+    index.remove_file("a.pdf")
+    assert index.orphaned_files() == {"b.pdf"}
+
+    # Riletto, il chunk di b.pdf diventa il canonico del gruppo
+    kept, duplicates = index.assign("b.pdf", [_chunk("b.pdf", SECTION)])
+    assert duplicates == 0 and len(kept) == 1
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = DuplicateIndex("test")
+    index.assign("a.pdf", [_chunk("a.pdf", SECTION), _chunk("a.pdf", OTHER)])
+    path = str(tmp_path / "dedup.npz")
+    index.save(path)
+    loaded = DuplicateIndex.load(path, "test")
+    assert loaded is not None and loaded.entries == index.entries
+    assert DuplicateIndex.load(path, "another") is None
@@ -0,0 +1,78 @@
+"""Table-driven tests of the local follow-up detector on Italian questions."""
+
+import pytest
+
+from app.rag.followup import detect_follow_up
+
+PREVIOUS = ("Come mi iscrivo al corso base per volontari?",
+            "Puoi iscriverti al corso base dal portale GAIA, scegliendo il comitato più vicino.")
+
+THRESHOLD = 2.0
+
+# (domanda, è un follow-up, segnale atteso)
+CASES = [
+    # Domande autonome, anche al secondo turno
+    ("Quali sono i requisiti per donare il sangue?", False, None),
+    ("Come posso diventare soccorritore in ambulanza?", False, None),
+    ("E' possibile fare servizio civile in Croce Rossa?", False, None),
+    ("Dove si trova la sede del comitato di Torino?", False, None),
+    ("Quanto dura la formazione per operatore del trasporto infermi?", False, None),
+    ("La Croce Rossa organizza corsi di primo soccorso aziendale?", False, None),
+    ("Le donazioni alla Croce Rossa sono deducibili?", False, None),
+    # Connettivi in apertura
+    ("E per i minorenni come funziona l'iscrizione?", True, "continuation"),
+    ("Ma serve un certificato medico per iniziare?", True, "continuation"),
+    ("Invece per il servizio civile cosa devo fare?", True, "continuation"),
+    ("Quindi devo aspettare la chiamata del comitato?", True, "continuation"),
+    # Pronomi e dimostrativi
+    ("Quanto costa questo corso per i volontari?", True, "anaphora"),
+    ("Quella piattaforma funziona anche da smartphone?", True, "anaphora"),
+    ("Lo posso fare anche se lavoro a tempo pieno?", True, "anaphora"),
+    ("Quanti ne organizzano ogni anno a Milano?", True, "anaphora"),
+    # Pronomi enclitici
+    ("Posso frequentarlo anche online da casa?", True, "enclitic"),
+    ("Entro quando devo completarla la registrazione?", True, "enclitic"),
+    # Riferimenti alla conversazione
+    ("Come hai detto, il portale richiede lo SPID?", True, "conversation_reference"),
+    ("Il comitato di prima accetta iscrizioni tutto l'anno?", True, "conversation_reference"),
+    # Ellissi
+    ("E a Milano?", True, "ellipsis"),
+    ("Quanto costa?", True, "ellipsis"),
+    ("Perché?", True, "ellipsis"),
+    ("Dove?", True, "ellipsis"),
+]
+
+
+@pytest.mark.parametrize("question, follow_up, cue", CASES, ids=[case[0] for case in CASES])
+def test_detects_follow_ups(question, follow_up, cue):
+    decision = detect_follow_up(question, PREVIOUS, threshold=THRESHOLD)
+    assert decision.is_follow_up is follow_up, decision.cues
+    if cue is not None:
+        assert cue in decision.cues
+    else:
+        assert decision.score < THRESHOLD
+
+
+def test_short_question_overlapping_the_previous_exchange():
+    decision = detect_follow_up("Il portale GAIA è gratuito?", PREVIOUS, threshold=THRESHOLD)
+    assert decision.cues == ["overlap"]
+    assert not decision.is_follow_up
+    assert detect_follow_up("Il portale GAIA è gratuito?", PREVIOUS, threshold=1.0).is_follow_up
+
+
+def test_first_question_is_never_a_follow_up():
+    decision = detect_follow_up("E quanto costa?", None, threshold=THRESHOLD)
+    assert not decision.is_follow_up
+    assert decision.cues == []
+
+
+def test_empty_question():
+    assert not detect_follow_up("???", PREVIOUS, threshold=THRESHOLD).is_follow_up
+
+
+def test_same_input_same_decision():
+    first = detect_follow_up("Ma lo posso fare online?", PREVIOUS, threshold=THRESHOLD)
+    second = detect_follow_up("Ma lo posso fare online?", PREVIOUS, threshold=THRESHOLD)
+    assert first == second
+    assert first.cues == ["continuation", "anaphora", "ellipsis"]
+    assert first.score == 6.0
@@ -0,0 +1,111 @@
+"""Tests of the hedged calls: when a copy is started and which answer is used."""
+
+import threading
+import time
+
+import pytest
+
+from app.core.admission import UpstreamLimiter
+from app.rag.hedging import Hedger, LatencyWindow
+
+
+def _hedger(max_workers: int = 4, limiter=None, min_samples: int = 1) -> Hedger:
+    hedger = Hedger("test", percentile=50, min_delay=0.02, window_size=10, min_samples=min_samples,
+                    max_workers=max_workers, limiter=limiter)
+    hedger.latencies.add(0.02)
+    return hedger
+
+
+class Calls:
+    """Callable answering after the delays given for its successive calls."""
+
+    def __init__(self, *delays, error_on=()):
+        self.delays = list(delays)
+        self.error_on = set(error_on)
+        self.count = 0
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            index = self.count
+            self.count += 1
+            self.threads.append(threading.current_thread().name)
+        time.sleep(self.delays[index])
+        if index in self.error_on:
+            raise ConnectionError(f"call {index} failed")
+        return index
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(4)
+    for latency in (0.1, 0.2, 0.3, 0.4, 0.5):
+        window.add(latency)
+    assert len(window) == 4
+    assert window.percentile(50) == 0.4
+    assert LatencyWindow(4).percentile(50) is None
+
+
+def test_no_hedge_until_enough_samples():
+    hedger = _hedger(min_samples=5)
+    assert hedger.delay() is None
+    calls = Calls(0.1)
+    assert hedger.run(calls) == 0 and calls.count == 1
+
+
+def test_fast_call_is_not_hedged():
+    calls = Calls(0.0)
+    assert _hedger().run(calls) == 0
+    time.sleep(0.05)
+    assert calls.count == 1
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    calls = Calls(0.5, 0.0)
+    started_at = time.monotonic()
+    assert _hedger().run(calls) == 1
+    assert calls.count == 2
+    assert time.monotonic() - started_at < 0.3
+
+
+def test_primary_wins_when_it_answers_first():
+    calls = Calls(0.05, 0.5)
+    assert _hedger().run(calls) == 0
+    assert calls.count == 2
+
+
+def test_failed_copy_falls_back_to_the_other():
+    assert _hedger().run(Calls(0.05, 0.1, error_on={0})) == 1
+
+
+def test_error_raised_when_every_copy_fails():
+    with pytest.raises(ConnectionError):
+        _hedger().run(Calls(0.05, 0.05, error_on={0, 1}))
+
+
+def test_no_hedge_without_a_free_upstream_slot():
+    limiter = UpstreamLimiter({"test": 1}, 0.1)
+    calls = Calls(0.1, 0.0)
+    with limiter.slot("test"):
+        assert _hedger(limiter=limiter).run(calls) == 0
+    assert calls.count == 1
+    assert limiter.in_flight() == {"test": 0}
+
+
+def test_busy_workers_run_the_call_inline_without_queueing():
+    hedger = _hedger(max_workers=1)
+    blocker = threading.Event()
+    hedger._submit(lambda: blocker.wait(5))
+    calls = Calls(0.05, 0.0)
+    try:
+        assert hedger.run(calls) == 0
+        assert calls.threads == [threading.current_thread().name]
+    finally:
+        blocker.set()
+
+
+def test_latency_is_measured_from_the_start_of_the_call():
+    hedger = _hedger()
+    hedger.latencies = LatencyWindow(10)
+    hedger._timed(lambda: time.sleep(0.05))
+    assert 0.04 <= hedger.latencies.percentile(50) < 0.2
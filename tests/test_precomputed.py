@@ -0,0 +1,81 @@
+"""Tests of the precomputed answer store and of the question form it is built with."""
+
+import threading
+
+import numpy as np
+
+import app.rag.components as components_module
+import app.rag.precomputed as precomputed
+from app.rag.precomputed import PrecomputedAnswerStore, build_store
+from app.rag.spelling import SpellingIndex
+
+
+def _entry(question, search_question=None):
+    return {"question": question, "search_question": search_question, "answer": f"Risposta a: {question}",
+            "source_documents": [{"id": "1"}], "model": "small", "count": 3}
+
+
+def test_text_lookup_matches_the_original_and_the_corrected_form():
+    store = PrecomputedAnswerStore([_entry("Quando inizia la formazone?", "Quando inizia la formazione?")],
+                                   np.ones((1, 4)), "v1")
+    assert store.lookup_text("quando  inizia la FORMAZONE?")["question"] == "Quando inizia la formazone?"
+    assert store.lookup_text("Quando inizia la formazione?") is not None
+    assert store.lookup_text("Quando finisce la formazione?") is None
+
+
+def test_vector_lookup_threshold():
+    store = PrecomputedAnswerStore([_entry("a"), _entry("b")], np.array([[1.0, 0.0], [0.0, 1.0]]), "v1")
+    assert store.lookup_vector([0.1, 0.9], min_similarity=0.9)["question"] == "b"
+    assert store.lookup_vector([1.0, 1.0], min_similarity=0.9) is None
+    assert store.lookup_vector([1.0, 0.0, 0.0], min_similarity=0.0) is None
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / "precomputed.npz")
+    PrecomputedAnswerStore([_entry("Come divento volontario?")], np.array([[3.0, 4.0]]), "v1").save(path)
+    store = PrecomputedAnswerStore.load(path)
+    assert store.collection_name == "v1"
+    assert store.lookup_text("come divento volontario?")["answer"] == "Risposta a: Come divento volontario?"
+    assert store.lookup_vector([0.6, 0.8], min_similarity=0.99) is not None
+
+
+def test_build_embeds_the_form_used_online(monkeypatch):
+    spelling = SpellingIndex({"formazione": 25, "inizia": 10, "quando": 10})
+    loaded = threading.Event()
+
+    class Components:
+        collection_version = type("Version", (), {"current": staticmethod(lambda: "v1")})()
+
+        def __init__(self):
+            self.spelling = None
+            self.spelling_loader = threading.Thread(target=self._load)
+            self.spelling_loader.start()
+
+        def _load(self):
+            assert loaded.wait(5)
+            self.spelling = spelling
+
+    embedded = []
+
+    class Engine(precomputed.RAGEngine):
+        def __init__(self, memory, components):
+            self.memory = memory
+            self.components = components
+
+        def query(self, question, **kwargs):
+            return {"answer": "ok", "source_documents": [{"id": "1"}], "metadata": {"model": "small"}}
+
+        def _embed_query(self, query, version):
+            embedded.append((query, version))
+            return [1.0, 0.0]
+
+    components = Components()
+    monkeypatch.setattr(components_module, "get_components", lambda: components)
+    monkeypatch.setattr(precomputed, "RAGEngine", Engine)
+    loaded.set()
+
+    store = build_store([("Quando inizia la formazone?", 4)])
+    # Il job attende il vocabolario e incorpora la domanda corretta, come la ricerca online
+    assert embedded == [("Quando inizia la formazione?", "v1")]
+    assert store.entries[0]["search_question"] == "Quando inizia la formazione?"
+    assert store.lookup_text("Quando inizia la formazione?") is store.entries[0]
@@ -0,0 +1,37 @@
+"""Tests of the answer prompt layout used by the provider-side prompt caching."""
+
+from llama_index.core.utils import get_tokenizer
+
+from app.rag.prompts import RAG_PROMPT, SYSTEM_PROMPT
+
+# Soglia del prompt caching di OpenAI, con margine: o200k usa meno token di cl100k sull'italiano
+CACHE_MIN_TOKENS = 1024
+TOKENIZER_MARGIN = 1.2
+
+
+def test_stable_prefix_exceeds_the_caching_threshold():
+    stable_prefix = SYSTEM_PROMPT + RAG_PROMPT.split("{context}")[0]
+    assert len(get_tokenizer()(stable_prefix)) >= CACHE_MIN_TOKENS * TOKENIZER_MARGIN
+
+
+def test_volatile_fields_follow_the_documents():
+    assert RAG_PROMPT.index("{context}") < RAG_PROMPT.index("{chat_history}") < RAG_PROMPT.index("{question}")
+    assert "{" not in SYSTEM_PROMPT
+
+
+def test_documents_keep_the_relevance_order():
+    from llama_index.core.prompts import PromptTemplate
+    from llama_index.core.schema import NodeWithScore, TextNode
+
+    from app.rag.engine import RAGEngine
+    from app.rag.memory import ConversationMemory
+
+    engine = object.__new__(RAGEngine)
+    engine.qa_prompt = PromptTemplate(RAG_PROMPT)
+    engine.memory = ConversationMemory()
+    nodes = [
+        NodeWithScore(node=TextNode(text="pagina 10", metadata={"source": "a.pdf", "page": 10}), score=0.9),
+        NodeWithScore(node=TextNode(text="pagina 2", metadata={"source": "a.pdf", "page": 2}), score=0.5),
+    ]
+    prompt = engine._build_answer_prompt("Domanda?", nodes)
+    assert prompt.index("Documento 1:\npagina 10") < prompt.index("Documento 2:\npagina 2")
@@ -0,0 +1,93 @@
+"""Tests of the query-complexity model router at its thresholds."""
+
+import types
+
+import pytest
+
+from app.core.config import settings
+from app.rag.routing import LARGE, SMALL, route_query, simple_decision
+
+
+@pytest.fixture(autouse=True)
+def routing_settings(monkeypatch):
+    for name, value in {
+        "MODEL_ROUTING_ENABLED": True,
+        "ROUTING_COMPLEX_THRESHOLD": 2.0,
+        "ROUTING_LONG_QUESTION_WORDS": 25,
+        "ROUTING_MIN_CONFIDENCE": 0.5,
+        "ROUTING_RELEVANT_SCORE": 0.3,
+        "ROUTING_MULTI_DOCUMENT_SOURCES": 3,
+        "ROUTING_DEEP_FOLLOW_UP": 3,
+        "LLM_MODEL": "large-model",
+        "LLM_SMALL_MODEL": "small-model",
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+
+
+def _node(score, source="statuto.pdf"):
+    return types.SimpleNamespace(score=score, metadata={"source": source})
+
+
+def _question(words):
+    return " ".join(["parola"] * words)
+
+
+CONFIDENT = [_node(0.9)]
+
+
+@pytest.mark.parametrize("words, long_question", [(24, False), (25, True)])
+def test_long_question_threshold(words, long_question):
+    decision = route_query(_question(words), CONFIDENT)
+    assert ("long_question" in decision.cues) is long_question
+    # Da sola la lunghezza non basta per il modello grande
+    assert decision.tier == SMALL
+
+
+@pytest.mark.parametrize("best_score, tier", [(0.49, LARGE), (0.5, SMALL)])
+def test_confidence_threshold(best_score, tier):
+    decision = route_query("Chi può donare il sangue?", [_node(best_score), _node(0.1)])
+    assert decision.tier == tier
+    assert ("low_confidence" in decision.cues) is (tier == LARGE)
+
+
+def test_confidence_is_only_judged_on_rerank_scores():
+    decision = route_query("Chi può donare il sangue?", [_node(0.2)], reranked=False)
+    assert "low_confidence" not in decision.cues
+
+
+@pytest.mark.parametrize("sources, tier", [(2, SMALL), (3, LARGE)])
+def test_multi_document_threshold(sources, tier):
+    nodes = [_node(0.8, f"documento-{i}.pdf") for i in range(sources)]
+    decision = route_query("Quali sono i compiti del presidente?", nodes)
+    assert decision.tier == tier
+    assert decision.model == ("large-model" if tier == LARGE else "small-model")
+
+
+def test_irrelevant_chunks_do_not_count_as_sources():
+    nodes = [_node(0.8, "a.pdf"), _node(0.6, "b.pdf"), _node(0.29, "c.pdf"), _node(0.1, "d.pdf")]
+    assert route_query("Quali sono i compiti del presidente?", nodes).tier == SMALL
+    nodes[2] = _node(0.3, "c.pdf")
+    assert route_query("Quali sono i compiti del presidente?", nodes).cues == ["multi_document"]
+
+
+@pytest.mark.parametrize("history_depth, condensed, deep", [(2, True, False), (3, True, True), (5, False, False)])
+def test_deep_follow_up_threshold(history_depth, condensed, deep):
+    decision = route_query("E quanto dura?", CONFIDENT, history_depth=history_depth, condensed=condensed)
+    assert ("deep_follow_up" in decision.cues) is deep
+
+
+def test_weak_cues_add_up_to_the_threshold():
+    decision = route_query(_question(30), CONFIDENT, history_depth=4, condensed=True)
+    assert decision.cues == ["long_question", "deep_follow_up"]
+    assert decision.score == 2.0
+    assert decision.tier == LARGE
+
+
+def test_routing_disabled_always_uses_the_large_model(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_ROUTING_ENABLED", False)
+    assert route_query("Chi può donare il sangue?", CONFIDENT).model == "large-model"
+    assert simple_decision().model == "large-model"
+
+
+def test_simple_decision_uses_the_small_model():
+    assert simple_decision().model == "small-model"
@@ -0,0 +1,78 @@
+"""Tests of the corpus spelling index: typos are corrected, inflections and names are kept."""
+
+import threading
+
+import app.rag.components as components_module
+from app.rag.components import RAGComponents
+from app.rag.spelling import SpellingIndex
+
+VOCABULARY = {
+    "iscriversi": 12, "volontario": 30, "formazione": 25, "corso": 40,
+    "soccorso": 18, "marzo": 9, "giorno": 7, "posso": 5,
+}
+
+
+def _index() -> SpellingIndex:
+    return SpellingIndex(VOCABULARY)
+
+
+def test_corrects_typos():
+    index = _index()
+    assert index.correct("Quando inizia la formazone?") == "Quando inizia la formazione?"
+    assert index.correct("corso di primo soccoso") == "corso di primo soccorso"
+
+
+def test_keeps_inflections():
+    index = _index()
+    assert index.correct("Posso iscrivermi al corso?") == "Posso iscrivermi al corso?"
+    assert index.suggest("volontari") is None
+    assert index.suggest("formazioni") is None
+
+
+def test_keeps_names():
+    index = _index()
+    assert index.suggest("marco") is None
+    assert index.correct("Marco ha 17 anni") == "Marco ha 17 anni"
+    assert index.correct("Chiedo per Marco, è maggiorenne") == "Chiedo per Marco, è maggiorenne"
+
+
+def test_keeps_known_and_short_words():
+    index = _index()
+    assert index.suggest("corso") is None
+    assert index.suggest("corsi") is None
+
+
+
+class _Version:
+    """Collection version tracker stub."""
+
+    def __init__(self, version: str):
+        self.version = version
+
+
+def _components(version: str) -> RAGComponents:
+    components = object.__new__(RAGComponents)
+    components.qdrant_client = None
+    components.collection_version = _Version(version)
+    components.spelling = None
+    return components
+
+
+def test_components_load_the_index_in_background(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(components_module, "load_spelling_index", lambda client, name: release.wait(5) and _index())
+    components = _components("cri_v1")
+
+    thread = components._reload_spelling(None, "cri_v1")
+    assert components.spelling is None
+    release.set()
+    thread.join(5)
+    assert components.spelling is not None
+
+
+def test_stale_background_load_is_discarded(monkeypatch):
+    monkeypatch.setattr(components_module, "load_spelling_index", lambda client, name: _index())
+    components = _components("cri_v2")
+
+    components._reload_spelling(None, "cri_v1").join(5)
+    assert components.spelling is None
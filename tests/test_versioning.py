@@ -0,0 +1,181 @@
+"""Tests of versioned collections: alias swap, resume of an interrupted build, pruning."""
+
+import itertools
+import json
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+import app.ingestion.pipeline as pipeline_module
+from app.core.config import settings
+from app.ingestion.pipeline import IngestionPipeline
+from app.rag.versioning import CollectionVersionTracker, list_versions, prune_versions, resolve_alias, swap_alias
+
+ALIAS = "documenti"
+DIMENSIONS = 4
+
+
+class FakeEmbedder:
+    """Deterministic embedder that can fail on a given call, like an interrupted run."""
+
+    def __init__(self, fail_on_call=None):
+        self.fail_on_call = fail_on_call
+        self.calls = 0
+        self.texts = []
+
+    def embed(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise ConnectionError("embedding service unreachable")
+        self.texts.extend(texts)
+        return [[1.0, float(len(text)), 0.5, 0.25] for text in texts]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def ingest(monkeypatch, tmp_path):
+    """Return a factory of pipelines on an in-memory Qdrant, one file per chunk, two chunks per window."""
+    for name, value in {
+        "EMBEDDING_DIMENSIONS": DIMENSIONS,
+        "QDRANT_VECTOR_MODE": "single",
+        "INGEST_EMBED_BATCH_SIZE": 1,
+        "INGEST_EMBED_CONCURRENCY": 1,
+        "INGEST_DEDUP_ENABLED": False,
+        "SPELLING_ENABLED": False,
+        "PRECOMPUTED_ENABLED": False,
+    }.items():
+        monkeypatch.setattr(settings, name, value)
+    # Versioni distinte anche per build nello stesso secondo
+    counter = itertools.count(1)
+    monkeypatch.setattr(pipeline_module, "versioned_name", lambda alias: f"{alias}_v{next(counter):04d}")
+
+    client = QdrantClient(":memory:")
+    root = tmp_path / "documenti"
+    root.mkdir()
+    manifest_path = str(tmp_path / "manifest.json")
+
+    def make(embedder=None):
+        return IngestionPipeline(str(root), collection_name=ALIAS, manifest_path=manifest_path, client=client,
+                                 embedder=embedder or FakeEmbedder(), new_version=True)
+
+    make.client, make.root, make.manifest_path = client, root, manifest_path
+    return make
+
+
+def _write(root, files):
+    for name, text in files.items():
+        (root / name).write_text(text, encoding="utf-8")
+
+
+def _count(client, collection):
+    return client.count(collection, exact=True).count
+
+
+FILES = {f"doc{i}.txt": f"Documento numero {i} sulle attività del comitato." for i in range(1, 7)}
+
+
+def test_build_swaps_the_alias_and_copies_unchanged_chunks(ingest):
+    _write(ingest.root, FILES)
+    stats = ingest().run()
+    assert stats["collection"] == "documenti_v0001"
+    assert stats["previous_collection"] is None
+    assert resolve_alias(ingest.client, ALIAS) == "documenti_v0001"
+
+    (ingest.root / "doc1.txt").write_text("Testo aggiornato del documento uno.", encoding="utf-8")
+    embedder = FakeEmbedder()
+    stats = ingest(embedder).run()
+    assert stats["previous_collection"] == "documenti_v0001"
+    assert resolve_alias(ingest.client, ALIAS) == "documenti_v0002"
+    # Solo il file cambiato passa per l'embedding, gli altri chunk copiano il vettore salvato
+    assert embedder.texts == ["Testo aggiornato del documento uno."]
+    assert stats["chunks_refreshed"] == 5
+    assert _count(ingest.client, "documenti_v0002") == 6
+    # La versione precedente resta intatta fino alla pulizia
+    assert _count(ingest.client, "documenti_v0001") == 6
+    with open(ingest.manifest_path, encoding="utf-8") as f:
+        assert "building" not in json.load(f)
+
+
+def test_interrupted_build_is_resumed(ingest):
+    _write(ingest.root, FILES)
+    ingest().run()
+
+    for name in FILES:
+        (ingest.root / name).write_text(FILES[name] + " Revisione 2.", encoding="utf-8")
+    # Terza finestra: le prime due (quattro file) sono già scritte nella nuova versione
+    with pytest.raises(ConnectionError):
+        ingest(FakeEmbedder(fail_on_call=3)).run()
+    assert resolve_alias(ingest.client, ALIAS) == "documenti_v0001"
+    with open(ingest.manifest_path, encoding="utf-8") as f:
+        building = json.load(f)["building"]
+    assert building["source"] == "documenti_v0001"
+    assert len(building["files"]) == 2
+
+    embedder = FakeEmbedder()
+    pipeline = ingest(embedder)
+    assert pipeline.resuming
+    assert pipeline.collection_name == "documenti_v0002"
+    stats = pipeline.run()
+    assert stats["files_unchanged"] == 2
+    assert len(embedder.texts) == 4
+    assert resolve_alias(ingest.client, ALIAS) == "documenti_v0002"
+    assert _count(ingest.client, "documenti_v0002") == 6
+
+
+def test_unfinished_build_is_not_resumed_after_the_alias_moved(ingest):
+    _write(ingest.root, FILES)
+    ingest().run()
+    (ingest.root / "doc1.txt").write_text("Testo aggiornato.", encoding="utf-8")
+    ingest().run(swap=False)
+    assert resolve_alias(ingest.client, ALIAS) == "documenti_v0001"
+
+    # Un'altra build sposta l'alias: la versione incompleta parte da dati superati
+    swap_alias(ingest.client, ALIAS, "documenti_v0002")
+    pipeline = ingest()
+    assert not pipeline.resuming
+    assert pipeline.collection_name == "documenti_v0003"
+
+
+def _create(client, *names):
+    for name in names:
+        client.create_collection(name, vectors_config=rest.VectorParams(size=DIMENSIONS, distance=rest.Distance.COSINE))
+
+
+def test_prune_keeps_the_current_and_newest_versions():
+    client = QdrantClient(":memory:")
+    _create(client, "documenti_v0001", "documenti_v0002", "documenti_v0003", "documenti_v0004", "altra_v0001")
+    swap_alias(client, ALIAS, "documenti_v0003")
+
+    deleted = prune_versions(client, ALIAS, keep=2, keep_unfinished=True)
+    assert deleted == ["documenti_v0001"]
+    assert list_versions(client, ALIAS) == ["documenti_v0002", "documenti_v0003", "documenti_v0004"]
+
+    # Senza keep_unfinished la versione più recente dell'alias, mai attivata, viene eliminata
+    deleted = prune_versions(client, ALIAS, keep=1)
+    assert deleted == ["documenti_v0002", "documenti_v0004"]
+    assert list_versions(client, ALIAS) == ["documenti_v0003"]
+    assert client.collection_exists("altra_v0001")
+
+
+def test_swap_refuses_a_collection_named_as_the_alias():
+    client = QdrantClient(":memory:")
+    _create(client, ALIAS, "documenti_v0001")
+    with pytest.raises(ValueError):
+        swap_alias(client, ALIAS, "documenti_v0001")
+
+
+def test_tracker_reports_the_swap():
+    client = QdrantClient(":memory:")
+    _create(client, "documenti_v0001", "documenti_v0002")
+    swap_alias(client, ALIAS, "documenti_v0001")
+    tracker = CollectionVersionTracker(client, alias=ALIAS, check_interval=0)
+    changes = []
+    tracker.on_change(lambda old, new: changes.append((old, new)))
+
+    assert tracker.current() == "documenti_v0001"
+    swap_alias(client, ALIAS, "documenti_v0002")
+    assert tracker.current() == "documenti_v0002"
+    assert changes == [("documenti_v0001", "documenti_v0002")]
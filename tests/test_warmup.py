@@ -0,0 +1,98 @@
+"""Tests of the startup warm-up: the warm-up query goes through the engine and fills its caches."""
+
+import types
+
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+import app.rag.components as components_module
+import app.rag.engine as engine_module
+import app.rag.warmup as warmup
+from app.core.circuit import CircuitBreakers
+from app.core.config import settings
+from app.rag.cache import VersionedCache
+from app.rag.engine import RAGEngine
+from app.rag.warmup import WarmupState
+
+
+class EmbedModel:
+    def __init__(self):
+        self.calls = 0
+
+    def get_query_embedding(self, query):
+        self.calls += 1
+        return [0.1, 0.2, 0.3]
+
+
+class Retriever:
+    def __init__(self, error=None):
+        self.error = error
+        self.queries = []
+
+    def retrieve(self, query_bundle):
+        self.queries.append(query_bundle)
+        if self.error is not None:
+            raise self.error
+        return [NodeWithScore(node=TextNode(text="Il BLS è il supporto vitale di base."), score=0.9)]
+
+
+class UnreachableQdrant:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("Qdrant unreachable")
+        return fail
+
+
+def _components(retriever, qdrant_client=None):
+    chat_client = types.SimpleNamespace(models=types.SimpleNamespace(retrieve=lambda model: model))
+    return types.SimpleNamespace(
+        llm=types.SimpleNamespace(_get_client=lambda: chat_client),
+        small_llm=None, condensation_llm=None, index=None, reranker=None, use_reranker=False,
+        condense_question_prompt=None, qa_prompt=None, no_context_prompt=None,
+        embed_model=EmbedModel(), qdrant_client=qdrant_client or UnreachableQdrant(), retriever=retriever,
+        collections=None, spelling=None,
+        collection_version=types.SimpleNamespace(current=lambda: "v1"),
+        embedding_cache=VersionedCache("embedding_test", 10, 0, invalidate_on_swap=False),
+        retrieval_cache=VersionedCache("retrieval_test", 10, 0, invalidate_on_swap=False),
+    )
+
+
+@pytest.fixture
+def state(monkeypatch):
+    state = WarmupState()
+    monkeypatch.setattr(warmup, "warmup_state", state)
+    monkeypatch.setattr(engine_module, "circuit_breakers", CircuitBreakers({}, enabled=False))
+    monkeypatch.setattr(settings, "QDRANT_VECTOR_MODE", "single")
+    monkeypatch.setattr(settings, "QDRANT_SCORE_THRESHOLD", None)
+    monkeypatch.setattr(settings, "WARMUP_INCLUDE_RERANK", False)
+    return state
+
+
+def test_warmup_query_fills_the_engine_caches(monkeypatch, state):
+    retriever = Retriever()
+    components = _components(retriever)
+    monkeypatch.setattr(components_module, "get_components", lambda: components)
+
+    warmup._warmup_pass()
+
+    assert state.status == "ready"
+    assert components.embedding_cache.get(settings.WARMUP_QUERY, "v1") == [0.1, 0.2, 0.3]
+    assert len(retriever.queries) == 1
+    key = RAGEngine.retrieval_key(settings.WARMUP_QUERY, "", settings.RETRIEVAL_TOP_K, ())
+    cached = components.retrieval_cache.get(key, "v1")
+    assert [node.node.text for node in cached] == ["Il BLS è il supporto vitale di base."]
+
+    # Un secondo passaggio non richiama l'embedding: è in cache come per le query dal vivo
+    warmup._warmup_pass()
+    assert components.embed_model.calls == 1
+
+
+def test_unreachable_qdrant_fails_the_warmup(monkeypatch, state):
+    components = _components(Retriever(error=ConnectionError("Qdrant unreachable")))
+    monkeypatch.setattr(components_module, "get_components", lambda: components)
+
+    warmup._warmup_pass()
+
+    assert state.status == "failed"
+    assert state.failed_dependencies() == ["qdrant"]
+    assert len(components.retrieval_cache) == 0